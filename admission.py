@@ -0,0 +1,187 @@
+# admission.py
+# Admission control in front of the Flask app. Requests are split into two
+# classes with their own concurrency limit and bounded queue:
+#   read   GET/HEAD/OPTIONS served from the caches
+#   write  everything that waits on the database (and its write lock): other
+#          methods, plus reads of routes under DATABASE_PATHS such as /search
+# so a pile-up of PUTs or searches can only exhaust the write slots, never the
+# read ones.
+#
+# A request that can't get a slot waits in its class's queue until its deadline:
+# arrival plus the class's queue timeout, or sooner if the client sent
+# X-Request-Timeout (seconds). Arrival is taken from X-Request-Start when a
+# proxy sets it, so time spent queued upstream counts too; a request that is
+# already past its deadline on arrival is shed without queueing. Shed requests
+# get an immediate 503 with a Retry-After estimated from queue depth and
+# recent service times.
+import json
+import math
+import threading
+import time
+
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import ClosingIterator
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DEFAULT_LIMITS = {
+    'read': {'concurrency': 32, 'queue': 128, 'timeout': 1.0},
+    'write': {'concurrency': 4, 'queue': 32, 'timeout': 5.0},
+}
+# Long-polls and probes hold or need no slot
+EXEMPT_PATHS = ('/changes', '/live', '/ready')
+# Routes whose reads query a database rather than the caches
+DATABASE_PATHS = ('/search', '/jobs')
+# Weight of the newest sample in the service-time moving average
+SERVICE_TIME_ALPHA = 0.1
+
+
+class AdmissionGate:
+    """Concurrency limit plus a bounded queue for one class of requests."""
+
+    def __init__(self, name, concurrency, queue, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._cond = threading.Condition()
+        self._service_time = None
+        self.stats = {
+            'admitted': 0,
+            'queued_total': 0,
+            'max_queue_depth': 0,
+            'shed_queue_full': 0,
+            'shed_deadline': 0,
+            'queue_wait_ms_total': 0.0,
+        }
+
+    def acquire(self, deadline):
+        """Take a slot, waiting until ``deadline`` (monotonic); returns None or why the request was shed."""
+        with self._cond:
+            now = time.monotonic()
+            if now >= deadline:
+                self.stats['shed_deadline'] += 1
+                return 'deadline'
+            # Newcomers don't overtake requests already queued
+            if self.in_flight < self.concurrency and self.queued == 0:
+                self.in_flight += 1
+                self.stats['admitted'] += 1
+                return None
+            if self.queued >= self.queue_size:
+                self.stats['shed_queue_full'] += 1
+                return 'queue_full'
+            self.queued += 1
+            self.stats['queued_total'] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queued)
+            try:
+                while self.in_flight >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['shed_deadline'] += 1
+                        return 'deadline'
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.stats['admitted'] += 1
+                self.stats['queue_wait_ms_total'] += (time.monotonic() - now) * 1000
+                return None
+            finally:
+                self.queued -= 1
+
+    def release(self, service_time):
+        with self._cond:
+            self.in_flight -= 1
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time += SERVICE_TIME_ALPHA * (service_time - self._service_time)
+            # Wake every waiter: one woken alone could be timing out and leave the slot idle
+            self._cond.notify_all()
+
+    def retry_after(self):
+        """Whole seconds until the current queue should have drained, at least 1."""
+        service_time = self._service_time or 0.0
+        return max(1, math.ceil((self.queued + 1) * service_time / self.concurrency))
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'timeout': self.timeout,
+                'in_flight': self.in_flight,
+                'queue_depth': self.queued,
+                'service_time_ms': None if self._service_time is None else round(self._service_time * 1000, 3),
+                **self.stats
+            }
+
+
+def _arrival(environ, now, wall_now):
+    """Monotonic arrival time, moved back by any queueing a proxy recorded in X-Request-Start."""
+    start = environ.get('HTTP_X_REQUEST_START', '')
+    if start.startswith('t='):
+        start = start[2:]
+    try:
+        started = float(start)
+    except ValueError:
+        return now
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    while started > wall_now * 10:
+        started /= 1000
+    return now - max(0.0, wall_now - started)
+
+
+class AdmissionControl:
+    """WSGI middleware that admits, queues or sheds each request before the app sees it."""
+
+    def __init__(self, wsgi_app, limits=None, exempt_paths=EXEMPT_PATHS, database_paths=DATABASE_PATHS):
+        self.wsgi_app = wsgi_app
+        self.exempt_paths = exempt_paths
+        self.database_paths = database_paths
+        self.gates = {name: AdmissionGate(name, **options) for name, options in (limits or DEFAULT_LIMITS).items()}
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.exempt_paths):
+            return self.wsgi_app(environ, start_response)
+        cached = environ.get('REQUEST_METHOD') in READ_METHODS and not path.startswith(self.database_paths)
+        gate = self.gates['read' if cached else 'write']
+        now, wall_now = time.monotonic(), time.time()
+        deadline = _arrival(environ, now, wall_now) + gate.timeout
+        try:
+            deadline = min(deadline, now + float(environ['HTTP_X_REQUEST_TIMEOUT']))
+        except (KeyError, ValueError):
+            pass
+        reason = gate.acquire(deadline)
+        if reason is not None:
+            return self._shed(gate, reason)(environ, start_response)
+        started = time.monotonic()
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            gate.release(time.monotonic() - started)
+            raise
+        # Hold the slot until the body has been sent, not just until the view returned
+        return ClosingIterator(app_iter, [lambda: gate.release(time.monotonic() - started)])
+
+    def _shed(self, gate, reason):
+        body = json.dumps({'error': 'Server is overloaded, retry later', 'class': gate.name, 'reason': reason})
+        return Response(body, status=503, mimetype='application/json',
+                        headers={'Retry-After': str(gate.retry_after())})
+
+    def stats(self):
+        return {name: gate.snapshot() for name, gate in self.gates.items()}
+
+
+def init_admission(app):
+    if not app.config.get('ADMISSION_CONTROL'):
+        return
+    limits = {}
+    for name, defaults in DEFAULT_LIMITS.items():
+        limits[name] = {
+            option: app.config.get(f'ADMISSION_{name.upper()}_{option.upper()}', default)
+            for option, default in defaults.items()
+        }
+    app.admission = AdmissionControl(app.wsgi_app, limits, tuple(app.config.get('ADMISSION_EXEMPT_PATHS', EXEMPT_PATHS)),
+                                     tuple(app.config.get('ADMISSION_DATABASE_PATHS', DATABASE_PATHS)))
+    app.wsgi_app = app.admission
@@ -0,0 +1,48 @@
+# bench_app.py
+# Helpers shared by the benchmark scripts: a Flask app over a throwaway SQLite
+# database seeded with synthetic rows. Run benchmarks from the repo root, e.g.
+#   python -m benchmarks.cache_write_stress
+import os
+import tempfile
+
+from flask import Flask
+from sqlalchemy import insert
+
+from database import check_schema, db, init_db
+from cache import init_cache
+from models.employee import Employee
+from models.department import Department
+from models.location import Location
+
+
+def make_app(employees=1000, departments=None, locations=None, db_path=None, config=None):
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    departments = departments or max(employees // 50, 1)
+    locations = locations or max(departments // 10, 1)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config.update(config or {})
+    init_db(app)
+    check_schema(app)
+    init_cache(app)
+    with app.app_context():
+        if db.session.query(Employee.id).first() is None:
+            seed(locations, departments, employees)
+    return app
+
+
+def seed(locations, departments, employees, batch_size=50000):
+    db.session.execute(insert(Location), [
+        {'id': i, 'name': f'Location {i}'} for i in range(1, locations + 1)
+    ])
+    db.session.execute(insert(Department), [
+        {'id': i, 'name': f'Department {i}', 'location_id': i % locations + 1} for i in range(1, departments + 1)
+    ])
+    for start in range(1, employees + 1, batch_size):
+        db.session.execute(insert(Employee), [
+            {'id': i, 'name': f'Employee {i}', 'department_id': i % departments + 1}
+            for i in range(start, min(start + batch_size, employees + 1))
+        ])
+    db.session.commit()
@@ -0,0 +1,206 @@
+# cache_load_scaling.py
+# How load_cache's table build scales with the number of employees, for the ORM
+# path (query.all() + per-object copy) and the streamed Core path (select()
+# with yield_per, consumed partition by partition).
+#
+#   python -m benchmarks.cache_load_scaling
+#   python -m benchmarks.cache_load_scaling --sizes 10000,100000,1000000,10000000 --output benchmarks/results/cache_load_scaling.md
+#
+# Each (size, mode) runs in a fresh subprocess so peak RSS is that run's alone;
+# its address space is capped at --memory-limit-mb so a size that doesn't fit
+# is reported as out of memory instead of waking the OOM killer.
+# Seeded databases are kept in --data-dir and reused across runs. Reported:
+#   wall    seconds spent in build_tables()
+#   rss     peak RSS growth over the process's RSS just before the load
+#   blocks  live allocator blocks added by the load (sys.getallocatedblocks)
+#   traced  tracemalloc peak during the load, only with --tracemalloc (slow)
+# A size is flagged superlinear when wall time or RSS grows faster than
+# rows ** --superlinear-exponent between it and the previous size (pairs whose
+# smaller measurement is under NOISE_FLOOR aren't judged).
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = (10000, 100000, 1000000)
+MODES = ('orm', 'core')
+SUPERLINEAR_EXPONENT = 1.15
+# Below these, timer and page-granularity noise swamps the scaling exponent
+NOISE_FLOOR = {'wall_s': 0.05, 'rss_mb': 8.0}
+
+
+def _rss_now_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _db_path(data_dir, size):
+    return os.path.join(data_dir, f'employees-{size}.db')
+
+
+def _memory_total_mb():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) // 1024
+
+
+def _run_child(size, mode, db_path, batch_size, trace, memory_limit_mb):
+    import gc
+    import tracemalloc
+
+    from benchmarks.bench_app import make_app
+    from cache import build_tables
+    from database import db
+    from models.employee import Employee
+    from models.department import Department
+    from models.location import Location
+
+    app = make_app(size, db_path=db_path)
+    models = {'employee_cache': Employee, 'department_cache': Department, 'location_cache': Location}
+    limit = memory_limit_mb * 2 ** 20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    with app.app_context():
+        gc.collect()
+        rss_before = _rss_now_kb()
+        blocks_before = sys.getallocatedblocks()
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            tables = build_tables(models, db, mode, batch_size)
+        except MemoryError:
+            tables = None
+        wall = time.perf_counter() - started
+        traced = tracemalloc.get_traced_memory()[1] if trace else None
+        tracemalloc.stop()
+        if tables is None:
+            print(json.dumps({'error': f'out of memory (> {memory_limit_mb} MB)'}))
+            return
+        db.session.remove()
+        gc.collect()
+        result = {
+            'rows': len(tables['employee_cache']),
+            'wall_s': wall,
+            'rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+            'blocks': sys.getallocatedblocks() - blocks_before,
+            'traced_mb': traced / 2 ** 20 if traced is not None else None
+        }
+    print(json.dumps(result))
+
+
+def _measure(size, mode, args):
+    command = [sys.executable, '-m', 'benchmarks.cache_load_scaling', '--child', str(size), mode,
+               _db_path(args.data_dir, size), '--batch-size', str(args.batch_size),
+               '--memory-limit-mb', str(args.memory_limit_mb)]
+    if args.tracemalloc:
+        command.append('--tracemalloc')
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        # Most likely killed for memory at the larger sizes; record it rather than abort
+        reason = 'killed' if completed.returncode < 0 else f'exit {completed.returncode}'
+        return {'error': reason}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _seed(size, args):
+    from benchmarks.bench_app import make_app
+
+    path = _db_path(args.data_dir, size)
+    if not os.path.exists(path):
+        print(f'seeding {size} employees into {path}', file=sys.stderr)
+        make_app(size, db_path=path)
+
+
+def _exponent(previous, current, size_previous, size_current, key):
+    if previous.get(key) is None or current.get(key) is None or previous[key] < NOISE_FLOOR[key]:
+        return None
+    return math.log(current[key] / previous[key]) / math.log(size_current / size_previous)
+
+
+def _table(results, sizes, threshold):
+    lines = [
+        '| mode | employees | wall (s) | rows/s | peak RSS +MB | live blocks | traced peak MB | scaling exp. (wall / rss) | |',
+        '|---|---:|---:|---:|---:|---:|---:|---:|---|',
+    ]
+    flagged = []
+    for mode in results:
+        previous_size = None
+        for size in sizes:
+            result = results[mode][size]
+            if 'error' in result:
+                lines.append(f'| {mode} | {size:,} | {result["error"]} | | | | | | |')
+                previous_size = None
+                continue
+            exponents, flag = '', ''
+            if previous_size is not None:
+                previous = results[mode][previous_size]
+                wall_exp = _exponent(previous, result, previous_size, size, 'wall_s')
+                rss_exp = _exponent(previous, result, previous_size, size, 'rss_mb')
+                exponents = ' / '.join('-' if exp is None else f'{exp:.2f}' for exp in (wall_exp, rss_exp))
+                if any(exp is not None and exp > threshold for exp in (wall_exp, rss_exp)):
+                    flag = '**superlinear**'
+                    flagged.append((mode, previous_size, size))
+            traced = '' if result['traced_mb'] is None else f'{result["traced_mb"]:.1f}'
+            lines.append(
+                f'| {mode} | {size:,} | {result["wall_s"]:.3f} | {result["rows"] / result["wall_s"]:,.0f} | '
+                f'{result["rss_mb"]:.1f} | {result["blocks"]:,} | {traced} | {exponents} | {flag} |'
+            )
+            previous_size = size
+    return lines, flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the cache load scales with table size')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'cache-load-scaling'))
+    parser.add_argument('--tracemalloc', action='store_true')
+    parser.add_argument('--memory-limit-mb', type=int, default=_memory_total_mb() * 3 // 4)
+    parser.add_argument('--superlinear-exponent', type=float, default=SUPERLINEAR_EXPONENT)
+    parser.add_argument('--output', help='also write the markdown table to this file')
+    parser.add_argument('--child', nargs=3, metavar=('SIZE', 'MODE', 'DB_PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        size, mode, db_path = args.child
+        _run_child(int(size), mode, db_path, args.batch_size, args.tracemalloc, args.memory_limit_mb)
+        return
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    modes = args.modes.split(',')
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {mode: {} for mode in modes}
+    for size in sizes:
+        _seed(size, args)
+        for mode in modes:
+            print(f'{mode} @ {size}...', file=sys.stderr)
+            results[mode][size] = _measure(size, mode, args)
+    lines, flagged = _table(results, sizes, args.superlinear_exponent)
+    header = [
+        '# Cache load scaling',
+        '',
+        f'`python -m benchmarks.cache_load_scaling --sizes {",".join(map(str, sizes))}` '
+        f'(batch size {args.batch_size}); Python {platform.python_version()}, {platform.machine()}, '
+        f'{os.cpu_count()} CPU. Superlinear threshold: exponent > {args.superlinear_exponent}.',
+        '',
+    ]
+    output = '\n'.join(header + lines) + '\n'
+    print(output)
+    for mode, previous_size, size in flagged:
+        print(f'WARNING: {mode} load scales superlinearly between {previous_size:,} and {size:,} rows', file=sys.stderr)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
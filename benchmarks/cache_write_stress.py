@@ -0,0 +1,153 @@
+# cache_write_stress.py
+# Hammers the cache write path from many threads and checks that readers never
+# see a half-updated row and that the cache ends up matching the writes.
+#
+#   python -m benchmarks.cache_write_stress --threads 32 --seconds 5
+#   python -m benchmarks.cache_write_stress --with-db      # real commits + reloads
+#
+# Without --with-db, writers only hold the row lock for --commit-ms to stand in
+# for a DB commit, so the run shows how much lock striping buys over one lock.
+import argparse
+import random
+import threading
+import time
+
+from sqlalchemy import select
+
+from benchmarks.bench_app import make_app
+from cache import get_change_log, get_table, load_cache, patch_cache, row_lock, update_cache
+from database import db
+from models.employee import Employee
+from models.department import Department
+from models.location import Location
+from versioning import conditional_update
+
+
+def _consistent(row):
+    # Writers keep name and department_id in lock-step; DB-seeded rows are exempt
+    name = row['name']
+    return not name.startswith('w') or name.rsplit('-', 1)[1] == str(row['department_id'])
+
+
+def run(stripes, args):
+    app = make_app(employees=args.rows, config={'CACHE_LOCK_STRIPES': stripes, 'CHANGE_LOG_SIZE': 10_000_000})
+    with app.app_context():
+        load_cache(Employee, Department, Location, db)
+    deadline = time.perf_counter() + args.seconds
+    counts = {'writes': 0, 'reads': 0, 'torn': 0, 'reloads': 0}
+    counts_lock = threading.Lock()
+    errors = []
+
+    def writer(thread_id):
+        writes = 0
+        rng = random.Random(thread_id)
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                key = rng.randint(1, args.rows)
+                values = {'name': f'w{thread_id}-{writes}', 'department_id': writes}
+                with row_lock('employee_cache', key):
+                    if args.with_db:
+                        # The same versioned write path the PUT routes take
+                        row, _ = conditional_update(Employee, key, values)
+                    else:
+                        if args.commit_ms:
+                            time.sleep(args.commit_ms / 1000)
+                        cached = get_table('employee_cache').get(key) or {}
+                        row = {'id': key, **values, 'version': (cached.get('version') or 0) + 1}
+                    if writes % 2:
+                        patch_cache('employee_cache', key, {field: row[field]
+                                                            for field in ('name', 'department_id', 'version')})
+                    else:
+                        update_cache('employee_cache', key, row)
+                writes += 1
+            db.session.remove()
+        with counts_lock:
+            counts['writes'] += writes
+
+    def reader(thread_id):
+        reads = torn = 0
+        rng = random.Random(-thread_id)
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                row = get_table('employee_cache').get(rng.randint(1, args.rows))
+                if row is None or not _consistent(row):
+                    torn += 1
+                reads += 1
+        with counts_lock:
+            counts['reads'] += reads
+            counts['torn'] += torn
+
+    def reloader():
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                time.sleep(args.reload_interval)
+                try:
+                    load_cache(Employee, Department, Location, db)
+                except Exception as e:
+                    errors.append(e)
+                counts['reloads'] += 1
+            db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.threads)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    if args.with_db:
+        threads.append(threading.Thread(target=reloader))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        mismatches = _verify(args)
+    return {
+        'stripes': stripes,
+        'writes/s': counts['writes'] / elapsed,
+        'reads/s': counts['reads'] / elapsed,
+        'torn reads': counts['torn'],
+        'reloads': counts['reloads'],
+        'mismatched rows': mismatches,
+        'errors': len(errors)
+    }
+
+
+def _verify(args):
+    cache = get_table('employee_cache')
+    if args.with_db:
+        # With real commits the cache must converge on the database
+        rows = db.session.execute(select(Employee.id, Employee.name, Employee.department_id, Employee.version)).all()
+        expected = {row.id: {'id': row.id, 'name': row.name, 'department_id': row.department_id,
+                             'version': row.version} for row in rows}
+    else:
+        # Otherwise the last upsert recorded for each key must be what is cached
+        expected = {}
+        for version, table, op, row in get_change_log().since(0):
+            if op == 'upsert':
+                expected[row['id']] = row
+    return sum(1 for key, row in expected.items() if cache.get(key) != row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress the cache write path from many threads')
+    parser.add_argument('--threads', type=int, default=16, help='writer threads')
+    parser.add_argument('--readers', type=int, default=4, help='reader threads')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--stripes', type=int, nargs='+', default=[1, 64])
+    parser.add_argument('--commit-ms', type=float, default=1.0, help='simulated commit time without --with-db')
+    parser.add_argument('--with-db', action='store_true', help='commit to SQLite and reload the cache concurrently')
+    parser.add_argument('--reload-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    failed = False
+    for stripes in args.stripes:
+        result = run(stripes, args)
+        print('  '.join(f'{name}={value:.0f}' if isinstance(value, float) else f'{name}={value}'
+                        for name, value in result.items()))
+        failed |= bool(result['torn reads'] or result['mismatched rows'] or result['errors'])
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# import_time.py
+# Cold-start report: how long `import main` takes in a fresh interpreter and
+# which modules dominate it, checked against a budget so regressions fail CI.
+#
+#   python -m benchmarks.import_time --budget-ms 750 --top 15
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import time of the app against a budget')
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=750.0)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    # The target module is imported last and its cumulative time covers everything
+    total_ms = next(cumulative for name, _, cumulative in reversed(rows) if name.strip() == args.module) / 1000
+
+    print(f'{"self ms":>9} {"cumul ms":>9}  module')
+    for name, self_us, cumulative_us in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f'{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name.strip()}')
+    status = 'OK' if total_ms <= args.budget_ms else 'OVER BUDGET'
+    print(f'\nimport {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms) {status}')
+    raise SystemExit(0 if total_ms <= args.budget_ms else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# logging_overhead.py
+# Cost per call of the diagnostics on the request path, before and after
+# logging_utils: the old f-string print of a whole record (and of a whole cache
+# on load) against the lazy, levelled, per-call-site limited logger, with
+# output going to /dev/null so only formatting and filtering are measured.
+#
+#   python -m benchmarks.logging_overhead
+#   python -m benchmarks.logging_overhead --columns 200 --rows 100000
+import argparse
+import contextlib
+import os
+import time
+
+from logging_utils import Lazy, configure_logging, get_logger
+
+log = get_logger('benchmarks.logging_overhead')
+
+
+class Record:
+    """Stand-in for a UserCache row: a few keys plus JSON data and comments blobs."""
+
+    def __init__(self, columns):
+        self.user_name = 'admin_user'
+        self.table_name = 'employee'
+        self.primary_key = '42'
+        self.data = {f'column_{i}': f'value {i} ' * 4 for i in range(columns)}
+        self.comments = {f'column_{i}': {'q1': 'yes', 'q2': 'no', 'q3': 'n/a', 'q4': 'see notes'} for i in range(columns)}
+
+    def __repr__(self):
+        return (f"<UserCache(user_name='{self.user_name}', table_name='{self.table_name}', "
+                f"primary_key='{self.primary_key}', data={self.data}, comments={self.comments})>")
+
+
+def _per_call(function, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-call overhead of print() vs logging_utils on hot paths')
+    parser.add_argument('--columns', type=int, default=50, help='columns in the record printed per request')
+    parser.add_argument('--rows', type=int, default=10000, help='rows in the cache printed per load')
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    record = Record(args.columns)
+    table = {i: {'id': i, 'name': f'Employee {i}', 'department_id': i % 50 + 1} for i in range(args.rows)}
+    devnull = open(os.devnull, 'w')
+
+    def print_record():
+        print(f"Record found: {record}", file=devnull)
+        print(f"Current comments: {record.comments}", file=devnull)
+
+    def log_record():
+        log.debug('record found: %r', record)
+
+    def print_cache():
+        print(f"Employees: {list(table.values())}", file=devnull)
+
+    def log_cache():
+        log.debug('built caches: %s', Lazy(lambda: {'employee_cache': len(table)}))
+        log.info('cache loaded: %d employees', len(table))
+
+    settings = [
+        ('logger at INFO (debug disabled)', {'LOG_LEVEL': 'INFO', 'LOG_FORMAT': 'json'}),
+        ('logger at DEBUG, 20/s per call site', {'LOG_LEVEL': 'DEBUG', 'LOG_FORMAT': 'json', 'LOG_RATE_LIMIT': 20.0}),
+        ('logger at DEBUG, 1% sampled', {'LOG_LEVEL': 'DEBUG', 'LOG_FORMAT': 'json', 'LOG_RATE_LIMIT': 0,
+                                         'LOG_SAMPLE_RATE': 0.01}),
+        ('logger at DEBUG, unlimited', {'LOG_LEVEL': 'DEBUG', 'LOG_FORMAT': 'json', 'LOG_RATE_LIMIT': 0}),
+    ]
+    print(f'record with {args.columns} columns ({len(repr(record)):,} chars), cache of {args.rows:,} rows; '
+          f'{args.calls} calls per case, output to /dev/null')
+    print(f'{"case":<40} {"per request µs":>15} {"per load µs":>12}')
+    cache_calls = max(args.calls // 100, 5)
+    print(f'{"print() f-strings (before)":<40} {_per_call(print_record, args.calls) * 1e6:15.2f} '
+          f'{_per_call(print_cache, cache_calls) * 1e6:12.1f}')
+    with contextlib.closing(devnull):
+        for name, config in settings:
+            configure_logging(config, stream=devnull)
+            print(f'{name:<40} {_per_call(log_record, args.calls) * 1e6:15.2f} '
+                  f'{_per_call(log_cache, cache_calls) * 1e6:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# partitioned_cache.py
+# Partitioned cache on one machine: starts --nodes local cache-node processes,
+# loads the employee table onto them through load_cache, then compares
+# fan-out multi-key reads against one round trip per key. Finally adds a node
+# and removes it again, reporting the fraction of keys each change moved
+# (about 1/N expected) and checking every row is still readable.
+#
+#   python -m benchmarks.partitioned_cache
+#   python -m benchmarks.partitioned_cache --nodes 4 --employees 100000 --keys 200
+import argparse
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_app import make_app
+from cache import get_many, get_table, load_cache
+from database import db
+from models.department import Department
+from models.employee import Employee
+from models.location import Location
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_node(authkey):
+    address = f'127.0.0.1:{_free_port()}'
+    process = subprocess.Popen([sys.executable, '-m', 'partitioned_cache', 'serve', address],
+                               env={**os.environ, 'CACHE_PARTITION_AUTHKEY': authkey})
+    host, port = address.split(':')
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, int(port)), timeout=0.2).close()
+            return address, process
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'cache node {address} did not start')
+
+
+def _check_all(app, ids):
+    with app.test_request_context():
+        found = get_many('employee_cache', ids)
+    assert len(found) == len(ids), f'{len(ids) - len(found)} rows unreadable'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fan-out reads and rebalancing of the partitioned cache')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--employees', type=int, default=50000)
+    parser.add_argument('--keys', type=int, default=100, help='keys per multi-key read')
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+
+    authkey = secrets.token_hex(16)
+    workdir = tempfile.mkdtemp(prefix='partitioned-')
+    processes = []
+    try:
+        nodes = []
+        for _ in range(args.nodes + 1):
+            address, process = _start_node(authkey)
+            nodes.append(address)
+            processes.append(process)
+        spare = nodes.pop()
+        app = make_app(args.employees, config={
+            'CACHE_BACKEND': 'partitioned',
+            'CACHE_PARTITION_NODES': nodes,
+            'CACHE_PARTITION_RING_PATH': os.path.join(workdir, 'ring.json'),
+            'CACHE_PARTITION_AUTHKEY': authkey,
+            'CACHE_PARTITION_CHECK_INTERVAL': 0.05
+        })
+        store = app.cache_store
+        with app.app_context():
+            started = time.perf_counter()
+            load_cache(Employee, Department, Location, db)
+            print(f'loaded {args.employees} employees onto {args.nodes} nodes in '
+                  f'{time.perf_counter() - started:.2f}s')
+        counts = {node: stats['tables'].get('employee_cache', 0) for node, stats in store.stats()['nodes'].items()}
+        print('rows per node: ' + ', '.join(f'{node} {count}' for node, count in counts.items()))
+
+        ids = list(range(1, args.employees + 1))
+        rng = random.Random(0)
+        batches = [rng.sample(ids, args.keys) for _ in range(args.reads)]
+        with app.test_request_context():
+            table = get_table('employee_cache')
+            started = time.perf_counter()
+            for batch in batches:
+                for key in batch:
+                    table.get(key)
+            per_key = (time.perf_counter() - started) / args.reads
+            started = time.perf_counter()
+            for batch in batches:
+                get_many('employee_cache', batch)
+            fan_out = (time.perf_counter() - started) / args.reads
+        print(f'{args.keys} keys: {per_key * 1000:.2f} ms one round trip per key, '
+              f'{fan_out * 1000:.2f} ms fan-out ({per_key / fan_out:.1f}x)')
+
+        for change, node in (('add', spare), ('remove', spare)):
+            result = store.add_node(node) if change == 'add' else store.remove_node(node)
+            size = len(result['nodes'])
+            expected = 1 / size if change == 'add' else 1 / (size + 1)
+            print(f'{change} {node}: moved {result["moved"]} of {args.employees} keys '
+                  f'({result["moved"] / args.employees:.1%}, ideal {expected:.1%})')
+            _check_all(app, ids)
+        print('all rows readable after each change')
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# replay.py
+# Re-drives a capture written by traffic_capture.py and reports latency
+# distributions, so cache and DB changes can be tried against real traffic.
+#
+#   python -m benchmarks.replay capture.jsonl.gz                 # boots create_app() on a temp DB copy
+#   python -m benchmarks.replay capture.jsonl.gz --speed 10
+#   python -m benchmarks.replay capture.jsonl.gz --speed max --url http://127.0.0.1:5000
+#
+# The local app gets a throwaway copy of instance/example.db (or --db), since
+# replayed PUTs overwrite rows with sanitized values. Requests are dispatched
+# at their offsets from the first captured arrival divided by --speed (or as
+# fast as the workers allow with --speed max). Latency is measured from the
+# scheduled send time, so a backed-up target shows up as latency, not as a
+# slower replay.
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from traffic_capture import read_capture
+
+
+def _boot_local(config_overrides, db_path):
+    from werkzeug.serving import make_server
+    from main import create_app
+
+    config = dict(config_overrides)
+    if 'SQLALCHEMY_DATABASE_URI' not in config:
+        copy = os.path.join(tempfile.mkdtemp(prefix='replay-'), os.path.basename(db_path))
+        shutil.copyfile(db_path, copy)
+        # The copy is ours to change, schema included
+        config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{copy}', DB_MIGRATE_ON_START=True)
+    app = create_app(config)
+    # Per-request access logs would dominate the output and skew timings
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def _speed(value):
+    """--speed: 'max' (None), or a positive multiplier of the captured pace."""
+    if value == 'max':
+        return None
+    try:
+        speed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number or 'max', got {value!r}")
+    if not 0 < speed < float('inf'):
+        raise argparse.ArgumentTypeError(f'must be a positive number, got {value!r}')
+    return speed
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Replayer:
+    def __init__(self, base_url, speed, workers):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.speed = speed
+        self.workers = workers
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return conn
+
+    def _send(self, record, scheduled):
+        path = record['p']
+        if record.get('q'):
+            path += '?' + urlencode([(name, value) for name, values in record['q'].items() for value in values])
+        body = json.dumps(record['b']).encode('utf-8') if record.get('b') is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        group = f"{record['m']} {record.get('r') or record['p']}"
+        try:
+            conn = self._connection()
+            conn.request(record['m'], path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self._local.conn = None
+            status = None
+        latency = (time.perf_counter() - scheduled) * 1000
+        with self._lock:
+            self.latencies[group].append(latency)
+            if status is None or status >= 500:
+                self.errors[group] += 1
+
+    def run(self, records):
+        started = time.perf_counter()
+        first = records[0]['t'] if records else 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            for record in records:
+                if self.speed is None:
+                    scheduled = time.perf_counter()
+                else:
+                    scheduled = started + (record['t'] - first) / self.speed
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(self._send, record, scheduled)
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        rows = []
+        everything = []
+        for group, values in sorted(self.latencies.items()):
+            values.sort()
+            everything.extend(values)
+            rows.append((group, values))
+        everything.sort()
+        rows.append(('ALL', everything))
+        print(f'{"route":<45} {"count":>7} {"errors":>6} {"p50":>8} {"p90":>8} {"p99":>8} {"max":>8}  (ms)')
+        for group, values in rows:
+            errors = sum(self.errors.values()) if group == 'ALL' else self.errors[group]
+            print(f'{group:<45} {len(values):>7} {errors:>6} {_percentile(values, 0.5):8.2f} '
+                  f'{_percentile(values, 0.9):8.2f} {_percentile(values, 0.99):8.2f} {(values[-1] if values else 0):8.2f}')
+        print(f'\n{len(everything)} requests in {elapsed:.2f}s ({len(everything) / elapsed if elapsed else 0:.0f} req/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a captured request log against the API')
+    parser.add_argument('capture')
+    parser.add_argument('--url', help='target base URL; default boots main.create_app() in-process')
+    parser.add_argument('--speed', type=_speed, default=1.0, help="replay speed multiplier (> 0), or 'max'")
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--config', default='{}', help='JSON config overrides for the locally booted app')
+    parser.add_argument('--db', default=os.path.join('instance', 'example.db'),
+                        help='database the locally booted app runs on a temporary copy of')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        base_url, server = _boot_local(json.loads(args.config), args.db)
+    records = sorted(read_capture(args.capture), key=lambda record: record['t'])
+    replayer = Replayer(base_url, args.speed, args.workers)
+    elapsed = replayer.run(records)
+    replayer.report(elapsed)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
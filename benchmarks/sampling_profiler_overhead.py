@@ -0,0 +1,77 @@
+# sampling_profiler_overhead.py
+# Throughput cost of leaving sampling_profiler running. A CPU-bound workload
+# runs at a realistic stack depth while a pool of idle threads stands in for
+# server workers parked in accept/wait (the sampler walks those stacks too);
+# rounds alternate between profiler off and on at each rate, best of N.
+#
+#   python -m benchmarks.sampling_profiler_overhead
+#   python -m benchmarks.sampling_profiler_overhead --hz 19 100 --threads 32 --seconds 2
+import argparse
+import json
+import threading
+import time
+
+from sampling_profiler import SamplingProfiler
+
+
+def _work(rows, depth):
+    if depth:
+        return _work(rows, depth - 1)
+    return len(json.dumps(rows))
+
+
+def _throughput(rows, depth, seconds):
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        _work(rows, depth)
+        done += 1
+    return done / seconds
+
+
+def _idle(stop, depth):
+    if depth:
+        return _idle(stop, depth - 1)
+    stop.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput overhead of the always-on sampling profiler')
+    parser.add_argument('--hz', type=int, nargs='+', default=[19, 50, 100])
+    parser.add_argument('--threads', type=int, default=16, help='idle threads with deep stacks')
+    parser.add_argument('--depth', type=int, default=40, help='stack depth of the workload and idle threads')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [{'id': i, 'name': f'Employee {i}', 'department_id': i % 50} for i in range(200)]
+    stop = threading.Event()
+    for _ in range(args.threads):
+        threading.Thread(target=_idle, args=(stop, args.depth), daemon=True).start()
+
+    print(f'{args.threads} idle threads, stack depth {args.depth}, best of {args.rounds} x {args.seconds}s, '
+          f'rounds interleaved')
+    best = {hz: 0.0 for hz in [None] + args.hz}
+    busy = {hz: 0.0 for hz in args.hz}
+    stacks = {}
+    for _ in range(args.rounds):
+        best[None] = max(best[None], _throughput(rows, args.depth, args.seconds))
+        for hz in args.hz:
+            profiler = SamplingProfiler(hz)
+            profiler.start()
+            started = time.perf_counter()
+            best[hz] = max(best[hz], _throughput(rows, args.depth, args.seconds))
+            busy[hz] = max(busy[hz], profiler.busy_seconds / (time.perf_counter() - started))
+            profiler.stop()
+            stacks[hz] = len(profiler.counts)
+    # On a busy machine the throughput column is noisy; sampler busy is the time it held the GIL
+    print(f'{"profiler":<14} {"ops/s":>10} {"overhead":>9} {"sampler busy":>13} {"stacks":>7}')
+    print(f'{"off":<14} {best[None]:10.0f}')
+    for hz in args.hz:
+        print(f'{f"{hz} Hz":<14} {best[hz]:10.0f} {(1 - best[hz] / best[None]) * 100:8.2f}% '
+              f'{busy[hz] * 100:12.2f}% {stacks[hz]:7}')
+    stop.set()
+
+
+if __name__ == '__main__':
+    main()
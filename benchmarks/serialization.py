@@ -0,0 +1,65 @@
+# serialization.py
+# Encode time and payload size of the response formats for a large table:
+# Flask's default provider (stdlib json, sorted keys) vs serialization.py's
+# orjson provider and MessagePack, for cached row dicts (what the list routes
+# return) and for ORM instances (through the per-model encoders).
+#
+#   python -m benchmarks.serialization
+#   python -m benchmarks.serialization --rows 100000 --repeat 5
+import argparse
+import gzip
+import time
+
+from flask.json.provider import DefaultJSONProvider
+
+import serialization
+from benchmarks.bench_app import make_app
+from cache import row_to_dict, sqlalchemy_to_dict
+from models.employee import Employee
+
+
+def _best(encode, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = encode()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare response encoders on a large table')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.rows)
+    stdlib = DefaultJSONProvider(app)
+    fast = serialization.FastJSONProvider(app)
+    with app.app_context():
+        objects = Employee.query.all()
+        table = sqlalchemy_to_dict(objects, 'id')
+
+        cases = [
+            ('rows: stdlib json (Flask default)', lambda: stdlib.dumps(table).encode('utf-8')),
+            ('rows: orjson provider', lambda: fast.dumps(table).encode('utf-8')),
+            ('objects: row_to_dict + stdlib json', lambda: stdlib.dumps([row_to_dict(obj) for obj in objects]).encode('utf-8')),
+            ('objects: orjson + model encoder', lambda: fast.dumps(objects).encode('utf-8')),
+        ]
+        if serialization.msgpack is not None:
+            cases.insert(2, ('rows: msgpack', lambda: serialization.encode_msgpack(table)))
+            cases.append(('objects: msgpack + model encoder', lambda: serialization.encode_msgpack(objects)))
+        if serialization.orjson is None:
+            print('orjson is not installed; the orjson cases measure the stdlib fallback')
+
+        print(f'{args.rows} employees, best of {args.repeat}')
+        print(f'{"encoder":<38} {"ms":>9} {"MB/s":>8} {"bytes":>11} {"gzip bytes":>11}')
+        for name, encode in cases:
+            elapsed, payload = _best(encode, args.repeat)
+            print(f'{name:<38} {elapsed * 1000:9.1f} {len(payload) / elapsed / 2 ** 20:8.1f} '
+                  f'{len(payload):11,} {len(gzip.compress(payload, 6)):11,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# single_flight.py
+# How many SQL fetches a burst of identical concurrent cache misses costs, with
+# and without coalescing. Each round drops the tiered cache, releases --threads
+# readers of the same few hot keys at once and counts SELECTs by primary key;
+# then the same number of threads call load_cache together. --db-latency-ms
+# stretches each fetch to stand in for a loaded database, where misses overlap.
+#
+#   python -m benchmarks.single_flight
+#   python -m benchmarks.single_flight --threads 64 --hot-keys 4 --rounds 10
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+
+from benchmarks.bench_app import make_app
+from cache import get_single_flight, get_table, load_cache
+from database import db
+from models.department import Department
+from models.employee import Employee
+from models.location import Location
+
+
+def _burst(app, threads, work):
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def run(index):
+        with app.app_context():
+            barrier.wait()
+            try:
+                work(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQL fetches saved by coalescing concurrent cache misses')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--hot-keys', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--employees', type=int, default=10000)
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='single-flight-')
+    app = make_app(args.employees, config={'CACHE_BACKEND': 'tiered',
+                                           'CACHE_L2_PATH': os.path.join(workdir, 'l2.db')})
+    fetches = [0]
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM employee' in statement and 'WHERE employee.id' in statement:
+                fetches[0] += 1
+                time.sleep(args.db_latency_ms / 1000)
+
+        load_cache(Employee, Department, Location, db)
+        store = app.cache_store
+        flight = get_single_flight()
+
+    def read(index):
+        get_table('employee_cache').get(index % args.hot_keys + 1)
+
+    print(f'{args.threads} threads reading {args.hot_keys} cold hot keys, {args.db_latency_ms:g} ms per fetch, '
+          f'{args.rounds} rounds')
+    for label, coalesce in (('without coalescing', None), ('single-flight', flight)):
+        store.single_flight = coalesce
+        fetches[0] = 0
+        elapsed = 0.0
+        for _ in range(args.rounds):
+            with app.app_context():
+                store.reset(store.models)
+            elapsed += _burst(app, args.threads, read)
+        print(f'{label:<20} {fetches[0] / args.rounds:6.1f} SQL fetches per burst, '
+              f'{elapsed / args.rounds * 1000:7.2f} ms')
+
+    before = flight.stats()['by_kind'].get('reload', {}).get('loads', 0)
+    _burst(app, args.threads, lambda index: load_cache(Employee, Department, Location, db))
+    reloads = flight.stats()['by_kind']['reload']
+    print(f'{args.threads} concurrent load_cache calls ran {reloads["loads"] - before} load(s)')
+    print('single-flight stats:', flight.stats())
+
+
+if __name__ == '__main__':
+    main()
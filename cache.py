@@ -1,44 +1,676 @@
-# cache.py
-from flask import current_app
+import gc
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, jsonify
+from sqlalchemy import select
+
+from database import caught_up_reads
+from logging_utils import Lazy, get_logger
+from tracing import span
+
+log = get_logger(__name__)
+
+# Number of change records kept for /changes consumers before they must resync
+CHANGE_LOG_SIZE = 10000
+# Total size (in result rows) the query cache may hold before evicting
+QUERY_CACHE_MAX_SIZE = 100000
+
+CACHE_NAMES = ('employee_cache', 'department_cache', 'location_cache')
+# Row locks are striped so writers to different rows rarely share one
+CACHE_LOCK_STRIPES = 64
+# Rows fetched per round trip when load_cache streams a table
+CACHE_LOAD_BATCH_SIZE = 10000
+# Seconds a caller waits on someone else's in-flight fetch or reload before giving up
+SINGLE_FLIGHT_TIMEOUT = 10.0
+# Retry-After (seconds) on the 503 answered when a request still times out waiting on one
+SINGLE_FLIGHT_RETRY_AFTER = 1
+# How long load_cache callers (warmup, jobs, admin reloads) arriving mid-reload wait on the
+# in-flight one; a full reload of a large table can take minutes, far past SINGLE_FLIGHT_TIMEOUT
+CACHE_RELOAD_WAIT_TIMEOUT = 300.0
+
+
+class ResyncRequired(Exception):
+    """Raised when a consumer's version is no longer covered by the change log."""
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised to a caller that gave up waiting on another caller's in-flight load."""
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs the load; callers arriving
+    while it runs wait for it and get its result, or its exception re-raised.
+    A waiter gives up with ``SingleFlightTimeout`` after ``timeout`` seconds;
+    the leader's load keeps running and still completes for the others.
+    Keys are tuples whose first item names the kind of load, for the stats.
+    """
+
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counters = defaultdict(lambda: dict.fromkeys(('loads', 'suppressed', 'errors', 'timeouts'), 0))
+
+    def do(self, key, load, timeout=None):
+        with self._lock:
+            counters = self.counters[key[0]]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                counters['loads'] += 1
+            else:
+                flight.waiters += 1
+                counters['suppressed'] += 1
+        if leader:
+            try:
+                flight.result = load()
+            except BaseException as e:
+                flight.error = e
+                with self._lock:
+                    counters['errors'] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.result
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                counters['timeouts'] += 1
+            raise SingleFlightTimeout(f'gave up waiting for in-flight {key[0]} load')
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: dict(counters) for kind, counters in self.counters.items()}
+            in_flight = len(self._flights)
+        totals = {name: sum(counters[name] for counters in kinds.values())
+                  for name in ('loads', 'suppressed', 'errors', 'timeouts')}
+        return {'in_flight': in_flight, **totals, 'by_kind': kinds}
+
+
+class ChangeLog:
+    """Bounded ring buffer of (version, table, op, row) change records.
+
+    Versions are contiguous, so the record for a version can be located by
+    offset from the oldest retained one. ``epoch`` identifies this log
+    instance; versions from another process or an earlier run are meaningless.
+    """
+
+    def __init__(self, maxlen=CHANGE_LOG_SIZE):
+        self.epoch = uuid.uuid4().hex
+        self._records = deque(maxlen=maxlen)
+        self._version = 0
+        self._cond = threading.Condition()
+
+    @property
+    def version(self):
+        return self._version
+
+    def append(self, table, op, row):
+        with self._cond:
+            self._version += 1
+            self._records.append((self._version, table, op, row))
+            self._cond.notify_all()
+            return self._version
+
+    def since(self, version):
+        with self._cond:
+            return self._since(version)
+
+    def wait(self, version, timeout):
+        """Block until there are changes after ``version`` or ``timeout`` elapses."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version, timeout)
+            return self._since(version)
+
+    def _since(self, version):
+        if version > self._version:
+            raise ResyncRequired(version)
+        if version == self._version:
+            return []
+        oldest = self._records[0][0] if self._records else self._version + 1
+        if version < oldest - 1:
+            raise ResyncRequired(version)
+        return list(itertools.islice(self._records, version - oldest + 1, None))
+
+
+class QueryCache:
+    """Result cache for filtered reads, invalidated by the tables it depends on.
+
+    Entries are keyed by ``(name, normalized params, snapshot version)`` and
+    tagged with the tables the query read. ``version`` is the cache snapshot
+    currently published; ``reset`` moves it on and drops every entry, and a
+    result computed from any other snapshot is returned but never stored.
+    Eviction is GreedyDual-Size-Frequency: an entry's priority is
+    ``clock + hits * compute_seconds / size``, so large results that were
+    cheap to compute go first and the clock ages out stale ones.
+    """
+
+    def __init__(self, max_size=QUERY_CACHE_MAX_SIZE, single_flight=None):
+        self.max_size = max_size
+        self.single_flight = single_flight
+        self._entries = {}
+        self._by_table = defaultdict(set)
+        self._generations = defaultdict(int)
+        self.version = 0
+        self._heap = []
+        self._clock = 0.0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get_or_compute(self, name, params, tables, compute, version=0):
+        key = (name, params, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry['hits'] += 1
+                self._push(key, entry)
+                return entry['result']
+            self.misses += 1
+            generations = [version] + [self._generations[table] for table in tables]
+
+        def load():
+            started = time.perf_counter()
+            result = compute()
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                # A write to one of the tables, or a reload, since the snapshot we read makes the result stale
+                if generations == [self.version] + [self._generations[table] for table in tables]:
+                    self._store(key, tables, result, elapsed)
+            return result
+
+        if self.single_flight is None:
+            return load()
+        # Generations in the key: a caller never joins a computation that began before its own write
+        try:
+            return self.single_flight.do(('query', name, params, tuple(generations)), load)
+        except SingleFlightTimeout:
+            # The leader is slow, not failing: answer from our own computation rather than an error
+            return load()
+
+    def invalidate(self, table):
+        with self._lock:
+            self._generations[table] += 1
+            for key in self._by_table.pop(table, ()):
+                if self._remove(key):
+                    self.invalidations += 1
+
+    def reset(self, version):
+        """Drop every entry: snapshot ``version`` has been published in place of the last."""
+        with self._lock:
+            self.version = version
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_table.clear()
+            self._heap = []
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _store(self, key, tables, result, elapsed):
+        size = max(len(result), 1) if hasattr(result, '__len__') else 1
+        if size > self.max_size:
+            return
+        self._remove(key)
+        entry = {'result': result, 'tables': tables, 'size': size, 'cost': elapsed, 'hits': 1}
+        self._entries[key] = entry
+        for table in tables:
+            self._by_table[table].add(key)
+        self._size += size
+        self._push(key, entry)
+        while self._size > self.max_size:
+            self._evict()
+
+    def _push(self, key, entry):
+        entry['priority'] = self._clock + entry['hits'] * entry['cost'] / entry['size']
+        heapq.heappush(self._heap, (entry['priority'], id(entry), key))
+        # Every hit pushes a new heap item; rebuild once stale ones dominate
+        if len(self._heap) > 4 * len(self._entries) + 64:
+            self._heap = [(e['priority'], id(e), k) for k, e in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def _evict(self):
+        while self._heap:
+            priority, entry_id, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is not None and id(entry) == entry_id and entry['priority'] == priority:
+                self._clock = priority
+                self._remove(key)
+                self.evictions += 1
+                return
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._size -= entry['size']
+        for table in entry['tables']:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+        return True
+
+
+def normalize_params(args, fields):
+    """Turn a request's filter args into a hashable, order-independent key.
+
+    Only ``fields``, the filters the view reads, take part, so unrelated args
+    don't split one result into many entries. ``q`` is keyed the way views
+    match it: its first value, stripped and lowercased.
+    """
+    params = []
+    for name in sorted(fields):
+        if name == 'q':
+            values = (args.get(name, '').strip().lower(),)
+        else:
+            values = tuple(sorted({value.strip() for value in args.getlist(name)}))
+        values = tuple(value for value in values if value)
+        if values:
+            params.append((name, values))
+    return tuple(params)
+
+
+def get_query_cache():
+    if not hasattr(current_app, 'query_cache'):
+        current_app.query_cache = QueryCache(current_app.config.get('QUERY_CACHE_MAX_SIZE', QUERY_CACHE_MAX_SIZE),
+                                             get_single_flight())
+    return current_app.query_cache
+
+
+def get_single_flight():
+    if not hasattr(current_app, 'single_flight'):
+        current_app.single_flight = SingleFlight(
+            current_app.config.get('SINGLE_FLIGHT_TIMEOUT', SINGLE_FLIGHT_TIMEOUT))
+    return current_app.single_flight
+
+
+def cached_query(name, params, tables, compute):
+    store = current_app.cache_store
+    if hasattr(store, 'sync'):
+        # Apply other processes' writes first; a hit would otherwise never look
+        store.sync()
+    with span('cache.query', {'cache.query': name, 'cache.hit': True}) as current:
+        def traced_compute():
+            current.set('cache.hit', False)
+            return compute()
+        # The snapshot the compute will read, pinned for this request
+        return get_query_cache().get_or_compute(name, params, tuple(tables), traced_compute, get_snapshot().version)
+
+
+class StripedLock:
+    """A fixed set of re-entrant locks shared out by hashing (cache_name, key).
+
+    Writers to different rows almost always land on different stripes, so
+    they don't serialize. ``all()`` takes every stripe in index order for the
+    rare operation, such as publishing a reload, that must exclude all writers.
+    """
+
+    def __init__(self, stripes=CACHE_LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, cache_name, key):
+        return self._locks[hash((cache_name, key)) % len(self._locks)]
+
+    @contextmanager
+    def many(self, cache_name, keys):
+        """Take the stripes of every key in ``keys``, in index order like ``all()``."""
+        locks = [self._locks[index] for index in sorted({hash((cache_name, key)) % len(self._locks) for key in keys})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    @contextmanager
+    def all(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+
+class CacheSnapshot:
+    """An immutable-by-convention set of cache tables published as one unit.
+
+    Reloads build a fresh snapshot and swap ``app.cache_snapshot`` to it with a
+    single reference assignment, so readers never see a half-loaded table.
+    Only ``update_cache`` and ``patch_cache`` touch a published table, and only
+    by replacing a whole row under that row's stripe of ``app.cache_locks``.
+    """
+
+    def __init__(self, version, tables):
+        self.version = version
+        self.tables = tables
+
+
+def _single_flight_timeout(e):
+    response = jsonify({'error': 'Timed out waiting for a cache load, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config.get('SINGLE_FLIGHT_RETRY_AFTER',
+                                                                 SINGLE_FLIGHT_RETRY_AFTER))
+    return response
+
+
+def init_cache(app):
+    # Waits that can't fall back to computing themselves (row fills, reloads) surface as 503s
+    app.register_error_handler(SingleFlightTimeout, _single_flight_timeout)
+    app.cache_locks = StripedLock(app.config.get('CACHE_LOCK_STRIPES', CACHE_LOCK_STRIPES))
+    app.change_log = ChangeLog(app.config.get('CHANGE_LOG_SIZE', CHANGE_LOG_SIZE))
+    app.single_flight = SingleFlight(app.config.get('SINGLE_FLIGHT_TIMEOUT', SINGLE_FLIGHT_TIMEOUT))
+    app.query_cache = QueryCache(app.config.get('QUERY_CACHE_MAX_SIZE', QUERY_CACHE_MAX_SIZE), app.single_flight)
+    app.cache_store = None
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    if backend == 'mmap':
+        from snapshot_store import MmapStore, MMAP_CHECK_INTERVAL
+        app.cache_store = MmapStore(
+            app.config.get('CACHE_MMAP_DIR') or os.path.join(app.instance_path, 'cache-snapshot'),
+            loader=app.config.get('CACHE_MMAP_LOADER', True),
+            check_interval=app.config.get('CACHE_MMAP_CHECK_INTERVAL', MMAP_CHECK_INTERVAL),
+            # Another process published a generation: filtered results may be stale
+            on_swap=lambda: [app.query_cache.invalidate(_table_name(name)) for name in CACHE_NAMES]
+        )
+    elif backend == 'tiered':
+        from tiered_cache import TieredStore, L1_SIZE, L2_SIZE, PROMOTE_AFTER, SYNC_INTERVAL
+        app.cache_store = TieredStore(
+            app.config.get('CACHE_L2_PATH') or os.path.join(app.instance_path, 'cache-l2.db'),
+            l1_size=app.config.get('CACHE_L1_SIZE', L1_SIZE),
+            l2_size=app.config.get('CACHE_L2_SIZE', L2_SIZE),
+            promote_after=app.config.get('CACHE_L1_PROMOTE_AFTER', PROMOTE_AFTER),
+            sync_interval=app.config.get('CACHE_L1_SYNC_INTERVAL', SYNC_INTERVAL),
+            single_flight=app.single_flight,
+            # Another process wrote to the table: filtered results may be stale
+            on_invalidate=lambda name: app.query_cache.invalidate(_table_name(name))
+        )
+    elif backend == 'partitioned':
+        from partitioned_cache import (PartitionedStore, CACHE_PARTITIONED_TABLES, CACHE_PARTITION_VNODES,
+                                       CACHE_PARTITION_CHECK_INTERVAL)
+        app.cache_store = PartitionedStore(
+            app.config.get('CACHE_PARTITION_NODES', ()),
+            app.config.get('CACHE_PARTITION_RING_PATH') or os.path.join(app.instance_path, 'cache-ring.json'),
+            partitioned=app.config.get('CACHE_PARTITIONED_TABLES', CACHE_PARTITIONED_TABLES),
+            vnodes=app.config.get('CACHE_PARTITION_VNODES', CACHE_PARTITION_VNODES),
+            # Same secret the nodes read from their environment
+            authkey=app.config.get('CACHE_PARTITION_AUTHKEY') or os.environ.get('CACHE_PARTITION_AUTHKEY'),
+            loader=app.config.get('CACHE_PARTITION_LOADER', True),
+            check_interval=app.config.get('CACHE_PARTITION_CHECK_INTERVAL', CACHE_PARTITION_CHECK_INTERVAL),
+            batch_size=app.config.get('CACHE_LOAD_BATCH_SIZE', CACHE_LOAD_BATCH_SIZE),
+            # Another process wrote to a partitioned table: filtered results may be stale
+            on_invalidate=lambda name: app.query_cache.invalidate(_table_name(name))
+        )
+    _publish(app, CacheSnapshot(0, {cache_name: {} for cache_name in CACHE_NAMES}))
+
+
+def _publish(app, snapshot):
+    """Swap in ``snapshot``; reloads call this holding ``app.cache_locks.all()``."""
+    app.cache_snapshot = snapshot
+    # Per-table aliases for callers that only ever read one table
+    for cache_name, table in snapshot.tables.items():
+        setattr(app, cache_name, table)
+    # Under the same locks as the swap, so no write's invalidation can interleave with it
+    app.query_cache.reset(snapshot.version)
+
+
+def get_snapshot():
+    """Return the cache snapshot, pinned for the rest of the current request."""
+    if not has_request_context():
+        return current_app.cache_snapshot
+    snapshot = g.get('cache_snapshot')
+    if snapshot is None:
+        snapshot = current_app.cache_snapshot
+        store = current_app.cache_store
+        if hasattr(store, 'pin'):
+            # Live views (the mmap store's) would otherwise follow every swap mid-request
+            snapshot = CacheSnapshot(snapshot.version, store.pin(snapshot.tables))
+        g.cache_snapshot = snapshot
+    return snapshot
+
+
+def get_table(cache_name):
+    with span('cache.table', {'cache.name': cache_name}):
+        return get_snapshot().tables[cache_name]
+
+
+def get_many(cache_name, keys):
+    """Cached rows for those of ``keys`` that exist, keyed by id and in the order asked for.
+
+    Partitioned tables fetch from all the owning nodes at once.
+    """
+    table = get_table(cache_name)
+    if hasattr(table, 'get_many'):
+        return table.get_many(keys)
+    return {key: table[key] for key in keys if key in table}
+
+
+def as_dict(table):
+    # Shared-memory backends hand out read-only Mapping views rather than dicts
+    return table if isinstance(table, dict) else dict(table.items())
+
+
+def get_change_log():
+    if not hasattr(current_app, 'change_log'):
+        current_app.change_log = ChangeLog(current_app.config.get('CHANGE_LOG_SIZE', CHANGE_LOG_SIZE))
+    return current_app.change_log
+
+
+def _table_name(cache_name):
+    return cache_name[:-len('_cache')] if cache_name.endswith('_cache') else cache_name
+
+
+def row_to_dict(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
 
 
 def sqlalchemy_to_dict(obj,primary_key_column):
     result = {}
     for row in obj:
-        row_dict = row.__dict__
-        row_dict.pop( '_sa_instance_state', None)
+        row_dict = row_to_dict(row)
         result[row_dict[primary_key_column]]=row_dict
     return result
 
+def build_tables(models, db, mode='core', batch_size=CACHE_LOAD_BATCH_SIZE):
+    """Read every row of each model into ``{cache_name: {id: row dict}}``.
+
+    ``mode='orm'`` materialises mapped objects with ``query.all()`` and copies
+    them out; ``'core'`` streams plain rows from a Core select in batches of
+    ``batch_size`` and never builds ORM objects or an intermediate list.
+    """
+    tables = {}
+    with _gc_paused():
+        for cache_name, model in models.items():
+            tables[cache_name] = _build_table(model, db, mode, batch_size)
+    return tables
+
+
+@contextmanager
+def _gc_paused():
+    # Every row allocated during a load survives it, so each full collection
+    # rescans the whole growing table for nothing: load time goes superlinear
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _build_table(model, db, mode, batch_size):
+    if mode == 'orm':
+        return sqlalchemy_to_dict(model.query.all(), 'id')
+    table = model.__table__
+    columns = [column.key for column in table.columns]
+    id_index = columns.index('id')
+    rows = {}
+    result = db.session.execute(select(*table.columns).execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        for row in partition:
+            rows[row[id_index]] = dict(zip(columns, row))
+    return rows
+
+
 def load_cache(Employee, Department, Location, db):
-    employees = Employee.query.all()
-    print(f"Employees: {employees}")
+    """(Re)load every cache table; concurrent calls share one load and all wait for it.
+
+    A call arriving mid-load gets that load's result rather than starting
+    another, so it sees the writes this process made (they replay from the
+    change log) but may miss rows committed elsewhere after the load read them.
+    """
+    app = current_app._get_current_object()
+    if not hasattr(app, 'cache_snapshot'):
+        init_cache(app)
+    get_single_flight().do(('reload',), lambda: _load_cache(app, Employee, Department, Location, db),
+                           app.config.get('CACHE_RELOAD_WAIT_TIMEOUT', CACHE_RELOAD_WAIT_TIMEOUT))
 
-    # Initialize caches if they don't exist
-    if not hasattr(current_app, 'employee_cache'):
-        current_app.employee_cache = {}
-    if not hasattr(current_app, 'department_cache'):
-        current_app.department_cache = {}
-    if not hasattr(current_app, 'location_cache'):
-        current_app.location_cache = {}
 
-    # Update the caches
-    current_app.employee_cache.clear()
+def _load_cache(app, Employee, Department, Location, db):
+    change_log = get_change_log()
+    store = app.cache_store
+    models = {'employee_cache': Employee, 'department_cache': Department, 'location_cache': Location}
 
-    
-    current_app.employee_cache.update(sqlalchemy_to_dict(employees,'id'))
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    if backend == 'tiered' or (backend == 'mmap' and not store.loader):
+        if backend == 'tiered':
+            # Read-through tiers fill lazily; a reload just drops what they hold
+            store.reset(models)
+        else:
+            # Another process loads the shared snapshot; just map what it published
+            store.wait_ready()
+        with app.cache_locks.all():
+            for cache_name in CACHE_NAMES:
+                change_log.append(_table_name(cache_name), 'reload', None)
+            _publish(app, CacheSnapshot(change_log.version, store.tables(CACHE_NAMES)))
+        return
 
-    departments = Department.query.all()
-    current_app.department_cache.clear()
-    current_app.department_cache.update(sqlalchemy_to_dict(departments,'id'))
+    # Build the new tables off to the side; readers keep the published snapshot meanwhile
+    while True:
+        start_version = change_log.version
+        # A replica may serve the load, but only one holding every write before start_version
+        with caught_up_reads():
+            # Partitioned tables stream from SQL to their nodes in write_full instead
+            local_models = {name: model for name, model in models.items()
+                            if name not in getattr(store, 'partitioned', ())}
+            tables = build_tables(local_models, db, app.config.get('CACHE_LOAD_MODE', 'core'),
+                                  app.config.get('CACHE_LOAD_BATCH_SIZE', CACHE_LOAD_BATCH_SIZE))
+            log.debug('built caches: %s', Lazy(lambda: {name: len(table) for name, table in tables.items()}))
+            if store is not None:
+                store.write_full(tables, models)
+        with app.cache_locks.all():
+            try:
+                missed = change_log.since(start_version)
+            except ResyncRequired:
+                # More writes landed during the load than the change log holds
+                continue
+            # Writes that committed while we were reading may not be in our rows
+            for version, table, op, row in missed:
+                if op == 'upsert':
+                    if store is not None:
+                        store.put(table + '_cache', row['id'], row)
+                    else:
+                        tables[table + '_cache'][row['id']] = row
+                elif op == 'delete':
+                    if store is not None:
+                        store.delete(table + '_cache', row['id'])
+                    else:
+                        tables[table + '_cache'].pop(row['id'], None)
+            # A reload may have changed anything; consumers refetch these tables
+            for cache_name in CACHE_NAMES:
+                change_log.append(_table_name(cache_name), 'reload', None)
+            if store is not None:
+                tables = store.tables(CACHE_NAMES)
+            _publish(app, CacheSnapshot(change_log.version, tables))
+        break
 
-    locations = Location.query.all()
-    current_app.location_cache.clear()
-    current_app.location_cache.update(sqlalchemy_to_dict(locations,'id'))
+    log.info('cache loaded: %d employees, %d departments, %d locations',
+             len(current_app.employee_cache), len(current_app.department_cache), len(current_app.location_cache))
 
-    print(f"Employee cache inside load_cache: {current_app.employee_cache}")
+
+def row_lock(cache_name, key):
+    """Lock guarding one cache row; hold it across the DB write and the cache update.
+
+    Holding it across both keeps concurrent writers to the same row from
+    committing in one order and landing in the cache in the other, and lets
+    the cache verifier tell a write still on its way to the cache from drift.
+    Versioned writes take it for the verifier's sake; ``update_cache`` already
+    refuses to take them backwards.
+    """
+    return current_app.cache_locks.lock_for(cache_name, key)
 
 
 def update_cache(cache_name, key, obj):
-    cache = getattr(current_app, cache_name)
-    cache[key] = obj
+    """Publish ``obj`` as the cached row; returns False if the cache already holds a newer version."""
+    app = current_app._get_current_object()
+    with app.cache_locks.lock_for(cache_name, key):
+        table = app.cache_snapshot.tables[cache_name]
+        if obj.get('version') is not None:
+            cached = table.get(key)
+            if cached is not None and cached.get('version') is not None and cached['version'] > obj['version']:
+                # A later write landed first; its row is the one to keep
+                return False
+        # Replacing the row reference is atomic for readers of the live snapshot
+        table[key] = obj
+        get_change_log().append(_table_name(cache_name), 'upsert', obj)
+    get_query_cache().invalidate(_table_name(cache_name))
+    return True
+
+
+def evict_cache(cache_name, key):
+    app = current_app._get_current_object()
+    with app.cache_locks.lock_for(cache_name, key):
+        table = app.cache_snapshot.tables[cache_name]
+        if key not in table:
+            return
+        del table[key]
+        get_change_log().append(_table_name(cache_name), 'delete', {'id': key})
+    get_query_cache().invalidate(_table_name(cache_name))
+
+
+def patch_cache(cache_name, key, changes):
+    """Copy-on-write update of some fields of a cached row; returns the new row."""
+    app = current_app._get_current_object()
+    with app.cache_locks.lock_for(cache_name, key):
+        row = dict(app.cache_snapshot.tables[cache_name].get(key, {}))
+        row.update(changes)
+        update_cache(cache_name, key, row)
+    return row
@@ -0,0 +1,172 @@
+# cache_verifier.py
+# Background check that the in-process caches still match the database,
+# without reloading them.
+#
+# Both sides are summarised per id-range bucket as (row count, sum of per-row
+# CRC32). The database side is computed inside SQLite with GROUP BY and a
+# registered row_crc() function, so no rows cross into Python for buckets that
+# agree. Mismatching buckets are split `fanout` ways and compared again until
+# they span at most `leaf_size` ids; only those leaves are fetched and diffed
+# row by row. Each divergent row is re-read under its row lock before it is
+# repaired, so a PUT that committed but hasn't reached the cache yet isn't
+# counted as drift, and versioned rows are never replaced by older ones.
+import bisect
+import threading
+import time
+import zlib
+
+from sqlalchemy import text
+
+from cache import CACHE_NAMES, evict_cache, get_table, row_lock, update_cache
+from database import db
+
+FANOUT = 64
+LEAF_SIZE = 256
+
+
+def _row_crc(*values):
+    return zlib.crc32('\x1f'.join(['\x00' if value is None else str(value) for value in values]).encode('utf-8'))
+
+
+class CacheVerifier:
+    def __init__(self, models, fanout=FANOUT, leaf_size=LEAF_SIZE):
+        self.models = models
+        self.fanout = fanout
+        self.leaf_size = leaf_size
+        self._lock = threading.Lock()
+        # cache_name -> {key: (row, crc)}; cached rows are replaced, never mutated,
+        # so a row that is the same object as last run still has the same CRC
+        self._crcs = {}
+        self.stats = {
+            'runs': 0,
+            'last_run_ms': None,
+            'last_run_at': None,
+            'buckets_compared': 0,
+            'leaves_fetched': 0,
+            'rows_repaired': 0,
+            'rows_evicted': 0,
+            'drift_by_table': {name: 0 for name in models}
+        }
+
+    def run(self):
+        """Verify every table once; returns this run's drift counts."""
+        with self._lock:
+            started = time.perf_counter()
+            drift = {}
+            with db.engine.connect() as conn:
+                conn.connection.driver_connection.create_function('row_crc', -1, _row_crc, deterministic=True)
+                for cache_name, model in self.models.items():
+                    drift[cache_name] = self._verify_table(conn, cache_name, model)
+            self.stats['runs'] += 1
+            self.stats['last_run_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self.stats['last_run_at'] = time.time()
+            return drift
+
+    def _verify_table(self, conn, cache_name, model):
+        table = model.__table__
+        columns = [column.key for column in table.columns]
+        select_columns = ', '.join(f'"{column}"' for column in columns)
+        # Materialise once so the whole pass sees one version of the table
+        cache_rows = dict(get_table(cache_name).items())
+        keys = sorted(cache_rows)
+        previous = self._crcs.get(cache_name, {})
+        crcs = self._crcs[cache_name] = {}
+
+        def cache_buckets(lo, hi, width):
+            buckets = {}
+            for key in keys[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]:
+                known = crcs.get(key)
+                if known is None:
+                    row = cache_rows[key]
+                    known = previous.get(key)
+                    if known is None or known[0] is not row:
+                        known = (row, _row_crc(*[row.get(column) for column in columns]))
+                    crcs[key] = known
+                bucket = (key - lo) // width
+                count, total = buckets.get(bucket, (0, 0))
+                buckets[bucket] = (count + 1, total + known[1])
+            return buckets
+
+        db_lo, db_hi = conn.execute(text(f'SELECT min(id), max(id) FROM "{table.name}"')).one()
+        bounds = [bound for bound in (db_lo, db_hi, keys[0] if keys else None, keys[-1] if keys else None)
+                  if bound is not None]
+        if not bounds:
+            return 0
+        ranges = [(min(bounds), max(bounds))]
+        leaves = []
+        while ranges:
+            next_ranges = []
+            for lo, hi in ranges:
+                if hi - lo + 1 <= self.leaf_size:
+                    leaves.append((lo, hi))
+                    continue
+                width = -(-(hi - lo + 1) // self.fanout)
+                db_buckets = {
+                    bucket: (count, total) for bucket, count, total in conn.execute(text(
+                        f'SELECT (id - :lo) / :width, count(*), sum(row_crc({select_columns})) '
+                        f'FROM "{table.name}" WHERE id BETWEEN :lo AND :hi GROUP BY 1'
+                    ), {'lo': lo, 'hi': hi, 'width': width})
+                }
+                ours = cache_buckets(lo, hi, width)
+                self.stats['buckets_compared'] += len(set(db_buckets) | set(ours))
+                for bucket in set(db_buckets) | set(ours):
+                    if db_buckets.get(bucket) != ours.get(bucket):
+                        bucket_lo = lo + bucket * width
+                        next_ranges.append((bucket_lo, min(bucket_lo + width - 1, hi)))
+            ranges = next_ranges
+
+        drifted = 0
+        for lo, hi in leaves:
+            self.stats['leaves_fetched'] += 1
+            db_rows = {
+                row['id']: dict(row) for row in conn.execute(
+                    text(f'SELECT {select_columns} FROM "{table.name}" WHERE id BETWEEN :lo AND :hi'),
+                    {'lo': lo, 'hi': hi}
+                ).mappings()
+            }
+            in_range = keys[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]
+            for key in set(db_rows) | set(in_range):
+                if db_rows.get(key) != cache_rows.get(key):
+                    drifted += self._repair(conn, cache_name, table, select_columns, key)
+        self.stats['drift_by_table'][cache_name] += drifted
+        return drifted
+
+    def _repair(self, conn, cache_name, table, select_columns, key):
+        with row_lock(cache_name, key):
+            found = conn.execute(text(f'SELECT {select_columns} FROM "{table.name}" WHERE id = :id'),
+                                 {'id': key}).mappings().first()
+            cached = get_table(cache_name).get(key)
+            if found is None and cached is not None:
+                evict_cache(cache_name, key)
+                self.stats['rows_evicted'] += 1
+                return 1
+            # A newer version than we read may have just landed; update_cache won't regress it
+            if found is not None and dict(found) != cached and update_cache(cache_name, key, dict(found)):
+                self.stats['rows_repaired'] += 1
+                return 1
+        return 0
+
+
+def init_verifier(app, models):
+    """Attach a verifier to ``app`` and, if CACHE_VERIFY_INTERVAL is set, run it in the background."""
+    app.cache_verifier = CacheVerifier(
+        {cache_name: models[cache_name] for cache_name in CACHE_NAMES},
+        fanout=app.config.get('CACHE_VERIFY_FANOUT', FANOUT),
+        leaf_size=app.config.get('CACHE_VERIFY_LEAF_SIZE', LEAF_SIZE)
+    )
+    interval = app.config.get('CACHE_VERIFY_INTERVAL')
+    if interval:
+        threading.Thread(target=_verify_forever, args=(app, interval), name='cache-verifier', daemon=True).start()
+    return app.cache_verifier
+
+
+def _verify_forever(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                app.cache_verifier.run()
+            except Exception:
+                app.logger.exception('cache verification failed')
+            finally:
+                db.session.remove()
@@ -1,8 +1,337 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+import click
+import sqlalchemy as sa
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+# Replicas further behind the primary than this stop receiving reads
+REPLICA_MAX_LAG = 5.0
+# How often the primary heartbeat is written and replica lag is measured
+REPLICA_CHECK_INTERVAL = 1.0
+# Per-replica options that configure replication rather than the engine
+_REPLICA_OPTIONS = ('copy_interval',)
+_READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(Session):
+    """Sends writes to the primary and reads to a replica when one is fresh enough.
+
+    Reads stay on the primary for the rest of the session once it has flushed,
+    and for the whole of any non-GET request, so a request always reads its own
+    writes. The session is scoped to the app context, which Flask pushes per
+    request, so that pinning lasts exactly one request. A session also sticks
+    to the first replica it picks, so its reads never go back in time.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing or self.info.get('primary'):
+            return primary
+        if isinstance(clause, (sa.sql.expression.UpdateBase, sa.sql.expression.TextClause)):
+            # Writes, and raw SQL we can't tell from a write
+            self.info['primary'] = True
+            return primary
+        if has_request_context() and request.method not in _READ_METHODS:
+            return primary
+        replicas = getattr(current_app, 'db_replicas', None)
+        if replicas is None or primary is not self._db.engine:
+            return primary
+        name = self.info.get('replica')
+        if name is None or not replicas.is_healthy(name):
+            name = self.info['replica'] = replicas.choose()
+        if name is None:
+            return primary
+        replicas.count_read(name)
+        return self._db.engines[_bind_key(name)]
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _pin_to_primary(session, flush_context):
+    session.info['primary'] = True
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def _bind_key(name):
+    return f'replica:{name}'
+
+
+def _sqlite_path(engine):
+    url = engine.url
+    if url.drivername not in ('sqlite', 'sqlite+pysqlite') or not url.database:
+        return None
+    return url.database[len('file:'):] if url.query.get('uri') else url.database
+
+
+class ReplicaSet:
+    """Tracks replica lag from a heartbeat row and keeps snapshot replicas refreshed.
+
+    Every check the monitor writes the current time into ``replication_heartbeat``
+    on the primary, then reads it back from each replica: a replica showing the
+    latest heartbeat has lag 0, otherwise its lag is the age of the heartbeat it
+    has. Replicas with a ``copy_interval`` are SQLite files refreshed from the
+    primary with the online backup API.
+    """
+
+    def __init__(self, app, options, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL):
+        self.app = app
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.copy_intervals = {name: replica.get('copy_interval') for name, replica in options.items()}
+        self.stats = {
+            name: {'lag_seconds': None, 'healthy': False, 'reads': 0, 'last_copy_at': None,
+                   'last_copy_ms': None, 'error': None}
+            for name in options
+        }
+        self._names = itertools.cycle(sorted(options))
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def is_healthy(self, name):
+        return self.stats[name]['healthy']
+
+    def choose(self):
+        with self._lock:
+            for _ in range(len(self.stats)):
+                name = next(self._names)
+                if self.stats[name]['healthy']:
+                    return name
+        return None
+
+    def count_read(self, name):
+        self.stats[name]['reads'] += 1
+
+    def write_heartbeat(self):
+        now = time.time()
+        with db.engine.begin() as conn:
+            conn.execute(sa.text('INSERT OR REPLACE INTO replication_heartbeat (id, ts) VALUES (1, :ts)'),
+                         {'ts': now})
+        self._heartbeat = now
+        return now
+
+    def replica_heartbeat(self, name):
+        with db.engines[_bind_key(name)].connect() as conn:
+            return conn.execute(sa.text('SELECT ts FROM replication_heartbeat WHERE id = 1')).scalar()
+
+    def check(self):
+        self.write_heartbeat()
+        for name, interval in self.copy_intervals.items():
+            last_copy = self.stats[name]['last_copy_at']
+            if interval and (last_copy is None or time.time() - last_copy >= interval):
+                self._copy(name)
+        for name, stats in self.stats.items():
+            try:
+                seen = self.replica_heartbeat(name)
+            except sa.exc.SQLAlchemyError as e:
+                stats.update(lag_seconds=None, healthy=False, error=str(e.orig if hasattr(e, 'orig') else e))
+                continue
+            lag = None if seen is None else (0.0 if seen >= self._heartbeat else time.time() - seen)
+            stats.update(lag_seconds=lag, healthy=lag is not None and lag <= self.max_lag, error=None)
+
+    def _copy(self, name):
+        stats = self.stats[name]
+        source, target = _sqlite_path(db.engine), _sqlite_path(db.engines[_bind_key(name)])
+        started = time.perf_counter()
+        try:
+            with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+                src.backup(dst)
+        except sqlite3.Error as e:
+            stats['error'] = str(e)
+            return
+        stats['last_copy_at'] = time.time()
+        stats['last_copy_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def wait_for(self, ts, timeout):
+        """Return a replica that has caught up with heartbeat ``ts``, or None after ``timeout``."""
+        deadline = time.monotonic() + timeout
+        while True:
+            for name in sorted(self.stats):
+                try:
+                    seen = self.replica_heartbeat(name)
+                except sa.exc.SQLAlchemyError:
+                    continue
+                if seen is not None and seen >= ts:
+                    return name
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(0.05, self.check_interval))
+
+    def run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.check()
+                except Exception:
+                    self.app.logger.exception('replica check failed')
+            time.sleep(self.check_interval)
+
+
+@contextmanager
+def use_primary():
+    """Send every read in the block to the primary."""
+    info = db.session.info
+    previous = info.get('primary')
+    info['primary'] = True
+    try:
+        yield
+    finally:
+        if previous is None:
+            info.pop('primary', None)
+
+
+@contextmanager
+def caught_up_reads(timeout=None):
+    """Read from a replica holding every write committed before the block, else the primary.
+
+    For bulk reads such as cache loads that must not miss older writes but
+    would rather not compete with commits on the primary.
+    """
+    replicas = getattr(current_app, 'db_replicas', None)
+    if replicas is None:
+        yield
+        return
+    if timeout is None:
+        timeout = 2 * replicas.check_interval
+    name = replicas.wait_for(replicas.write_heartbeat(), timeout)
+    info = db.session.info
+    saved = {key: info[key] for key in ('primary', 'replica') if key in info}
+    info.pop('primary', None)
+    if name is None:
+        info['primary'] = True
+    else:
+        info['replica'] = name
+    try:
+        yield
+    finally:
+        info.pop('primary', None)
+        info.pop('replica', None)
+        info.update(saved)
+
+
+def add_missing_columns():
+    """Add model columns that an existing database predates; create_all() only creates whole tables.
+
+    Only columns that are nullable or have a server default can be added this way.
+    """
+    inspector = sa.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(f'cannot add NOT NULL column {table.name}.{column.name} without a server default')
+                ddl = sa.schema.CreateColumn(column).compile(dialect=db.engine.dialect)
+                conn.execute(sa.text(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}'))
+
+
+def missing_schema():
+    """Model tables and columns the database lacks."""
+    inspector = sa.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing += [f'{table.name}.{column.name}' for column in table.columns if column.name not in existing]
+    return missing
+
+
+def _create_schema():
+    db.create_all()
+    add_missing_columns()
+
+
+# Schema changes the app needs, in the order they apply: name -> (pending, apply).
+# pending() lists what is missing (empty when up to date); both run in an app context.
+_migrations = {'models': (missing_schema, _create_schema)}
+
+
+def register_migration(name, pending, apply):
+    _migrations[name] = (pending, apply)
+
+
+def pending_migrations():
+    pending = {}
+    for name, (missing, _) in _migrations.items():
+        found = missing()
+        if found:
+            pending[name] = found
+    return pending
+
+
+def migrate():
+    """Apply every pending migration; returns what each one added."""
+    applied = {}
+    for name, (missing, apply) in _migrations.items():
+        found = missing()
+        if found:
+            apply()
+            applied[name] = found
+    return applied
+
+
+def check_schema(app):
+    """Create the schema of a new, empty database; for an existing one only report what is pending.
+
+    Startup never alters a database that already holds tables (such as the
+    tracked instance/example.db): run `flask --app main db-migrate`, or set
+    DB_MIGRATE_ON_START where that is wanted.
+    """
+    with app.app_context():
+        tables = set(sa.inspect(db.engine).get_table_names()) - {'replication_heartbeat'}
+        if not tables or app.config.get('DB_MIGRATE_ON_START'):
+            migrate()
+            return {}
+        return pending_migrations()
+
+
+@click.command('db-migrate')
+@with_appcontext
+def migrate_command():
+    """Create missing tables, columns and indexes in the configured database."""
+    applied = migrate()
+    if not applied:
+        click.echo('Database schema is up to date')
+    for name, changes in applied.items():
+        click.echo(f'{name}: added {", ".join(changes)}')
 
-db = SQLAlchemy()
 
 def init_db(app):
+    # Register every model on db.metadata first: create_all() only sees tables of imported models
+    from models import employee, department, location  # noqa: F401
+    replicas = {}
+    for name, options in app.config.get('SQLALCHEMY_REPLICAS', {}).items():
+        options = {'url': options} if isinstance(options, str) else dict(options)
+        replicas[name] = {key: options.pop(key) for key in _REPLICA_OPTIONS if key in options}
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[_bind_key(name)] = options
     db.init_app(app)
+    app.cli.add_command(migrate_command)
     with app.app_context():
-        db.create_all()
+        if replicas:
+            with db.engine.begin() as conn:
+                conn.execute(sa.text('CREATE TABLE IF NOT EXISTS replication_heartbeat '
+                                     '(id INTEGER PRIMARY KEY, ts REAL NOT NULL)'))
+            for name, options in replicas.items():
+                if not options.get('copy_interval'):
+                    continue
+                path = _sqlite_path(db.engines[_bind_key(name)])
+                if path is None or _sqlite_path(db.engine) is None:
+                    raise ValueError(f'replica {name!r}: copy_interval needs SQLite primary and replica files')
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if replicas:
+        app.db_replicas = ReplicaSet(app, replicas, app.config.get('SQLALCHEMY_REPLICA_MAX_LAG', REPLICA_MAX_LAG),
+                                     app.config.get('SQLALCHEMY_REPLICA_CHECK_INTERVAL', REPLICA_CHECK_INTERVAL))
+        threading.Thread(target=app.db_replicas.run, name='replica-monitor', daemon=True).start()
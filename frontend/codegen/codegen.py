@@ -1,61 +1,47 @@
-import pandas as pd
 from jinja2 import Environment, FileSystemLoader
 import jinja2
 import os 
 import shutil
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from schema_compiler import compile_schema
 code_dir = "frontend"
 os.makedirs(code_dir,exist_ok=True)
 os.makedirs(os.path.join(code_dir,"layouts"),exist_ok=True)
 os.makedirs(os.path.join(code_dir,"callbacks"),exist_ok=True)
-def read_excel_schema(file_path):
-    tables_df = pd.read_excel(file_path, sheet_name='tables')
-    relationships_df = pd.read_excel(file_path, sheet_name='relationships')
-    return tables_df, relationships_df
-
-def process_tables(tables_df):
+def process_tables(ir):
     model_schema = {}
-    for _, row in tables_df.iterrows():
-        table_name = row['tablename']
-        if table_name not in model_schema:
-            model_schema[table_name] = []
-        
-        model_schema[table_name].append({
-            'id': row['columnname'],
-            'label': row['columnname'].replace('_', ' ').title(),
-            'type': row['columntype'],
-            'editable': not row['pk'],  # Set editable to False if it's a primary key
+    for table_name in ir['order']:
+        model_schema[table_name] = [{
+            'id': column['name'],
+            'label': column['name'].replace('_', ' ').title(),
+            'type': column['type'],
+            'editable': not column['pk'],  # Set editable to False if it's a primary key
             'is_relation': False,
-            'pk': row['pk'],
+            'pk': column['pk'],
             'related_table': None,  # Initialize related_table
             'related_column': None  # Initialize related_column
-        })
+        } for column in ir['tables'][table_name]['columns']]
     return model_schema
 
-def process_relationships(relationships_df, model_schema):
+def process_relationships(ir, model_schema):
     relation_fields = {table: [] for table in model_schema}
     relation_key_table = {}
 
-    for _, row in relationships_df.iterrows():
-        table1, table2 = row['table1'], row['table2']
-        pk1, pk2 = row['table1_pk'], row['table2_pk']
+    for relationship in ir['relationships']:
+        table1, table2 = relationship['table1'], relationship['table2']
+        pk1, pk2 = relationship['table1_pk'], relationship['table2_pk']
 
-        # Update is_relation and add relationship info for table1
-        for column in model_schema[table1]:
-            if column['id'] == pk2:
-                column['is_relation'] = True
-                column['related_table'] = table2
-                column['related_column'] = pk1
-                relation_fields[table1].append(pk2)
-                relation_key_table[pk2] = table2
-
-        # Update is_relation and add relationship info for table2
-        for column in model_schema[table2]:
-            if column['id'] == pk1:
+        # Mark the column of each side that holds the other side's key, looked up by name
+        for table, other, key, other_key in ((table1, table2, pk1, pk2), (table2, table1, pk2, pk1)):
+            index = ir['tables'][table]['column_index'].get(other_key)
+            if index is not None:
+                column = model_schema[table][index]
                 column['is_relation'] = True
-                column['related_table'] = table1
-                column['related_column'] = pk2
-                relation_fields[table2].append(pk1)
-                relation_key_table[pk1] = table1
+                column['related_table'] = other
+                column['related_column'] = key
+                relation_fields[table].append(other_key)
+                relation_key_table[other_key] = other
 
         # Add reverse relationship field (e.g., post_ids for user table)
         reverse_field_name = f"{table2.lower()}_ids"
@@ -131,10 +117,10 @@ def generate_app(model_schema):
 
 def main():
     excel_file = 'schema.xlsx'
-    tables_df, relationships_df = read_excel_schema(excel_file)
+    ir = compile_schema(excel_file)
 
-    model_schema = process_tables(tables_df)
-    relation_fields, relation_key_table, model_schema = process_relationships(relationships_df, model_schema)
+    model_schema = process_tables(ir)
+    relation_fields, relation_key_table, model_schema = process_relationships(ir, model_schema)
     print("model_schema",model_schema['user'])
     generate_model_manager(model_schema, relation_fields, relation_key_table)
     generate_layouts(model_schema=model_schema)
@@ -142,6 +128,7 @@ def main():
     copy_layout_util(os.path.join('templates', 'callbacks', 'modal_callbacks_edit.py'),os.path.join(code_dir, 'callbacks', 'modal_callbacks_edit.py'))  # Add this line to copy layout_util.py
     copy_layout_util(os.path.join('templates', 'layouts', 'modal_layout.py'),os.path.join(code_dir, 'layouts', 'modal_layout.py'))  # Add this line to copy layout_util.py
     copy_layout_util(os.path.join('templates', 'layouts', '__init__.py'),os.path.join(code_dir, 'layouts', '__init__.py'))  # Add this line to copy layout_util.py
+    copy_layout_util(os.path.join('..', '..', 'sampling_profiler.py'),os.path.join(code_dir, 'sampling_profiler.py'))  # Shared with the API
 
     generate_callbacks(model_schema=model_schema)
     generate_app(model_schema=model_schema)
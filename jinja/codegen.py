@@ -1,9 +1,12 @@
 # codegen.py
 
 import os
-import pandas as pd
+import sys
 from jinja2 import Environment, FileSystemLoader
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from schema_compiler import compile_schema, snake_to_camel
+
 # Define paths
 TEMPLATES_DIR = 'templates'
 EXCEL_FILE = 'schema.xlsx'
@@ -12,58 +15,29 @@ OUTPUT_DIR = 'generated_flask_app'
 # Initialize Jinja2 environment
 env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
 
-# Helper function to convert snake_case to CamelCase
-def snake_to_camel(snake_str):
-    components = snake_str.split('_')
-    return ''.join(x.title() for x in components)
+def tables_from_ir(ir):
+    """The per-table dicts the templates expect, built from the compiled schema."""
+    tables = {}
+    for table_name in ir['order']:
+        table = ir['tables'][table_name]
+        tables[table_name] = {
+            'class_name': table['class_name'],
+            'columns': [{'columnname': column['name'], 'columntype': column['type'], 'pk': column['pk']}
+                        for column in table['columns']],
+            'relationships': [{
+                'related_table': relation['related_table'],
+                'related_class': relation['related_class'],
+                'relationship_table': relation['relationship_table'],
+                'back_populates': table_name + 's'
+            } for relation in table['relations']]
+        }
+    return tables
 
 def main():
-    # Read Excel sheets
-    tables_df = pd.read_excel(EXCEL_FILE, sheet_name='tables')
-    relationships_df = pd.read_excel(EXCEL_FILE, sheet_name='relationships')
+    ir = compile_schema(EXCEL_FILE)
+    tables = tables_from_ir(ir)
+    relationships = ir['relationships']
 
-    # Process tables
-    tables = {}
-    for _, row in tables_df.iterrows():
-        table = row['tablename']
-        column = {
-            'columnname': row['columnname'],
-            'columntype': row['columntype'],
-            'pk': row['pk']
-        }
-        if table not in tables:
-            tables[table] = {
-                'class_name': snake_to_camel(table),
-                'columns': [],
-                'relationships': []
-            }
-        tables[table]['columns'].append(column)
-
-    # Process relationships
-    relationships = []
-    for _, row in relationships_df.iterrows():
-        relationship = {
-            'relationship_table': row['relationship_table'],
-            'table1': row['table1'],
-            'table2': row['table2'],
-            'table1_pk':row['table1_pk'],
-            'table2_pk':row['table2_pk']
-        }
-        relationships.append(relationship)
-        # Update tables with relationships
-        tables[row['table1']]['relationships'].append({
-            'related_table': row['table2'],
-            'related_class': snake_to_camel(row['table2']),
-            'relationship_table': row['relationship_table'],
-            'back_populates': row['table1'] + 's'
-        })
-        tables[row['table2']]['relationships'].append({
-            'related_table': row['table1'],
-            'related_class': snake_to_camel(row['table1']),
-            'relationship_table': row['relationship_table'],
-            'back_populates': row['table2'] + 's'
-        })
-    
     # Create output directories
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     os.makedirs(os.path.join(OUTPUT_DIR, 'models'), exist_ok=True)
@@ -0,0 +1,493 @@
+# jobs.py
+# Background jobs for work too long for a request: cache reloads, search index
+# rebuilds and bulk updates. POST /jobs queues one and answers 202 at once;
+# GET /jobs/<id> reports its status and progress.
+#
+# The queue is a SQLite file of its own (JOBS_DB_PATH), so it survives
+# restarts and every worker process of the API shares it; a job is claimed
+# with a single UPDATE ... RETURNING, so each runs once. Workers are threads in
+# the API process, because a cache reload has to swap this process's caches;
+# each job runs in its own app context. Running jobs are heartbeated, and a job
+# whose process died is requeued once its heartbeat is JOBS_STALE_AFTER old
+# (or failed after JOBS_MAX_ATTEMPTS). Cancelling a queued job is immediate;
+# a running job stops at its next progress report.
+#
+# A cache reload has to happen in every API process, not whichever claims it
+# first. Each process with running workers registers itself in the processes
+# table and heartbeats there; a per-process kind (PER_PROCESS_KINDS) is queued
+# as a parent job plus one child targeted at each live process, which only
+# that process can claim. The parent never runs itself: it reports running
+# while children are, and settles with their per-process results once all
+# are finished. Children of a process that stops heartbeating fail.
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from logging_utils import get_logger
+
+log = get_logger(__name__)
+
+JOBS_WORKERS = 2
+JOBS_POLL_INTERVAL = 1.0
+JOBS_HEARTBEAT_INTERVAL = 10.0
+JOBS_STALE_AFTER = 60.0
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETENTION_SECONDS = 7 * 24 * 3600
+BULK_CHUNK_SIZE = 500
+# Progress is written to the queue at most this often per job
+PROGRESS_INTERVAL = 0.5
+# Ids listed per outcome in a bulk update's result
+MAX_REPORTED_IDS = 1000
+
+STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    target TEXT,
+    parent TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS processes (
+    id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+"""
+# Columns added since the first release of the queue, for job files that predate them
+_ADDED_COLUMNS = {'target': 'TEXT', 'parent': 'TEXT'}
+# target of a fan-out parent: never claimed, settled from its children
+FAN_OUT = '*'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    """Job rows in a SQLite file; every method opens its own short-lived connection."""
+
+    def __init__(self, path, stale_after=JOBS_STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def enqueue(self, kind, params, fan_out=False):
+        """Queue a job; with ``fan_out``, as a parent with one child per live process."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        encoded = json.dumps(params)
+        if not fan_out:
+            self._execute("INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                          (job_id, kind, encoded, now))
+            return job_id
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            processes = [row['id'] for row in conn.execute('SELECT id FROM processes WHERE heartbeat_at >= ? ORDER BY id',
+                                                           (now - self.stale_after,))]
+            conn.execute('INSERT INTO jobs (id, kind, params, status, created_at, target, error, finished_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, kind, encoded, 'queued' if processes else 'failed', now, FAN_OUT,
+                          None if processes else 'no process is running job workers', None if processes else now))
+            conn.executemany("INSERT INTO jobs (id, kind, params, status, created_at, target, parent) "
+                             "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                             [(uuid.uuid4().hex, kind, encoded, now, process, job_id) for process in processes])
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        rows = self._execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        job = _job_dict(rows[0])
+        if job['target'] == FAN_OUT:
+            job['children'] = [dict(row) for row in self._execute(
+                'SELECT id, target, status, progress, message, error FROM jobs WHERE parent = ? ORDER BY target',
+                (job_id,))]
+        return job
+
+    def list(self, status=None, limit=50):
+        if status:
+            rows = self._execute('SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?', (status, limit))
+        else:
+            rows = self._execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,))
+        return [_job_dict(row, with_params=False) for row in rows]
+
+    def claim(self, worker, process):
+        """Claim the oldest queued job that any process, or ``process`` in particular, may run."""
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+            "attempts = attempts + 1 WHERE id = (SELECT id FROM jobs WHERE status = 'queued' "
+            "AND (target IS NULL OR target = ?) ORDER BY created_at LIMIT 1) AND status = 'queued' RETURNING *",
+            (worker, now, now, process))
+        if not rows:
+            return None
+        if rows[0]['parent'] is not None:
+            self._execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+                          (now, rows[0]['parent']))
+        return rows[0]
+
+    def register(self, process):
+        """Mark ``process`` as alive and running workers, so fan-out jobs include it."""
+        self._execute('INSERT INTO processes (id, heartbeat_at) VALUES (?, ?) '
+                      'ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at', (process, time.time()))
+
+    def unregister(self, process):
+        self._execute('DELETE FROM processes WHERE id = ?', (process,))
+
+    def heartbeat(self, job_ids):
+        if job_ids:
+            placeholders = ', '.join('?' * len(job_ids))
+            self._execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders}) AND status = 'running'",
+                          (time.time(), *job_ids))
+
+    def report(self, job_id, progress, message):
+        """Record progress; returns whether cancellation has been requested."""
+        rows = self._execute('UPDATE jobs SET progress = ?, message = ?, heartbeat_at = ? WHERE id = ? '
+                             'RETURNING cancel_requested', (progress, message, time.time(), job_id))
+        return bool(rows and rows[0]['cancel_requested'])
+
+    def finish(self, job_id, status, result=None, error=None):
+        rows = self._execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, '
+                             "progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END WHERE id = ? "
+                             'RETURNING parent',
+                             (status, None if result is None else json.dumps(result), error, time.time(), status,
+                              job_id))
+        if rows and rows[0]['parent'] is not None:
+            self._settle(rows[0]['parent'])
+
+    def _settle(self, parent_id):
+        """Finish a fan-out parent once all its children have, with their results keyed by process."""
+        children = self._execute('SELECT target, status, result, error FROM jobs WHERE parent = ?', (parent_id,))
+        if any(child['status'] not in FINISHED for child in children):
+            return
+        statuses = {child['status'] for child in children}
+        status = 'succeeded' if statuses == {'succeeded'} else 'cancelled' if statuses == {'cancelled'} else 'failed'
+        result = {child['target']: json.loads(child['result']) if child['result'] is not None
+                  else {'status': child['status'], 'error': child['error']} for child in children}
+        failed = sorted(child['target'] for child in children if child['status'] == 'failed')
+        placeholders = ', '.join('?' * len(FINISHED))
+        self._execute(f'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, progress = 1 '
+                      f'WHERE id = ? AND status NOT IN ({placeholders})',
+                      (status, json.dumps(result), f'failed in {", ".join(failed)}' if failed else None, time.time(),
+                       parent_id, *FINISHED))
+
+    def cancel(self, job_id):
+        """Cancel a queued job outright or flag a running one; returns the job as it now stands.
+
+        Cancelling a fan-out parent cancels its children, and the parent settles from them.
+        """
+        now = time.time()
+        self._execute("UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                      "WHERE (id = ? OR parent = ?) AND status = 'queued' AND target IS NOT ?",
+                      (now, job_id, job_id, FAN_OUT))
+        self._execute("UPDATE jobs SET cancel_requested = 1 WHERE (id = ? OR parent = ?) AND status = 'running'",
+                      (job_id, job_id))
+        job = self.get(job_id)
+        if job is not None and job['target'] == FAN_OUT:
+            self._settle(job_id)
+            job = self.get(job_id)
+        return job
+
+    def recover(self, stale_after, max_attempts):
+        """Requeue (or fail, past max_attempts) running jobs whose process stopped heartbeating.
+
+        Jobs targeted at a process that is gone can't move elsewhere; they fail.
+        """
+        now = time.time()
+        cutoff = now - stale_after
+        self._execute('DELETE FROM processes WHERE heartbeat_at < ?', (cutoff,))
+        orphaned = self._execute(
+            "UPDATE jobs SET status = 'failed', error = 'process gone', finished_at = ? "
+            "WHERE status IN ('queued', 'running') AND target IS NOT NULL AND target IS NOT ? "
+            "AND target NOT IN (SELECT id FROM processes) RETURNING parent", (now, FAN_OUT))
+        for parent in {row['parent'] for row in orphaned if row['parent'] is not None}:
+            self._settle(parent)
+        failed = self._execute(
+            "UPDATE jobs SET status = 'failed', error = 'worker lost', finished_at = ? "
+            "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ? AND target IS NOT ? RETURNING parent",
+            (now, cutoff, max_attempts, FAN_OUT))
+        for parent in {row['parent'] for row in failed if row['parent'] is not None}:
+            self._settle(parent)
+        requeued = self._execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ? "
+            "AND target IS NOT ? RETURNING id", (cutoff, FAN_OUT))
+        return len(requeued), len(failed) + len(orphaned)
+
+    def purge(self, older_than):
+        placeholders = ', '.join('?' * len(FINISHED))
+        self._execute(f'DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?',
+                      (*FINISHED, time.time() - older_than))
+
+
+def _job_dict(row, with_params=True):
+    job = dict(row)
+    for key in ('params', 'result'):
+        if job[key] is not None:
+            job[key] = json.loads(job[key])
+    if not with_params:
+        job.pop('params')
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+
+class JobContext:
+    """Handed to a job handler: the app, the job's params, and progress reporting."""
+
+    def __init__(self, pool, job_id, params):
+        self.app = pool.app
+        self.job_id = job_id
+        self.params = params
+        self._queue = pool.queue
+        self._last_report = 0.0
+
+    def progress(self, fraction, message=None, force=False):
+        """Report progress in [0, 1]; raises JobCancelled if the job has been cancelled."""
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        if self._queue.report(self.job_id, round(fraction, 4), message):
+            raise JobCancelled()
+
+
+class JobPool:
+    """Worker threads that claim and run jobs from the queue."""
+
+    def __init__(self, app, queue, handlers, workers=JOBS_WORKERS, poll_interval=JOBS_POLL_INTERVAL):
+        self.app = app
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.running = {}
+        self.process = f'{socket.gethostname()}-{os.getpid()}'
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        self.queue.register(self.process)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(f'{os.getpid()}-{i}',), name=f'job-worker-{i}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self.queue.unregister(self.process)
+
+    def submit(self, kind, params):
+        job_id = self.queue.enqueue(kind, params, fan_out=kind in PER_PROCESS_KINDS)
+        self._wake.set()
+        return job_id
+
+    def _work(self, worker):
+        while not self._stop.is_set():
+            job = self.queue.claim(worker, self.process)
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id, kind = job['id'], job['kind']
+        context = JobContext(self, job_id, json.loads(job['params']))
+        with self._lock:
+            self.running[job_id] = kind
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                result = self.handlers[kind](context)
+        except JobCancelled:
+            self.queue.finish(job_id, 'cancelled')
+            log.info('job %s (%s) cancelled', job_id, kind)
+        except Exception as e:
+            self.queue.finish(job_id, 'failed', error=f'{type(e).__name__}: {e}')
+            log.exception('job %s (%s) failed', job_id, kind)
+        else:
+            self.queue.finish(job_id, 'succeeded', result)
+            log.info('job %s (%s) finished in %.1f s', job_id, kind, time.perf_counter() - started)
+        finally:
+            with self._lock:
+                self.running.pop(job_id, None)
+
+    def _heartbeat(self):
+        interval = min(JOBS_HEARTBEAT_INTERVAL, self.app.config.get('JOBS_STALE_AFTER', JOBS_STALE_AFTER) / 3)
+        while not self._stop.wait(interval):
+            with self._lock:
+                running = list(self.running)
+            try:
+                self.queue.register(self.process)
+                self.queue.heartbeat(running)
+                self.queue.recover(self.app.config.get('JOBS_STALE_AFTER', JOBS_STALE_AFTER),
+                                   self.app.config.get('JOBS_MAX_ATTEMPTS', JOBS_MAX_ATTEMPTS))
+            except sqlite3.Error:
+                log.exception('job heartbeat failed')
+
+
+def reload_cache(context):
+    from cache import load_cache
+    from database import db
+    from models.employee import Employee
+    from models.department import Department
+    from models.location import Location
+
+    context.progress(0, 'loading', force=True)
+    load_cache(Employee, Department, Location, db)
+    return {'rows': {name: len(getattr(context.app, name))
+                     for name in ('employee_cache', 'department_cache', 'location_cache')}}
+
+
+def rebuild_search(context):
+    from search import rebuild_index
+
+    context.progress(0, 'rebuilding', force=True)
+    return {'indexed': rebuild_index()}
+
+
+def _bulk_tables():
+    from models.employee import Employee
+    from models.department import Department
+    from models.location import Location
+
+    # Same fields the PUT routes accept
+    return {
+        'employee': (Employee, 'employee_cache', ('name', 'department_id')),
+        'department': (Department, 'department_cache', ('name', 'location_id')),
+        'location': (Location, 'location_cache', ('name',)),
+    }
+
+
+def bulk_update(context):
+    """Apply ``rows`` (each ``{'id': ..., field: value, ['version': n]}``) to ``table`` in chunks.
+
+    A row carrying a version only applies at that version, like a PUT with If-Match.
+    Each chunk is one transaction; its rows reach the cache once it commits,
+    under their row locks like a PUT's.
+    """
+    from flask import current_app
+
+    from cache import update_cache
+    from database import db, use_primary
+    from versioning import conditional_update
+
+    model, cache_name, fields = _bulk_tables()[context.params['table']]
+    rows = context.params['rows']
+    chunk_size = context.params.get('chunk_size', BULK_CHUNK_SIZE)
+    outcome = {'updated': 0, 'conflicts': [], 'missing': []}
+    # No request to route by: keep the version reads on conflict off the replicas
+    with use_primary():
+        for start in range(0, len(rows), chunk_size):
+            context.progress(start / len(rows), f'{start} of {len(rows)} rows')
+            chunk = rows[start:start + chunk_size]
+            applied = []
+            with current_app.cache_locks.many(cache_name, [row['id'] for row in chunk]):
+                try:
+                    for row in chunk:
+                        values = {field: row[field] for field in fields if field in row}
+                        versions = {row['version']} if row.get('version') is not None else None
+                        updated, current_version = conditional_update(model, row['id'], values, versions,
+                                                                      commit=False)
+                        if updated is not None:
+                            applied.append(updated)
+                        elif len(outcome['conflicts']) + len(outcome['missing']) < MAX_REPORTED_IDS:
+                            outcome['missing' if current_version is None else 'conflicts'].append(row['id'])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+                for updated in applied:
+                    update_cache(cache_name, updated['id'], updated)
+            outcome['updated'] += len(applied)
+    return outcome
+
+
+def validate_bulk_update(params):
+    table = params.get('table')
+    if table not in ('employee', 'department', 'location'):
+        return 'table must be employee, department or location'
+    rows = params.get('rows')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) and 'id' in row for row in rows):
+        return 'rows must be a list of objects with an id'
+    chunk_size = params.get('chunk_size', BULK_CHUNK_SIZE)
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size <= 0:
+        return 'chunk_size must be a positive integer'
+    return None
+
+
+# Kinds that act on process-local state, run once in every process with workers
+PER_PROCESS_KINDS = {'cache.reload'}
+
+# kind -> (handler, params validator or None)
+JOB_KINDS = {
+    'cache.reload': (reload_cache, None),
+    'search.rebuild': (rebuild_search, None),
+    'bulk.update': (bulk_update, validate_bulk_update),
+}
+
+
+def init_jobs(app):
+    if not app.config.get('JOBS_ENABLED'):
+        return
+    queue = JobQueue(app.config.get('JOBS_DB_PATH') or os.path.join(app.instance_path, 'jobs.db'),
+                     app.config.get('JOBS_STALE_AFTER', JOBS_STALE_AFTER))
+    queue.purge(app.config.get('JOBS_RETENTION_SECONDS', JOBS_RETENTION_SECONDS))
+    # Jobs can be queued right away; main._warmup starts the workers once the caches are loaded
+    app.jobs = JobPool(app, queue, {kind: handler for kind, (handler, _) in JOB_KINDS.items()},
+                       app.config.get('JOBS_WORKERS', JOBS_WORKERS),
+                       app.config.get('JOBS_POLL_INTERVAL', JOBS_POLL_INTERVAL))
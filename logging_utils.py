@@ -0,0 +1,138 @@
+# logging_utils.py
+# Logging for the app and its request paths, on top of the stdlib logging module.
+#
+#   log = get_logger(__name__)
+#   log.debug('record found: %s', record)            # formatted only if emitted
+#   log.info('loaded %s', Lazy(lambda: summary()))   # expensive args computed only if emitted
+#   log.info('cache miss', extra={'sample_rate': 0.01, 'table': name})
+#
+# Loggers from get_logger() pass through a per-call-site limiter for records
+# below WARNING: each (file, line) gets a token bucket of LOG_RATE_LIMIT records
+# per second, and records are sampled at LOG_SAMPLE_RATE (or the record's own
+# sample_rate). Warnings and errors always get through. Dropped records are
+# counted and reported on the next one the site emits as `suppressed`. Because
+# the limiter runs before any handler formats anything, a hot call site costs a
+# level check, or a record creation and a dict lookup, whatever it logs.
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+LOG_RATE_LIMIT = 20.0
+LOG_SAMPLE_RATE = 1.0
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class Lazy:
+    """Defers an expensive log argument until a handler actually formats it."""
+
+    __slots__ = ('compute',)
+
+    def __init__(self, compute):
+        self.compute = compute
+
+    def __str__(self):
+        return str(self.compute())
+
+    __repr__ = __str__
+
+
+class CallSiteLimiter(logging.Filter):
+    """Token bucket and sampling per (pathname, lineno), for records below WARNING."""
+
+    def __init__(self, rate=LOG_RATE_LIMIT, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self.sample_rate = sample_rate
+        # site -> [tokens, last refill, suppressed since last emit]
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sample_rate = getattr(record, 'sample_rate', self.sample_rate)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            self._suppress((record.pathname, record.lineno))
+            return False
+        if not self.rate:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None:
+                state = self._sites[site] = [self.rate, now, 0]
+            state[0] = min(self.rate, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            if state[0] < 1.0:
+                state[2] += 1
+                return False
+            state[0] -= 1.0
+            if state[2]:
+                record.suppressed = state[2]
+                state[2] = 0
+        return True
+
+    def _suppress(self, site):
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None:
+                state = self._sites[site] = [self.rate, time.monotonic(), 0]
+            state[2] += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, call site, message, then any extras."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'site': f'{record.module}:{record.lineno}',
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != 'sample_rate':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_limiter = CallSiteLimiter()
+
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+    if _limiter not in logger.filters:
+        logger.addFilter(_limiter)
+    return logger
+
+
+def configure_logging(config, stream=None):
+    """Apply LOG_LEVEL, LOG_FORMAT ('text' or 'json'), LOG_RATE_LIMIT and LOG_SAMPLE_RATE from ``config``.
+
+    Records go to ``stream`` (stderr by default) through a single root handler
+    that later calls reconfigure rather than duplicate.
+    """
+    _limiter.rate = config.get('LOG_RATE_LIMIT', LOG_RATE_LIMIT)
+    _limiter.sample_rate = config.get('LOG_SAMPLE_RATE', LOG_SAMPLE_RATE)
+    root = logging.getLogger()
+    root.setLevel(config.get('LOG_LEVEL', 'INFO'))
+    handler = next((handler for handler in root.handlers if getattr(handler, '_app_handler', False)), None)
+    if handler is None:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler._app_handler = True
+        root.addHandler(handler)
+    elif stream is not None:
+        handler.setStream(stream)
+    if config.get('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
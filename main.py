@@ -1,32 +1,137 @@
-from flask import Flask, current_app
-from routes.employee_routes import employee_bp
-from routes.department_routes import department_bp
-from routes.location_routes import location_bp
-from database import init_db
-from cache import load_cache
-from sample_data import insert_sample_data
-from models.employee import Employee
-from models.department import Department
-from models.location import Location
-app = Flask(__name__)
-
-
-
-# Initialize the database and create tables
-db = init_db(app)
-
-# Register Blueprints
-app.register_blueprint(employee_bp)
-app.register_blueprint(department_bp)
-app.register_blueprint(location_bp)
-
-with app.app_context():
-    insert_sample_data()
-    print("Inserted sample data")
-    load_cache(Employee, Department, Location, db)
-    print("Loaded cache")
-    print(current_app.employee_cache)
-    
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Flask, jsonify, request
+from admission import init_admission
+from database import check_schema, db, init_db
+from jobs import init_jobs
+from cache import init_cache, load_cache
+from logging_utils import configure_logging, get_logger
+from memory_stats import init_memory_stats
+from profiling import init_profiling
+from sampling_profiler import init_sampling_profiler
+from search import init_search
+from serialization import init_serialization
+from slow_queries import init_slow_queries
+from tracing import init_tracing
+from traffic_capture import init_capture
+
+log = get_logger(__name__)
+
+DEFAULT_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///example.db',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    # Insert sample rows on startup (needs a sample_data module providing insert_sample_data)
+    'SEED_SAMPLE_DATA': False,
+    # Load caches on a background thread; /ready answers 503 until they are hot
+    'WARMUP_IN_BACKGROUND': False,
+    # Shared secret for /admin/* (X-Admin-Token header); the admin endpoints answer 403 while unset
+    'ADMIN_TOKEN': None,
+    # Apply pending schema changes at startup instead of via `flask --app main db-migrate`
+    'DB_MIGRATE_ON_START': False,
+    # 'text' or 'json'; see logging_utils for LOG_RATE_LIMIT and LOG_SAMPLE_RATE
+    'LOG_LEVEL': 'INFO',
+    'LOG_FORMAT': 'text',
+}
+
+
+def create_app(config=None):
+    """Build the API app in explicit phases; nothing heavy happens at import time."""
+    app = Flask(__name__)
+    app.startup_phases = {}
+    app.ready = threading.Event()
+
+    with _phase(app, 'config'):
+        app.config.from_mapping(DEFAULT_CONFIG)
+        app.config.from_prefixed_env()
+        app.config.update(config or {})
+        configure_logging(app.config)
+        init_serialization(app)
+
+    with _phase(app, 'db'):
+        # Initialize the database; only a new, empty one gets its tables created here
+        init_db(app)
+        app.schema_pending = check_schema(app)
+        init_slow_queries(app)
+        init_cache(app)
+        init_search(app)
+        init_profiling(app)
+        init_sampling_profiler(app)
+        init_tracing(app)
+        init_memory_stats(app)
+        init_capture(app)
+        init_admission(app)
+        init_jobs(app)
+
+    with _phase(app, 'blueprints'):
+        _register_blueprints(app)
+
+    if app.schema_pending:
+        # Serve /live and /ready (503) but nothing that needs the missing schema
+        log.error('database schema is out of date, run `flask --app main db-migrate`: %s', app.schema_pending)
+        app.before_request(_refuse_until_migrated)
+    elif app.config['WARMUP_IN_BACKGROUND']:
+        threading.Thread(target=_warmup, args=(app,), name='cache-warmup', daemon=True).start()
+    else:
+        _warmup(app)
+    return app
+
+
+# Endpoints that still answer while the schema needs migrating
+SCHEMA_PENDING_ENDPOINTS = ('health_bp.live', 'health_bp.ready')
+
+
+def _refuse_until_migrated():
+    if request.endpoint not in SCHEMA_PENDING_ENDPOINTS:
+        return jsonify({'error': 'Database schema is out of date; run `flask --app main db-migrate`'}), 503
+
+
+def _register_blueprints(app):
+    from routes.employee_routes import employee_bp
+    from routes.department_routes import department_bp
+    from routes.location_routes import location_bp
+    from routes.change_routes import change_bp
+    from routes.admin_routes import admin_bp
+    from routes.health_routes import health_bp
+    from routes.search_routes import search_bp
+    from routes.job_routes import job_bp
+
+    app.register_blueprint(employee_bp)
+    app.register_blueprint(department_bp)
+    app.register_blueprint(location_bp)
+    app.register_blueprint(change_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(job_bp)
+
+
+def _warmup(app):
+    from models.employee import Employee
+    from models.department import Department
+    from models.location import Location
+
+    with app.app_context(), _phase(app, 'warmup'):
+        if app.config['SEED_SAMPLE_DATA']:
+            from sample_data import insert_sample_data
+            insert_sample_data()
+        load_cache(Employee, Department, Location, db)
+        if app.config.get('CACHE_BACKEND', 'memory') not in ('tiered', 'partitioned'):
+            # Read-through tiers and cache nodes hold no local copy to verify
+            from cache_verifier import init_verifier
+            init_verifier(app, {'employee_cache': Employee, 'department_cache': Department, 'location_cache': Location})
+    if hasattr(app, 'jobs'):
+        app.jobs.start()
+    app.ready.set()
+
+
+@contextmanager
+def _phase(app, name):
+    started = time.perf_counter()
+    yield
+    app.startup_phases[name] = round((time.perf_counter() - started) * 1000, 3)
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,216 @@
+# memory_stats.py
+# What is holding the worker's memory, for /admin/memory:
+#   * the deep size of each cache table and of the query cache (tables over
+#     MEMORY_EXACT_ROWS rows are extrapolated from an evenly spaced sample),
+#   * the identity maps of the SQLAlchemy sessions still alive in the scoped
+#     registry (or, on request, anywhere in the heap), and
+#   * tracemalloc snapshots taken on demand, reported as top allocation sites
+#     or as the difference between two snapshots.
+# tracemalloc slows every allocation, so it only runs between the first
+# snapshot request and an explicit stop.
+import gc
+import itertools
+import sys
+import threading
+import tracemalloc
+import types
+from collections import OrderedDict, deque
+
+from sqlalchemy.orm import Session
+
+from cache import CACHE_NAMES, get_snapshot
+
+MEMORY_EXACT_ROWS = 100000
+MEMORY_SAMPLE_ROWS = 10000
+MEMORY_TRACEMALLOC_FRAMES = 10
+MEMORY_MAX_SNAPSHOTS = 5
+
+# Shared by everything and not owned by any cache
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+           types.CodeType, types.FrameType)
+_ATOMIC = (str, bytes, int, float, bool, complex, type(None))
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def deep_size(obj, seen=None):
+    """Bytes reachable from ``obj`` through containers and instance attributes, each object once."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _OPAQUE):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, _ATOMIC):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        else:
+            attributes = getattr(obj, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def table_size(table, exact_rows=MEMORY_EXACT_ROWS, sample_rows=MEMORY_SAMPLE_ROWS, seen=None):
+    """Deep size of one cache table; large tables are extrapolated from a sample of rows."""
+    rows = len(table)
+    if not isinstance(table, dict):
+        # mmap and tiered tables decode rows on access; their memory isn't on the Python heap
+        return {'rows': rows, 'bytes': None, 'backend': type(table).__name__}
+    if rows <= exact_rows:
+        return {'rows': rows, 'bytes': deep_size(table, seen), 'estimated': False}
+    seen = set() if seen is None else seen
+    step = rows // sample_rows
+    sampled = list(itertools.islice(table.items(), 0, None, step))
+    sample_bytes = sum(deep_size(key, seen) + deep_size(row, seen) for key, row in sampled)
+    estimate = sys.getsizeof(table) + sample_bytes * rows // len(sampled)
+    return {'rows': rows, 'bytes': estimate, 'estimated': True, 'sampled_rows': len(sampled)}
+
+
+def cache_sizes(app):
+    """Deep size of every cache table and of the query cache.
+
+    Query cache results share row dicts with the tables; the query cache is
+    measured last and only counts what the tables don't already hold.
+    """
+    exact_rows = app.config.get('MEMORY_EXACT_ROWS', MEMORY_EXACT_ROWS)
+    sample_rows = app.config.get('MEMORY_SAMPLE_ROWS', MEMORY_SAMPLE_ROWS)
+    tables = get_snapshot().tables
+    seen = set()
+    caches = {cache_name: table_size(tables[cache_name], exact_rows, sample_rows, seen) for cache_name in CACHE_NAMES}
+    query_cache = app.query_cache
+    with query_cache._lock:
+        entries = dict(query_cache._entries)
+    caches['query_cache'] = {'entries': len(entries), 'bytes': deep_size(entries, seen)}
+    return {'caches': caches, 'total_bytes': sum(stats['bytes'] or 0 for stats in caches.values())}
+
+
+def _session_stats(session):
+    return {
+        'identity_map': len(session.identity_map),
+        'new': len(session.new),
+        'deleted': len(session.deleted),
+        'in_transaction': session.in_transaction() is not None
+    }
+
+
+def session_stats(db, scan_heap=False):
+    """Identity-map sizes of the sessions in db.session's registry, optionally of every Session alive."""
+    registry = getattr(db.session.registry, 'registry', {})
+    sessions = {str(scope): _session_stats(session) for scope, session in list(registry.items())}
+    stats = {
+        'scoped': sessions,
+        'scoped_identity_map_total': sum(session['identity_map'] for session in sessions.values())
+    }
+    if scan_heap:
+        alive = [obj for obj in gc.get_objects() if isinstance(obj, Session)]
+        stats['heap'] = {
+            'sessions': len(alive),
+            'identity_map_total': sum(len(session.identity_map) for session in alive),
+            'largest': sorted((len(session.identity_map) for session in alive), reverse=True)[:10]
+        }
+    return stats
+
+
+def process_memory():
+    """Current and peak RSS in bytes, from /proc where available."""
+    stats = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    stats['rss' if name == 'VmRSS' else 'peak_rss'] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats['peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    stats['gc_counts'] = gc.get_count()
+    return stats
+
+
+def _stat(stat, group_by):
+    frames = [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]
+    site = {'site': frames if group_by == 'traceback' else frames[0]}
+    site.update({'size_kb': round(stat.size / 1024, 1), 'count': stat.count})
+    if hasattr(stat, 'size_diff'):
+        site.update({'size_diff_kb': round(stat.size_diff / 1024, 1), 'count_diff': stat.count_diff})
+    return site
+
+
+class SnapshotStore:
+    """The last few tracemalloc snapshots, by id."""
+
+    def __init__(self, frames=MEMORY_TRACEMALLOC_FRAMES, max_snapshots=MEMORY_MAX_SNAPSHOTS):
+        self.frames = frames
+        self.max_snapshots = max_snapshots
+        self.snapshots = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Snapshot the heap, starting tracemalloc first if needed; returns (id, started)."""
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(self.frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        with self._lock:
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self.snapshots[snapshot_id] = snapshot
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+        return snapshot_id, started
+
+    def top(self, snapshot_id, group_by='lineno', limit=20):
+        snapshot = self.snapshots[snapshot_id]
+        stats = snapshot.statistics(group_by)
+        return {
+            'id': snapshot_id,
+            'total_kb': round(sum(stat.size for stat in stats) / 1024, 1),
+            'top': [_stat(stat, group_by) for stat in stats[:limit]]
+        }
+
+    def diff(self, old_id, new_id, group_by='lineno', limit=20):
+        stats = self.snapshots[new_id].compare_to(self.snapshots[old_id], group_by)
+        return {
+            'from': old_id,
+            'to': new_id,
+            'size_diff_kb': round(sum(stat.size_diff for stat in stats) / 1024, 1),
+            'top': [_stat(stat, group_by) for stat in stats[:limit]]
+        }
+
+    def status(self):
+        tracing = tracemalloc.is_tracing()
+        status = {'tracing': tracing, 'snapshots': list(self.snapshots)}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            status.update({'traced_kb': round(current / 1024, 1), 'traced_peak_kb': round(peak / 1024, 1),
+                           'overhead_kb': round(tracemalloc.get_tracemalloc_memory() / 1024, 1)})
+        return status
+
+    def stop(self):
+        tracemalloc.stop()
+        with self._lock:
+            self.snapshots.clear()
+
+
+def init_memory_stats(app):
+    app.memory_snapshots = SnapshotStore(
+        app.config.get('MEMORY_TRACEMALLOC_FRAMES', MEMORY_TRACEMALLOC_FRAMES),
+        app.config.get('MEMORY_MAX_SNAPSHOTS', MEMORY_MAX_SNAPSHOTS)
+    )
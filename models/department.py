@@ -5,3 +5,5 @@ class Department(db.Model):
     name = db.Column(db.String(100), nullable=False)
     employee = db.relationship('Employee', backref='department', uselist=False)
     location_id = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=False)
+    # Bumped by every update; clients send it back in If-Match
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
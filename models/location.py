@@ -4,3 +4,5 @@ class Location(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     departments = db.relationship('Department', backref='location', lazy=True)
+    # Bumped by every update; clients send it back in If-Match
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
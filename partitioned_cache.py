@@ -0,0 +1,567 @@
+# partitioned_cache.py
+# Cache tables partitioned by id across local cache-server processes, for
+# tables too big for one process (CACHE_BACKEND = 'partitioned').
+#
+# Each node is `python -m partitioned_cache serve [HOST:]PORT` holding plain
+# dicts; API processes talk to it over multiprocessing.connection. Requests
+# are pickled, so whoever can complete the handshake can run code in the node:
+# the shared secret in the CACHE_PARTITION_AUTHKEY environment variable is
+# required on both sides (nodes refuse to start without one), and nodes bind
+# to loopback unless given a host. Keys map to nodes by consistent hashing
+# with CACHE_PARTITION_VNODES virtual nodes each, so adding or removing one of
+# N nodes moves about 1/N of the keys. Multi-key reads fan out to the owning
+# nodes in parallel and merge.
+# Tables not listed in CACHE_PARTITIONED_TABLES stay in-process dicts.
+#
+# Ring membership lives in a small JSON file (CACHE_PARTITION_RING_PATH) that
+# every API process on the host rereads when it changes, at most every
+# check_interval. A rebalance copies the moving keys to their new owners,
+# switches the ring, waits for other processes to notice, copies again to
+# pick up writes that landed on the old owners meanwhile, then deletes them
+# there. Copies and loads merge by row version, so they never replace a newer
+# row with an older one.
+#
+# A reload streams the table from SQL straight to the nodes. Nodes stamp every
+# row with the table's current load generation; once the load has finished,
+# rows with an older stamp (deleted from SQL since the last load) are swept.
+#
+# Other API processes write straight to the nodes, so each node also counts
+# writes per table. sync(), at most every check_interval, compares those
+# counters with the last ones seen and calls on_invalidate(table) for the
+# tables that changed, so results derived from them (the app's query cache)
+# are dropped.
+import argparse
+import uuid
+import bisect
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from sqlalchemy import select
+
+from database import db
+from logging_utils import get_logger
+
+log = get_logger(__name__)
+
+CACHE_PARTITION_VNODES = 160
+CACHE_PARTITION_BIND_HOST = '127.0.0.1'
+MIN_AUTHKEY_LENGTH = 16
+CACHE_PARTITION_CHECK_INTERVAL = 0.5
+CACHE_PARTITIONED_TABLES = ('employee_cache',)
+# Keys copied per round trip while loading or rebalancing
+TRANSFER_BATCH = 5000
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with ``vnodes`` points per node."""
+
+    def __init__(self, nodes=(), vnodes=CACHE_PARTITION_VNODES):
+        self.vnodes = vnodes
+        self.nodes = []
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        points = sorted(list(zip(self._points, self._owners)) + [(_hash(f'{node}#{i}'), node) for i in range(self.vnodes)])
+        self._points = [point for point, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def remove(self, node):
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def copy(self):
+        ring = HashRing(vnodes=self.vnodes)
+        ring.nodes, ring._points, ring._owners = list(self.nodes), list(self._points), list(self._owners)
+        return ring
+
+    def node_for(self, key):
+        index = bisect.bisect(self._points, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+    def partition(self, keys):
+        """``{node: [keys it owns]}`` for ``keys``."""
+        parts = defaultdict(list)
+        for key in keys:
+            parts[self.node_for(key)].append(key)
+        return parts
+
+
+# ---- cache server -------------------------------------------------------
+
+class PartitionServer:
+    """One node's tables: key -> (load generation, row)."""
+
+    def __init__(self):
+        self.tables = defaultdict(dict)
+        self.generations = defaultdict(int)
+        # Per-table write counters; the boot id tells a restarted node's counters from the old ones
+        self.boot_id = uuid.uuid4().hex
+        self.writes = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get_many(self, table, keys):
+        rows = self.tables[table]
+        found = {}
+        for key in keys:
+            entry = rows.get(key)
+            if entry is not None:
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, table, rows):
+        with self._lock:
+            generation = self.generations[table]
+            target = self.tables[table]
+            for key, row in rows.items():
+                target[key] = (generation, row)
+            self.writes[table] += 1
+
+    def merge_many(self, table, rows):
+        """Store rows unless the node already holds a newer version; returns how many were stored."""
+        stored = 0
+        with self._lock:
+            generation = self.generations[table]
+            target = self.tables[table]
+            for key, row in rows.items():
+                current = target.get(key)
+                if current is not None:
+                    version, held = row.get('version'), current[1].get('version')
+                    if version is not None and held is not None and held > version:
+                        # Keep the newer row, but it survives this load's sweep
+                        target[key] = (generation, current[1])
+                        continue
+                target[key] = (generation, row)
+                stored += 1
+            if stored:
+                self.writes[table] += 1
+        return stored
+
+    def delete_many(self, table, keys):
+        with self._lock:
+            target = self.tables[table]
+            for key in keys:
+                target.pop(key, None)
+            self.writes[table] += 1
+
+    def keys(self, table):
+        return list(self.tables[table])
+
+    def items(self, table):
+        return [(key, entry[1]) for key, entry in list(self.tables[table].items())]
+
+    def count(self, table):
+        return len(self.tables[table])
+
+    def begin_load(self, table):
+        with self._lock:
+            self.generations[table] += 1
+            return self.generations[table]
+
+    def sweep(self, table, generation):
+        """Drop rows not written since load ``generation`` began; returns how many."""
+        with self._lock:
+            target = self.tables[table]
+            stale = [key for key, entry in target.items() if entry[0] < generation]
+            for key in stale:
+                del target[key]
+            if stale:
+                self.writes[table] += 1
+        return len(stale)
+
+    def write_stamps(self, tables):
+        """``{table: (boot id, writes)}``; a change means the table's rows changed."""
+        with self._lock:
+            return {table: (self.boot_id, self.writes[table]) for table in tables}
+
+    def stats(self):
+        return {'pid': os.getpid(), 'tables': {table: len(rows) for table, rows in self.tables.items()}}
+
+    def ping(self):
+        return True
+
+
+_OPS = ('get_many', 'set_many', 'merge_many', 'delete_many', 'keys', 'items', 'count', 'begin_load', 'sweep',
+        'write_stamps', 'stats', 'ping')
+
+
+def _parse_address(address):
+    host, _, port = str(address).rpartition(':')
+    return host or CACHE_PARTITION_BIND_HOST, int(port)
+
+
+def _authkey(authkey):
+    if not authkey or len(authkey) < MIN_AUTHKEY_LENGTH:
+        raise ValueError(f'CACHE_PARTITION_AUTHKEY must be set to a secret of at least {MIN_AUTHKEY_LENGTH} characters')
+    return authkey.encode()
+
+
+def serve(address, authkey):
+    server = PartitionServer()
+    address = _parse_address(address)
+    listener = Listener(address, authkey=_authkey(authkey))
+    log.info('cache node listening on %s:%d', *address)
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op not in _OPS:
+                        raise ValueError(f'unknown op {op}')
+                    conn.send(('ok', getattr(server, op)(*args)))
+                except Exception as e:
+                    conn.send(('error', f'{type(e).__name__}: {e}'))
+
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, OSError, EOFError):
+            # A client that failed the authkey handshake; keep serving the rest
+            continue
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+# ---- client side --------------------------------------------------------
+
+class NodeUnavailable(ConnectionError):
+    pass
+
+
+class NodeClient:
+    """Connection to one node, one socket per calling thread."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = _authkey(authkey)
+        self._local = threading.local()
+
+    def call(self, op, *args):
+        conn = getattr(self._local, 'conn', None)
+        try:
+            if conn is None:
+                conn = self._local.conn = Client(_parse_address(self.address), authkey=self.authkey)
+            conn.send((op, args))
+            status, result = conn.recv()
+        except (AuthenticationError, OSError, EOFError) as e:
+            self._local.conn = None
+            raise NodeUnavailable(f'cache node {self.address}: {e}') from e
+        if status == 'error':
+            raise RuntimeError(f'cache node {self.address}: {result}')
+        return result
+
+
+class PartitionedStore:
+    """cache.py store backend: partitioned tables on the nodes, the others in this process."""
+
+    def __init__(self, nodes, ring_path, partitioned=CACHE_PARTITIONED_TABLES, vnodes=CACHE_PARTITION_VNODES,
+                 authkey=None, loader=True, check_interval=CACHE_PARTITION_CHECK_INTERVAL,
+                 batch_size=TRANSFER_BATCH, on_invalidate=None):
+        self.partitioned = set(partitioned)
+        self.vnodes = vnodes
+        _authkey(authkey)
+        self.authkey = authkey
+        self.loader = loader
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.on_invalidate = on_invalidate
+        self.ring_path = ring_path
+        self.local = {}
+        self._clients = {}
+        self._ring = None
+        self._ring_id = None
+        self._checked_at = 0.0
+        self._write_stamps = {}
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        self._rebalance_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='cache-fanout')
+        os.makedirs(os.path.dirname(os.path.abspath(ring_path)), exist_ok=True)
+        if not os.path.exists(ring_path):
+            if not nodes:
+                raise ValueError('CACHE_PARTITION_NODES must list at least one cache node')
+            self._write_ring(list(nodes))
+        if not self.ring().nodes:
+            raise ValueError(f'the cache ring in {ring_path} has no nodes')
+
+    # -- ring membership
+
+    def _write_ring(self, nodes):
+        tmp = f'{self.ring_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'nodes': nodes, 'vnodes': self.vnodes}, f)
+        os.replace(tmp, self.ring_path)
+
+    def ring(self):
+        """The current ring, reread from the ring file if another process changed it."""
+        now = time.monotonic()
+        if self._ring is not None and now - self._checked_at < self.check_interval:
+            return self._ring
+        with self._lock:
+            self._checked_at = now
+            stat = os.stat(self.ring_path)
+            ring_id = (stat.st_ino, stat.st_mtime_ns)
+            if ring_id != self._ring_id:
+                with open(self.ring_path) as f:
+                    config = json.load(f)
+                self._ring = HashRing(config['nodes'], config.get('vnodes', self.vnodes))
+                self._ring_id = ring_id
+        return self._ring
+
+    def client(self, node):
+        client = self._clients.get(node)
+        if client is None:
+            client = self._clients[node] = NodeClient(node, self.authkey)
+        return client
+
+    def fan_out(self, calls):
+        """Run ``{node: (op, *args)}`` on every node at once; returns ``{node: result}``."""
+        if len(calls) == 1:
+            (node, call), = calls.items()
+            return {node: self.client(node).call(*call)}
+        futures = {node: self._executor.submit(self.client(node).call, *call) for node, call in calls.items()}
+        return {node: future.result() for node, future in futures.items()}
+
+    # -- row access
+
+    def get_many(self, table, keys):
+        found = {}
+        for rows in self.fan_out({node: ('get_many', table, part)
+                                  for node, part in self.ring().partition(keys).items()}).values():
+            found.update(rows)
+        return {key: found[key] for key in keys if key in found}
+
+    def items(self, table):
+        merged = []
+        for rows in self.fan_out({node: ('items', table) for node in self.ring().nodes}).values():
+            merged.extend(rows)
+        merged.sort(key=lambda item: item[0])
+        return merged
+
+    def count(self, table):
+        return sum(self.fan_out({node: ('count', table) for node in self.ring().nodes}).values())
+
+    def sync(self):
+        """Report partitioned tables written since the last check to on_invalidate, at most once per check_interval."""
+        now = time.monotonic()
+        if self.on_invalidate is None or now - self._synced_at < self.check_interval:
+            return
+        self._synced_at = now
+        names = sorted(self.partitioned)
+        try:
+            by_node = self.fan_out({node: ('write_stamps', names) for node in self.ring().nodes})
+        except (NodeUnavailable, RuntimeError):
+            # Can't tell what changed; assume everything did
+            by_node = None
+        changed = []
+        with self._lock:
+            for name in names:
+                stamp = None if by_node is None else tuple(sorted(
+                    (node, tuple(stamps[name])) for node, stamps in by_node.items()))
+                if stamp is None or stamp != self._write_stamps.get(name):
+                    changed.append(name)
+                    self._write_stamps[name] = stamp
+        for name in changed:
+            self.on_invalidate(name)
+
+    # -- cache.py store interface
+
+    def tables(self, names):
+        return {name: PartitionedTable(self, name) if name in self.partitioned else self.local.setdefault(name, {})
+                for name in names}
+
+    def write_full(self, tables, models):
+        for name, table in tables.items():
+            if name not in self.partitioned:
+                self.local[name] = table
+        if self.loader:
+            for name in self.partitioned:
+                if name in models:
+                    self.load(name, models[name])
+
+    def put(self, name, key, row):
+        if name in self.partitioned:
+            self.client(self.ring().node_for(key)).call('set_many', name, {key: row})
+        else:
+            self.local.setdefault(name, {})[key] = row
+
+    def delete(self, name, key):
+        if name in self.partitioned:
+            self.client(self.ring().node_for(key)).call('delete_many', name, [key])
+        else:
+            self.local.get(name, {}).pop(key, None)
+
+    def load(self, name, model):
+        """Stream ``model``'s table from SQL to the nodes, then sweep rows the load didn't see.
+
+        Holds the rebalance lock throughout, so the ring can't change under
+        the load and strand rows on a former owner or a removed node.
+        """
+        with self._rebalance_lock:
+            ring = self.ring()
+            generations = self.fan_out({node: ('begin_load', name) for node in ring.nodes})
+            table = model.__table__
+            result = db.session.execute(select(*table.columns).execution_options(yield_per=self.batch_size))
+            loaded = 0
+            for batch in result.mappings().partitions():
+                rows = {row['id']: dict(row) for row in batch}
+                parts = ring.partition(rows)
+                self.fan_out({node: ('merge_many', name, {key: rows[key] for key in keys})
+                              for node, keys in parts.items()})
+                loaded += len(rows)
+            swept = self.fan_out({node: ('sweep', name, generation) for node, generation in generations.items()})
+        log.info('loaded %d %s rows onto %d nodes, swept %d', loaded, name, len(ring.nodes), sum(swept.values()))
+        return loaded
+
+    # -- rebalancing
+
+    def _transfer(self, name, source, keys_by_target):
+        for target, keys in keys_by_target.items():
+            for start in range(0, len(keys), self.batch_size):
+                rows = self.client(source).call('get_many', name, keys[start:start + self.batch_size])
+                if rows:
+                    self.client(target).call('merge_many', name, rows)
+
+    def _rebalance(self, new_ring, sources):
+        """Move keys held by ``sources`` that ``new_ring`` assigns elsewhere; returns moved and total counts."""
+        moves = {}
+        total = 0
+        for name in self.partitioned:
+            for source in sources:
+                keys = self.client(source).call('keys', name)
+                total += len(keys)
+                by_target = defaultdict(list)
+                for key in keys:
+                    target = new_ring.node_for(key)
+                    if target != source:
+                        by_target[target].append(key)
+                moves[(name, source)] = by_target
+                self._transfer(name, source, by_target)
+        self._write_ring(new_ring.nodes)
+        with self._lock:
+            self._ring, self._ring_id = new_ring, None
+        # Other processes switch within check_interval; then pick up what they wrote to the old owners
+        time.sleep(self.check_interval * 2)
+        moved = 0
+        for (name, source), by_target in moves.items():
+            self._transfer(name, source, by_target)
+            for keys in by_target.values():
+                moved += len(keys)
+                if source in new_ring.nodes:
+                    self.client(source).call('delete_many', name, keys)
+        return {'moved': moved, 'total': total, 'nodes': new_ring.nodes}
+
+    def _check_rebalancer(self):
+        # Loads run only in the loader process; rebalancing there lets one lock keep the two apart
+        if not self.loader:
+            raise ValueError('rebalance from the cache loader process (CACHE_PARTITION_LOADER)')
+
+    def add_node(self, node):
+        self._check_rebalancer()
+        with self._rebalance_lock:
+            ring = self.ring()
+            if node in ring.nodes:
+                raise ValueError(f'{node} is already in the ring')
+            self.client(node).call('ping')
+            new_ring = ring.copy()
+            new_ring.add(node)
+            return self._rebalance(new_ring, ring.nodes)
+
+    def remove_node(self, node):
+        self._check_rebalancer()
+        with self._rebalance_lock:
+            ring = self.ring()
+            if node not in ring.nodes:
+                raise ValueError(f'{node} is not in the ring')
+            if len(ring.nodes) == 1:
+                raise ValueError('cannot remove the last node')
+            new_ring = ring.copy()
+            new_ring.remove(node)
+            return self._rebalance(new_ring, [node])
+
+    def stats(self):
+        ring = self.ring()
+        nodes = {}
+        for node in ring.nodes:
+            try:
+                nodes[node] = self.client(node).call('stats')
+            except NodeUnavailable as e:
+                nodes[node] = {'error': str(e)}
+        return {'vnodes': ring.vnodes, 'partitioned': sorted(self.partitioned), 'nodes': nodes}
+
+
+class PartitionedTable(Mapping):
+    """Dict-like view of one partitioned table; point reads go to the owning node.
+
+    Iteration and len() fan out to every node, which is a full scan of the table.
+    """
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __getitem__(self, key):
+        row = self.get_many([key]).get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __setitem__(self, key, row):
+        self._store.put(self._name, key, row)
+
+    def __delitem__(self, key):
+        self._store.delete(self._name, key)
+
+    def get_many(self, keys):
+        return self._store.get_many(self._name, keys)
+
+    def __iter__(self):
+        return iter([key for key, row in self._store.items(self._name)])
+
+    def __len__(self):
+        return self._store.count(self._name)
+
+    def items(self):
+        return self._store.items(self._name)
+
+    def values(self):
+        return [row for key, row in self._store.items(self._name)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a partitioned cache node')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subcommands.add_parser('serve')
+    serve_parser.add_argument('address', help=f'[HOST:]PORT to listen on (host defaults to {CACHE_PARTITION_BIND_HOST})')
+    args = parser.parse_args()
+    try:
+        serve(args.address, os.environ.get('CACHE_PARTITION_AUTHKEY'))
+    except ValueError as e:
+        sys.exit(f'refusing to start: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# profiling.py
+# On-demand per-request profiling.
+#
+# Nothing is registered unless PROFILING_ENABLED is set, so the hook costs nothing
+# when switched off. When on, a request is profiled if either:
+#   * it carries ?__profile=1 and an X-Profile-Token header matching
+#     PROFILING_TOKEN; the profile replaces the response body
+#     (?__profile=store writes it to PROFILING_DIR instead), or
+#   * it carries an X-Profile-Sample header and wins a PROFILING_SAMPLE_RATE
+#     coin flip; those profiles always go to PROFILING_DIR.
+# A profile is a call tree with wall times, the SQL statements run while it was
+# active (attached to the call that issued them), and a folded-stack rendering
+# that flamegraph.pl / speedscope accept.
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Calls shorter than this are folded into their parent to keep the tree small
+MIN_NODE_MS = 0.05
+
+_local = threading.local()
+
+
+class CallTreeProfiler:
+    """Builds a wall-clock call tree for the current thread via sys.setprofile."""
+
+    def __init__(self):
+        self.root = _node('request')
+        self.root['calls'] = 1
+        self._stack = [(self.root, time.perf_counter())]
+        self.sql = []
+
+    def start(self):
+        _local.profiler = self
+        sys.setprofile(self._callback)
+
+    def stop(self):
+        sys.setprofile(None)
+        _local.profiler = None
+        now = time.perf_counter()
+        # Close anything still open, e.g. the after_request hook that called us
+        while len(self._stack) > 1:
+            node, started = self._stack.pop()
+            node['time'] += now - started
+        node, started = self._stack[0]
+        node['time'] = now - started
+
+    def add_sql(self, statement, duration):
+        record = {'sql': statement, 'ms': round(duration * 1000, 3)}
+        self.sql.append(record)
+        self._stack[-1][0].setdefault('sql', []).append(record)
+
+    def _callback(self, frame, event_name, arg):
+        if event_name == 'call' or event_name == 'c_call':
+            if event_name == 'call':
+                code = frame.f_code
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            else:
+                name = f"{getattr(arg, '__qualname__', arg)} (builtin)"
+            children = self._stack[-1][0]['children']
+            node = children.get(name)
+            if node is None:
+                node = children[name] = _node(name)
+            node['calls'] += 1
+            self._stack.append((node, time.perf_counter()))
+        elif len(self._stack) > 1:
+            # return / c_return / c_exception; frames entered before start() never pushed
+            node, started = self._stack.pop()
+            node['time'] += time.perf_counter() - started
+
+    def tree(self, min_ms=MIN_NODE_MS):
+        return _export(self.root, min_ms / 1000)
+
+    def folded(self):
+        lines = []
+        _fold(self.root, [], lines)
+        return '\n'.join(lines) + '\n'
+
+
+def _node(name):
+    return {'name': name, 'calls': 0, 'time': 0.0, 'children': {}}
+
+
+def _export(node, min_seconds):
+    children = sorted(node['children'].values(), key=lambda child: child['time'], reverse=True)
+    exported = {
+        'name': node['name'],
+        'calls': node['calls'],
+        'ms': round(node['time'] * 1000, 3),
+        'children': [_export(child, min_seconds) for child in children
+                     if child['time'] >= min_seconds or child.get('sql')]
+    }
+    if node.get('sql'):
+        exported['sql'] = node['sql']
+    return exported
+
+
+def _fold(node, path, lines):
+    path = path + [node['name'].replace(';', ':')]
+    self_time = node['time'] - sum(child['time'] for child in node['children'].values())
+    if self_time > 0:
+        lines.append(f"{';'.join(path)} {int(self_time * 1_000_000)}")
+    for child in node['children'].values():
+        _fold(child, path, lines)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profiler', None) is not None:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiler = getattr(_local, 'profiler', None)
+    started = conn.info.get('profile_started')
+    if profiler is not None and started:
+        profiler.add_sql(statement, time.perf_counter() - started.pop())
+
+
+def _wants_profile():
+    config = current_app.config
+    mode = request.args.get('__profile')
+    if mode:
+        token = config.get('PROFILING_TOKEN')
+        supplied = request.headers.get('X-Profile-Token', '')
+        if token and hmac.compare_digest(token, supplied):
+            return 'store' if mode == 'store' else 'response'
+        return None
+    if 'X-Profile-Sample' in request.headers and random.random() < config.get('PROFILING_SAMPLE_RATE', 0.0):
+        return 'store'
+    return None
+
+
+def _start_profile():
+    mode = _wants_profile()
+    if mode is not None:
+        g.profile_mode = mode
+        g.profiler = CallTreeProfiler()
+        g.profiler.start()
+
+
+def _finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.stop()
+    profile = {
+        'method': request.method,
+        'path': request.full_path,
+        'status': response.status_code,
+        'ms': round(profiler.root['time'] * 1000, 3),
+        'sql_ms': round(sum(record['ms'] for record in profiler.sql), 3),
+        'sql_count': len(profiler.sql),
+        'tree': profiler.tree()
+    }
+    if g.pop('profile_mode') == 'response':
+        if request.args.get('__profile_format') == 'folded':
+            return current_app.response_class(profiler.folded(), mimetype='text/plain')
+        return jsonify(profile)
+    profile_id = _store(profile, profiler.folded())
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def _abandon_profile(exc):
+    # after_request is skipped when an exception propagates; never leave the tracer on
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+
+def _store(profile, folded):
+    directory = current_app.config.get('PROFILING_DIR') or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{random.getrandbits(32):08x}"
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump(profile, f)
+    with open(os.path.join(directory, f'{profile_id}.folded'), 'w') as f:
+        f.write(folded)
+    return profile_id
+
+
+def init_profiling(app):
+    if not app.config.get('PROFILING_ENABLED'):
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abandon_profile)
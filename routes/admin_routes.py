@@ -0,0 +1,141 @@
+import hmac
+
+from flask import Blueprint, jsonify, request
+from flask import current_app
+from cache import get_change_log, get_query_cache, get_single_flight
+from database import db
+from memory_stats import cache_sizes, process_memory, session_stats
+admin_bp = Blueprint('admin_bp', __name__)
+
+@admin_bp.before_request
+def require_admin_token():
+    # Admin endpoints can reload caches, rebalance nodes and start tracemalloc; off unless ADMIN_TOKEN is set
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'error': 'Admin endpoints are disabled; set ADMIN_TOKEN'}), 403
+    if not hmac.compare_digest(token, request.headers.get('X-Admin-Token', '')):
+        return jsonify({'error': 'X-Admin-Token required'}), 403
+
+@admin_bp.route('/admin/cache/stats', methods=['GET'])
+def get_cache_stats():
+    change_log = get_change_log()
+    stats = {
+        'query_cache': get_query_cache().stats(),
+        'single_flight': get_single_flight().stats(),
+        'change_log': {'epoch': change_log.epoch, 'version': change_log.version}
+    }
+    store = current_app.cache_store
+    if hasattr(store, 'stats'):
+        stats['tiers'] = store.stats()
+    return jsonify(stats)
+
+@admin_bp.route('/admin/cache/nodes', methods=['POST'])
+def rebalance_cache_nodes():
+    store = current_app.cache_store
+    if not hasattr(store, 'add_node'):
+        return jsonify({'error': 'cache is not partitioned'}), 404
+    body = request.get_json(silent=True) or {}
+    try:
+        if body.get('add'):
+            return jsonify(store.add_node(body['add']))
+        if body.get('remove'):
+            return jsonify(store.remove_node(body['remove']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'error': 'expected {"add": "host:port"} or {"remove": "host:port"}'}), 400
+
+@admin_bp.route('/admin/cache/verify', methods=['GET', 'POST'])
+def verify_cache():
+    verifier = getattr(current_app, 'cache_verifier', None)
+    if verifier is None:
+        return jsonify({'error': 'Cache verification is not available for this backend'}), 404
+    if request.method == 'POST':
+        drift = verifier.run()
+        return jsonify({'drift': drift, 'stats': verifier.stats})
+    return jsonify(verifier.stats)
+
+@admin_bp.route('/admin/db/replicas', methods=['GET'])
+def get_replicas():
+    replicas = getattr(current_app, 'db_replicas', None)
+    if replicas is None:
+        return jsonify({'replicas': {}, 'max_lag_seconds': None})
+    return jsonify({'replicas': replicas.stats, 'max_lag_seconds': replicas.max_lag})
+
+@admin_bp.route('/admin/admission', methods=['GET'])
+def get_admission_stats():
+    admission = getattr(current_app, 'admission', None)
+    if admission is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'classes': admission.stats()})
+
+@admin_bp.route('/admin/traces', methods=['GET'])
+def get_traces():
+    exporter = getattr(current_app, 'trace_exporter', None)
+    if not hasattr(exporter, 'traces'):
+        return jsonify({'error': 'Set TRACING_EXPORTER=memory to collect traces in process'}), 404
+    return jsonify({'traces': exporter.traces(request.args.get('limit', 20, type=int))})
+
+@admin_bp.route('/admin/memory', methods=['GET'])
+def get_memory():
+    return jsonify({
+        'process': process_memory(),
+        **cache_sizes(current_app),
+        'sessions': session_stats(db, scan_heap=request.args.get('scan_heap') == '1'),
+        'tracemalloc': current_app.memory_snapshots.status()
+    })
+
+@admin_bp.route('/admin/memory/snapshots', methods=['POST'])
+def take_memory_snapshot():
+    snapshot_id, started = current_app.memory_snapshots.take()
+    # The first snapshot only marks when tracing began; diff later ones against it
+    result = current_app.memory_snapshots.top(snapshot_id, limit=request.args.get('limit', 20, type=int))
+    return jsonify({'tracing_started': started, **result}), 201
+
+@admin_bp.route('/admin/memory/snapshots', methods=['GET'])
+def list_memory_snapshots():
+    return jsonify(current_app.memory_snapshots.status())
+
+@admin_bp.route('/admin/memory/snapshots', methods=['DELETE'])
+def stop_memory_tracing():
+    current_app.memory_snapshots.stop()
+    return '', 204
+
+@admin_bp.route('/admin/memory/snapshots/<int:snapshot_id>', methods=['GET'])
+def get_memory_snapshot(snapshot_id):
+    group_by = request.args.get('group_by', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'group_by must be lineno, filename or traceback'}), 400
+    if snapshot_id not in current_app.memory_snapshots.snapshots:
+        return jsonify({'error': 'Snapshot not found'}), 404
+    return jsonify(current_app.memory_snapshots.top(snapshot_id, group_by, request.args.get('limit', 20, type=int)))
+
+@admin_bp.route('/admin/memory/snapshots/<int:old_id>/diff/<int:new_id>', methods=['GET'])
+def diff_memory_snapshots(old_id, new_id):
+    group_by = request.args.get('group_by', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'group_by must be lineno, filename or traceback'}), 400
+    snapshots = current_app.memory_snapshots.snapshots
+    if old_id not in snapshots or new_id not in snapshots:
+        return jsonify({'error': 'Snapshot not found'}), 404
+    return jsonify(current_app.memory_snapshots.diff(old_id, new_id, group_by, request.args.get('limit', 20, type=int)))
+
+@admin_bp.route('/admin/queries', methods=['GET'])
+def get_query_stats():
+    stats = getattr(current_app, 'query_stats', None)
+    if stats is None:
+        return jsonify({'error': 'Set SLOW_QUERY_LOG to collect statement timings'}), 404
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in ('total_ms', 'p99_ms', 'max_ms', 'count', 'slow_count', 'mean_ms'):
+        return jsonify({'error': 'sort must be total_ms, p99_ms, max_ms, mean_ms, count or slow_count'}), 400
+    return jsonify({
+        'threshold_ms': stats.threshold_ms,
+        'untracked_statements': stats.overflow,
+        'statements': stats.top(sort, request.args.get('limit', 50, type=int))
+    })
+
+@admin_bp.route('/admin/queries', methods=['DELETE'])
+def reset_query_stats():
+    stats = getattr(current_app, 'query_stats', None)
+    if stats is not None:
+        stats.reset()
+    return '', 204
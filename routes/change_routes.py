@@ -0,0 +1,65 @@
+from flask import Blueprint, Response, jsonify, request
+from flask import current_app
+from cache import ResyncRequired, get_change_log
+change_bp = Blueprint('change_bp', __name__)
+
+# Upper bound for ?wait= so a long-poll can't pin a worker thread forever
+MAX_WAIT_SECONDS = 60
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def _record_to_dict(record):
+    version, table, op, row = record
+    return {'version': version, 'table': table, 'op': op, 'row': row}
+
+
+def _resync_response(change_log):
+    return jsonify({
+        'error': 'resync required',
+        'epoch': change_log.epoch,
+        'version': change_log.version
+    }), 410
+
+
+def _stream_changes(app, change_log, since):
+    version = since
+    while True:
+        try:
+            records = change_log.wait(version, SSE_HEARTBEAT_SECONDS)
+        except ResyncRequired:
+            payload = app.json.dumps({'epoch': change_log.epoch, 'version': change_log.version})
+            yield f"event: resync\ndata: {payload}\n\n"
+            return
+        if not records:
+            yield ": keepalive\n\n"
+            continue
+        for record in records:
+            version = record[0]
+            yield f"id: {version}\nevent: change\ndata: {app.json.dumps(_record_to_dict(record))}\n\n"
+
+
+@change_bp.route('/changes', methods=['GET'])
+def get_changes():
+    change_log = get_change_log()
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    epoch = request.args.get('epoch')
+    if since is None or (epoch and epoch != change_log.epoch):
+        return _resync_response(change_log)
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        app = current_app._get_current_object()
+        return Response(_stream_changes(app, change_log, since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    wait = min(request.args.get('wait', 0, type=float), MAX_WAIT_SECONDS)
+    try:
+        records = change_log.wait(since, wait) if wait > 0 else change_log.since(since)
+    except ResyncRequired:
+        return _resync_response(change_log)
+    return jsonify({
+        'epoch': change_log.epoch,
+        'version': records[-1][0] if records else since,
+        'changes': [_record_to_dict(record) for record in records]
+    })
@@ -1,24 +1,34 @@
 from flask import Blueprint, jsonify, request
-from database import db
+from versioning import versioned_put, with_etag
 from models.department import Department
 from flask import current_app
+from cache import as_dict, cached_query, get_table, normalize_params
 department_bp = Blueprint('department_bp', __name__)
 
+def _filter_departments(departments, location_ids, q):
+    return {
+        department_id: department for department_id, department in departments.items()
+        if (location_ids is None or department['location_id'] in location_ids)
+        and (q is None or q in department['name'].lower())
+    }
+
 @department_bp.route('/departments', methods=['GET'])
 def get_departments():
-    return current_app.department_cache
+    params = normalize_params(request.args, ('location_id', 'q'))
+    if not params:
+        return as_dict(get_table('department_cache'))
+    location_ids = set(request.args.getlist('location_id', type=int)) or None
+    q = request.args.get('q', '').strip().lower() or None
+    departments = get_table('department_cache')
+    return cached_query('departments', params, ('department',),
+                        lambda: _filter_departments(departments, location_ids, q))
 
 @department_bp.route('/department/<int:department_id>', methods=['GET'])
 def get_department(department_id):
-    return current_app.deparment_cache.get(department_id,{})
+    department = get_table('department_cache').get(department_id)
+    if department is None:
+        return {}
+    return with_etag(department, department)
 @department_bp.route('/department/<int:department_id>', methods=['PUT'])
 def update_department(department_id):
-    data = request.json
-    department = department_cache.get(department_id)
-    if department:
-        department.name = data.get('name', department.name)
-        department.location_id = data.get('location_id', department.location_id)
-        db.session.commit()
-        update_cache(current_app.department_cache, department_id, department)
-        return jsonify({'message': 'Department updated'})
-    return jsonify({'error': 'Department not found'}), 404
+    return versioned_put(Department, 'department_cache', department_id, ('name', 'location_id'), 'Department')
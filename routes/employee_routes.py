@@ -1,26 +1,51 @@
 from flask import Blueprint, jsonify, request
-from database import db
+from versioning import versioned_put, with_etag
 from models.employee import Employee
 from flask import current_app
+from cache import as_dict, cached_query, get_many, get_snapshot, get_table, normalize_params
 employee_bp = Blueprint('employee_bp', __name__)
 
+def _filter_employees(employees, departments, department_ids, location_ids, q):
+    if location_ids:
+        in_location = {department['id'] for department in departments.values() if department['location_id'] in location_ids}
+        department_ids = in_location if department_ids is None else department_ids & in_location
+    return {
+        employee_id: employee for employee_id, employee in employees.items()
+        if (department_ids is None or employee['department_id'] in department_ids)
+        and (q is None or q in employee['name'].lower())
+    }
+
 @employee_bp.route('/employees', methods=['GET'])
 def get_employees():
-    
-    return current_app.employee_cache
+    params = normalize_params(request.args, ('id', 'department_id', 'location_id', 'q'))
+    if not params:
+        return as_dict(get_table('employee_cache'))
+    try:
+        ids = [int(value) for value in request.args.getlist('id')]
+    except ValueError:
+        return jsonify({'error': 'id must be an integer'}), 400
+    department_ids = set(request.args.getlist('department_id', type=int)) or None
+    location_ids = set(request.args.getlist('location_id', type=int)) or None
+    q = request.args.get('q', '').strip().lower() or None
+    snapshot = get_snapshot()
+    employees, departments = snapshot.tables['employee_cache'], snapshot.tables['department_cache']
+    if ids:
+        # Point lookups: one round trip per cache node rather than a filtered scan
+        found = get_many('employee_cache', ids)
+        if department_ids is None and location_ids is None and q is None:
+            return found
+        return _filter_employees(found, departments, department_ids, location_ids, q)
+    tables = ('employee', 'department') if location_ids else ('employee',)
+    return cached_query('employees', params, tables,
+                        lambda: _filter_employees(employees, departments, department_ids, location_ids, q))
 
 @employee_bp.route('/employee/<int:employee_id>', methods=['GET'])
 def get_employee(employee_id):
-    return current_app.employee_cache.get(employee_id,{})
+    employee = get_table('employee_cache').get(employee_id)
+    if employee is None:
+        return {}
+    return with_etag(employee, employee)
 
 @employee_bp.route('/employee/<int:employee_id>', methods=['PUT'])
 def update_employee(employee_id):
-    data = request.json
-    employee = current_app.employee_cache.get(employee_id)
-    if employee:
-        employee.name = data.get('name', employee.name)
-        employee.department_id = data.get('department_id', employee.department_id)
-        db.session.commit()
-        update_cache(current_app.employee_cache, employee_id, employee)
-        return jsonify({'message': 'Employee updated'})
-    return jsonify({'error': 'Employee not found'}), 404
+    return versioned_put(Employee, 'employee_cache', employee_id, ('name', 'department_id'), 'Employee')
@@ -0,0 +1,15 @@
+from flask import Blueprint, jsonify
+from flask import current_app
+health_bp = Blueprint('health_bp', __name__)
+
+@health_bp.route('/live', methods=['GET'])
+def live():
+    return jsonify({'live': True})
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    is_ready = current_app.ready.is_set()
+    body = {'ready': is_ready, 'startup_phases_ms': current_app.startup_phases}
+    if getattr(current_app, 'schema_pending', None):
+        body['schema_pending'] = current_app.schema_pending
+    return jsonify(body), 200 if is_ready else 503
@@ -0,0 +1,71 @@
+from flask import Blueprint, jsonify, request, url_for
+from flask import current_app
+from jobs import FINISHED, JOB_KINDS, STATUSES
+job_bp = Blueprint('job_bp', __name__)
+
+def _pool():
+    return getattr(current_app, 'jobs', None)
+
+def _disabled():
+    return jsonify({'error': 'Background jobs are disabled; set JOBS_ENABLED'}), 404
+
+def _summarize_params(job):
+    # Bulk payloads can be large; report how many rows rather than echoing them
+    params = job.get('params') or {}
+    if isinstance(params.get('rows'), list):
+        job['params'] = {**params, 'rows': len(params['rows'])}
+    return job
+
+@job_bp.route('/jobs', methods=['POST'])
+def create_job():
+    pool = _pool()
+    if pool is None:
+        return _disabled()
+    data = request.json or {}
+    kind = data.get('kind')
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f'Unknown job kind: {kind}', 'kinds': list(JOB_KINDS)}), 400
+    params = data.get('params') or {}
+    validate = JOB_KINDS[kind][1]
+    error = validate(params) if validate is not None else None
+    if error:
+        return jsonify({'error': error}), 400
+    job_id = pool.submit(kind, params)
+    response = jsonify({'id': job_id, 'kind': kind, 'status': 'queued'})
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_bp.get_job', job_id=job_id)
+    return response
+
+@job_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    pool = _pool()
+    if pool is None:
+        return _disabled()
+    status = request.args.get('status')
+    if status is not None and status not in STATUSES:
+        return jsonify({'error': f'status must be one of {", ".join(STATUSES)}'}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    return jsonify({'jobs': pool.queue.list(status, limit)})
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    pool = _pool()
+    if pool is None:
+        return _disabled()
+    job = pool.queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_summarize_params(job))
+
+@job_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    pool = _pool()
+    if pool is None:
+        return _disabled()
+    job = pool.queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] in FINISHED:
+        return jsonify({'error': f'Job already {job["status"]}'}), 409
+    job = pool.queue.cancel(job_id)
+    return jsonify(_summarize_params(job)), 202 if job['status'] == 'running' else 200
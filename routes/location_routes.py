@@ -1,33 +1,35 @@
 from flask import Blueprint, jsonify, request
-from database import db
+from versioning import versioned_put, with_etag
 from models.location import Location
 from flask import current_app
+from cache import cached_query, get_table, normalize_params
 location_bp = Blueprint('location_bp', __name__)
 
+def _list_locations(locations, q):
+    return [{
+        'id': loc['id'],
+        'name': loc['name']
+    } for loc in locations.values() if q is None or q in loc['name'].lower()]
+
 @location_bp.route('/locations', methods=['GET'])
 def get_locations():
-    return jsonify([{
-        'id': loc.id,
-        'name': loc.name
-    } for loc in current_app.location_cache.values()])
+    params = normalize_params(request.args, ('q',))
+    q = request.args.get('q', '').strip().lower() or None
+    locations = get_table('location_cache')
+    if not params:
+        return jsonify(_list_locations(locations, q))
+    return jsonify(cached_query('locations', params, ('location',), lambda: _list_locations(locations, q)))
 
 @location_bp.route('/location/<int:location_id>', methods=['GET'])
 def get_location(location_id):
-    location = current_app.location_cache.get(location_id)
+    location = get_table('location_cache').get(location_id)
     if location:
-        return jsonify({
-            'id': location.id,
-            'name': location.name
-        })
+        return with_etag({
+            'id': location['id'],
+            'name': location['name']
+        }, location)
     return jsonify({'error': 'Location not found'}), 404
 
 @location_bp.route('/location/<int:location_id>', methods=['PUT'])
 def update_location(location_id):
-    data = request.json
-    location = current_app.location_cache.get(location_id)
-    if location:
-        location.name = data.get('name', location.name)
-        db.session.commit()
-        update_cache(location_cache, location_id, location)
-        return jsonify({'message': 'Location updated'})
-    return jsonify({'error': 'Location not found'}), 404
+    return versioned_put(Location, 'location_cache', location_id, ('name',), 'Location')
@@ -0,0 +1,22 @@
+from flask import Blueprint, jsonify, request
+from search import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, TYPE_CODES, search
+search_bp = Blueprint('search_bp', __name__)
+
+@search_bp.route('/search', methods=['GET'])
+def search_names():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': 'q is required'}), 400
+    types = [name for value in request.args.getlist('types') for name in value.split(',') if name]
+    unknown = [name for name in types if name not in TYPE_CODES]
+    if unknown:
+        return jsonify({'error': f'Unknown types: {", ".join(unknown)}', 'types': list(TYPE_CODES)}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    results, has_more = search(q, types, page, per_page)
+    return jsonify({
+        'results': results,
+        'page': page,
+        'per_page': per_page,
+        'next_page': page + 1 if has_more else None
+    })
@@ -0,0 +1,265 @@
+# sampling_profiler.py
+# Process-wide statistical profiler, cheap enough to leave on. A daemon thread
+# wakes SAMPLING_PROFILER_HZ times a second, grabs every thread's Python stack
+# with sys._current_frames() and counts it as a folded stack
+# ("thread;outer (file:line);...;inner (file:line)"). Counts accumulate for the
+# life of the process in a table capped at SAMPLING_PROFILER_MAX_STACKS
+# distinct stacks; samples of new stacks beyond the cap are only counted as
+# dropped.
+#
+# GET /debug/flamegraph?seconds=30 (with an X-Profile-Token header matching
+# SAMPLING_PROFILER_TOKEN) waits that long and returns what was sampled
+# meanwhile (seconds=0 returns everything since start), as folded stacks for
+# flamegraph.pl / speedscope, or with format=svg as a flame graph.
+# Threads parked in a wait are left out unless idle=1. Without a token
+# configured the profiler isn't started and the routes aren't registered.
+#
+# This module depends only on Flask, so the Dash frontend (whose server is a
+# Flask app) uses it too; frontend/codegen copies it next to the generated app.
+import hmac
+import html
+import math
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+
+from flask import current_app, request
+
+SAMPLING_PROFILER_HZ = 19
+SAMPLING_PROFILER_MAX_STACKS = 20000
+SAMPLING_PROFILER_MAX_SECONDS = 300
+# Code objects whose labels are cached before the cache is reset
+MAX_LABELS = 50000
+# Leaf functions of a thread that is blocked rather than running
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'accept', 'sleep', '_wait_for_tstate_lock', 'readinto', 'recv_into'}
+SVG_WIDTH = 1200
+SVG_ROW = 16
+# Frames narrower than this many pixels are left out of the SVG
+SVG_MIN_WIDTH = 0.3
+
+_THREAD_NUMBER = re.compile(r'-\d+')
+_profiler = None
+
+
+class SamplingProfiler:
+    """Samples all thread stacks on a background thread and counts them as folded stacks."""
+
+    def __init__(self, hz=SAMPLING_PROFILER_HZ, max_stacks=SAMPLING_PROFILER_MAX_STACKS):
+        self.hz = hz
+        self.max_stacks = max_stacks
+        self.counts = {}
+        self.samples = 0
+        self.dropped = 0
+        # Time spent inside _sample, to report the profiler's own overhead
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self._labels = {}
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = 1.0 / self.hz
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            self._sample(own)
+            self.busy_seconds += time.perf_counter() - started
+            next_sample += interval
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # Fell behind (e.g. a long GIL hold); skip the missed ticks rather than burst
+                next_sample, delay = time.monotonic(), 0
+            self._stop.wait(delay)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            if len(self._labels) >= MAX_LABELS:
+                self._labels.clear()
+            label = self._labels[code] = (
+                f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':'))
+        return label
+
+    def _thread_name(self, ident):
+        name = self._thread_names.get(ident)
+        if name is None:
+            # Request threads are numbered; fold them together so they share stacks
+            self._thread_names = {thread.ident: _THREAD_NUMBER.sub('', thread.name)
+                                  for thread in threading.enumerate()}
+            name = self._thread_names.get(ident, 'thread')
+        return name
+
+    def _sample(self, own):
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(self._thread_name(ident))
+            stack.reverse()
+            stacks.append(';'.join(stack))
+        with self._lock:
+            self.samples += 1
+            counts = self.counts
+            for stack in stacks:
+                if stack in counts:
+                    counts[stack] += 1
+                elif len(counts) < self.max_stacks:
+                    counts[stack] = 1
+                else:
+                    self.dropped += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts), self.samples
+
+    def collect(self, seconds):
+        """Stack counts sampled over the next ``seconds`` (everything so far if 0), and the sample count."""
+        before, samples_before = self.snapshot() if seconds else ({}, 0)
+        if seconds:
+            self._stop.wait(seconds)
+        after, samples_after = self.snapshot()
+        counts = {}
+        for stack, count in after.items():
+            count -= before.get(stack, 0)
+            if count:
+                counts[stack] = count
+        return counts, samples_after - samples_before
+
+    def stats(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            'hz': self.hz,
+            'samples': self.samples,
+            'stacks': len(self.counts),
+            'max_stacks': self.max_stacks,
+            'dropped': self.dropped,
+            'overhead': round(self.busy_seconds / elapsed, 5) if elapsed else None
+        }
+
+
+def without_idle(counts):
+    return {stack: count for stack, count in counts.items()
+            if stack.rsplit(';', 1)[-1].split(' (', 1)[0] not in IDLE_FUNCTIONS}
+
+
+def folded(counts):
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items()))
+
+
+def render_svg(counts, title='Flame graph', width=SVG_WIDTH):
+    """A self-contained flame graph (root at the bottom) with a tooltip on every frame."""
+    root = {'count': 0, 'children': {}}
+    for stack, count in counts.items():
+        node = root
+        node['count'] += count
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'count': 0, 'children': {}})
+            node['count'] += count
+    total = root['count'] or 1
+    scale = width / total
+    rects = []
+
+    def place(node, name, x, depth):
+        frame_width = node['count'] * scale
+        if frame_width < SVG_MIN_WIDTH:
+            return
+        rects.append((name, x, depth, frame_width, node['count']))
+        for child_name, child in sorted(node['children'].items()):
+            place(child, child_name, x, depth + 1)
+            x += child['count'] * scale
+
+    x = 0.0
+    for name, child in sorted(root['children'].items()):
+        place(child, name, x, 0)
+        x += child['count'] * scale
+    depth = max((rect[2] for rect in rects), default=0) + 1
+    height = (depth + 2) * SVG_ROW
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="{width / 2}" y="{SVG_ROW - 3}" text-anchor="middle" font-size="13">'
+        f'{html.escape(title)} ({total} samples)</text>'
+    ]
+    for name, x, depth, frame_width, count in rects:
+        y = height - (depth + 1) * SVG_ROW
+        hue = zlib.crc32(name.encode()) % 60
+        label = html.escape(name)
+        chars = int(frame_width / 7)
+        text = '' if chars < 3 else html.escape(name if len(name) <= chars else name[:chars - 2] + '..')
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count * 100 / total:.2f}%)</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{frame_width:.2f}" height="{SVG_ROW - 1}" '
+            f'fill="hsl({hue}, 90%, 60%)" rx="2"/>'
+            f'<text x="{x + 3:.2f}" y="{y + SVG_ROW - 4}">{text}</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def flamegraph():
+    config = current_app.config
+    if not hmac.compare_digest(config['SAMPLING_PROFILER_TOKEN'], request.headers.get('X-Profile-Token', '')):
+        return {'error': 'X-Profile-Token required'}, 403
+    max_seconds = config.get('SAMPLING_PROFILER_MAX_SECONDS', SAMPLING_PROFILER_MAX_SECONDS)
+    seconds = request.args.get('seconds', 30, type=float)
+    if not math.isfinite(seconds):
+        return {'error': 'seconds must be a finite number'}, 400
+    seconds = min(max(seconds, 0), max_seconds)
+    profiler = current_app.sampling_profiler
+    counts, samples = profiler.collect(seconds)
+    if request.args.get('idle') != '1':
+        counts = without_idle(counts)
+    headers = {'X-Samples': str(samples), 'Cache-Control': 'no-store'}
+    if request.args.get('format') == 'svg':
+        window = f'last {seconds:g}s' if seconds else 'since start'
+        return current_app.response_class(render_svg(counts, f'{window} at {profiler.hz} Hz'),
+                                          mimetype='image/svg+xml', headers=headers)
+    return current_app.response_class(folded(counts), mimetype='text/plain', headers=headers)
+
+
+def flamegraph_stats():
+    if not hmac.compare_digest(current_app.config['SAMPLING_PROFILER_TOKEN'], request.headers.get('X-Profile-Token', '')):
+        return {'error': 'X-Profile-Token required'}, 403
+    return current_app.sampling_profiler.stats()
+
+
+def init_sampling_profiler(app):
+    global _profiler
+    if not app.config.get('SAMPLING_PROFILER'):
+        return
+    if not app.config.get('SAMPLING_PROFILER_TOKEN'):
+        # Collecting holds a request thread for minutes; never expose it unauthenticated
+        app.logger.warning('SAMPLING_PROFILER is set but SAMPLING_PROFILER_TOKEN is not; profiler disabled')
+        return
+    # One sampler per process, however many apps it serves
+    if _profiler is None:
+        _profiler = SamplingProfiler(app.config.get('SAMPLING_PROFILER_HZ', SAMPLING_PROFILER_HZ),
+                                     app.config.get('SAMPLING_PROFILER_MAX_STACKS', SAMPLING_PROFILER_MAX_STACKS))
+        _profiler.start()
+    app.sampling_profiler = _profiler
+    app.add_url_rule('/debug/flamegraph', 'debug_flamegraph', flamegraph)
+    app.add_url_rule('/debug/flamegraph/stats', 'debug_flamegraph_stats', flamegraph_stats)
@@ -0,0 +1,196 @@
+# schema_compiler.py
+# Compiles schema.xlsx into the intermediate representation (IR) both code
+# generators consume: jinja/codegen.py (the Flask API) and
+# frontend/codegen/codegen.py (the Dash frontend).
+#
+# The workbook has a `tables` sheet (tablename, columnname, columntype, pk) and
+# a `relationships` sheet (relationship_table, table1, table2, table1_pk,
+# table2_pk). It is read once, validated, and indexed:
+#
+#   tables[name]      class_name, columns (in sheet order), column_index
+#                     (column name -> position), primary_key, relations (both
+#                     sides of every relationship the table takes part in)
+#   relationships     the relationships sheet, in order
+#   fk_graph[table]   tables it references. The foreign keys live in the
+#                     association tables (jinja/associated_tables.py.j2): each
+#                     relationship_table has a `<table1>_<table1_pk>` column
+#                     referencing table1 and a `<table2>_<table2_pk>` column
+#                     referencing table2, so association tables are nodes here
+#                     even when the tables sheet doesn't declare them
+#   reverse[table]    tables referencing it, with the referencing column
+#   order             the tables sheet's tables in topological order over
+#                     fk_graph, referenced tables first; tables on a cycle
+#                     follow in sheet order
+#   cycles            tables (association tables included) on a cycle
+#
+# The IR is plain JSON and is cached under .schema_cache/ next to the
+# workbook, keyed by the workbook's SHA-256, so an unchanged schema skips
+# the Excel parse entirely.
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+# Bump when the IR layout changes so stale cache files are ignored
+IR_VERSION = 2
+CACHE_DIR = '.schema_cache'
+TABLE_FIELDS = ('tablename', 'columnname', 'columntype', 'pk')
+RELATIONSHIP_FIELDS = ('relationship_table', 'table1', 'table2', 'table1_pk', 'table2_pk')
+
+
+class SchemaError(ValueError):
+    """The workbook doesn't describe a usable schema; ``problems`` lists every issue found."""
+
+    def __init__(self, problems):
+        super().__init__('invalid schema:\n  ' + '\n  '.join(problems))
+        self.problems = problems
+
+
+def snake_to_camel(snake_str):
+    return ''.join(part.title() for part in snake_str.split('_'))
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _flag(value):
+    # Empty cells come back from pandas as NaN, which is truthy
+    return bool(value) and value == value
+
+
+def read_workbook(path):
+    """Rows of the two sheets as lists of dicts, from a single open of the file."""
+    import pandas as pd
+
+    sheets = pd.read_excel(path, sheet_name=['tables', 'relationships'])
+    return sheets['tables'].to_dict('records'), sheets['relationships'].to_dict('records')
+
+
+def compile_records(table_rows, relationship_rows, source_hash=None):
+    """Validate and index the sheet rows; raises SchemaError listing every problem."""
+    problems = []
+    for sheet, rows, fields in (('tables', table_rows, TABLE_FIELDS),
+                                ('relationships', relationship_rows, RELATIONSHIP_FIELDS)):
+        missing = [field for field in fields if rows and field not in rows[0]]
+        if missing:
+            problems.append(f'{sheet} sheet is missing columns: {", ".join(missing)}')
+    if problems:
+        raise SchemaError(problems)
+
+    tables = {}
+    for line, row in enumerate(table_rows, start=2):
+        name, column = row['tablename'], row['columnname']
+        if not isinstance(name, str) or not isinstance(column, str):
+            problems.append(f'tables row {line}: tablename and columnname are required')
+            continue
+        table = tables.get(name)
+        if table is None:
+            table = tables[name] = {'name': name, 'class_name': snake_to_camel(name), 'columns': [],
+                                    'column_index': {}, 'primary_key': [], 'relations': []}
+        if column in table['column_index']:
+            problems.append(f'tables row {line}: duplicate column {name}.{column}')
+            continue
+        pk = _flag(row['pk'])
+        table['column_index'][column] = len(table['columns'])
+        table['columns'].append({'name': column, 'type': row['columntype'], 'pk': pk})
+        if pk:
+            table['primary_key'].append(column)
+
+    relationships = []
+    fk_graph = {name: [] for name in tables}
+    reverse = {name: [] for name in tables}
+    for line, row in enumerate(relationship_rows, start=2):
+        relationship = {field: row[field] for field in RELATIONSHIP_FIELDS}
+        association, table1, table2 = relationship['relationship_table'], relationship['table1'], relationship['table2']
+        if not isinstance(association, str):
+            problems.append(f'relationships row {line}: relationship_table is required')
+            continue
+        unknown = [table for table in (table1, table2) if table not in tables]
+        if unknown:
+            problems.append(f'relationships row {line}: unknown table {", ".join(map(str, unknown))}')
+            continue
+        for table, key in ((table1, relationship['table1_pk']), (table2, relationship['table2_pk'])):
+            if key not in tables[table]['column_index']:
+                problems.append(f'relationships row {line}: {table} has no column {key}')
+        relationships.append(relationship)
+        for side, (table, other, key, other_key) in enumerate(
+                ((table1, table2, relationship['table1_pk'], relationship['table2_pk']),
+                 (table2, table1, relationship['table2_pk'], relationship['table1_pk'])), start=1):
+            tables[table]['relations'].append({
+                'side': side,
+                'related_table': other,
+                'related_class': snake_to_camel(other),
+                'relationship_table': relationship['relationship_table'],
+                'key': key,
+                'related_key': other_key
+            })
+        # The association table holds a foreign key to each side
+        fk_graph.setdefault(association, [])
+        for table, key in ((table1, relationship['table1_pk']), (table2, relationship['table2_pk'])):
+            reference = {'table': association, 'column': f'{table}_{key}'}
+            if table not in fk_graph[association]:
+                fk_graph[association].append(table)
+            if reference not in reverse[table]:
+                reverse[table].append(reference)
+        reverse.setdefault(association, [])
+    if problems:
+        raise SchemaError(problems)
+
+    order, cycles = _topological_order(fk_graph)
+    order = [name for name in order if name in tables]
+    return {
+        'ir_version': IR_VERSION,
+        'source_hash': source_hash,
+        'tables': tables,
+        'relationships': relationships,
+        'fk_graph': fk_graph,
+        'reverse': reverse,
+        'order': order,
+        'cycles': cycles
+    }
+
+
+def _topological_order(fk_graph):
+    """Referenced tables before the tables referencing them (Kahn's algorithm, graph order on ties)."""
+    position = {name: index for index, name in enumerate(fk_graph)}
+    remaining = {name: len(set(fk_graph[name]) - {name}) for name in fk_graph}
+    dependents = defaultdict(list)
+    for name, targets in fk_graph.items():
+        for target in set(targets) - {name}:
+            dependents[target].append(name)
+    ready = [name for name in fk_graph if remaining[name] == 0]
+    order = []
+    while ready:
+        ready.sort(key=position.get, reverse=True)
+        name = ready.pop()
+        order.append(name)
+        for dependent in dependents[name]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    placed = set(order)
+    cycles = [name for name in fk_graph if name not in placed]
+    return order + cycles, cycles
+
+
+def compile_schema(path, use_cache=True):
+    """The IR for the workbook at ``path``, from the on-disk cache when the file is unchanged."""
+    source_hash = file_hash(path)
+    cache_path = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR,
+                              f'{source_hash}-v{IR_VERSION}.json')
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return json.load(f)
+    ir = compile_records(*read_workbook(path), source_hash=source_hash)
+    if use_cache:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(ir, f, default=str)
+        os.replace(tmp, cache_path)
+    return ir
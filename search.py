@@ -0,0 +1,128 @@
+# search.py
+# Full-text search over employee, department and location names, kept in a
+# SQLite FTS5 index so it scales past what an in-memory index could hold.
+#
+# The index is contentless (names live only in their own tables) and each row's
+# FTS rowid encodes where it came from: rowid = id * 4 + type code. Triggers on
+# the three tables keep it in step with every write path; deleting from a
+# contentless table takes the old values, which the triggers have at hand.
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from cache import get_table
+from database import db, register_migration
+
+SEARCH_TABLE = 'search_index'
+TYPE_CODES = {'employee': 1, 'department': 2, 'location': 3}
+TYPES_BY_CODE = {code: name for name, code in TYPE_CODES.items()}
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _schema():
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"name, content='', tokenize='unicode61 remove_diacritics 2')"
+    ]
+    for table, code in TYPE_CODES.items():
+        rowid = f'{{row}}.id * 4 + {code}'
+        insert = f"INSERT INTO {SEARCH_TABLE} (rowid, name) VALUES ({rowid.format(row='new')}, new.name);"
+        delete = (f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name) "
+                  f"VALUES ('delete', {rowid.format(row='old')}, old.name);")
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF id, name ON {table} "
+            f"BEGIN {delete} {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        ]
+    return statements
+
+
+def _populate(conn):
+    for table, code in TYPE_CODES.items():
+        conn.execute(text(f'INSERT INTO {SEARCH_TABLE} (rowid, name) SELECT id * 4 + {code}, name FROM {table}'))
+    conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+
+
+def missing_index():
+    """Names of the index table and triggers not yet in the database."""
+    wanted = [SEARCH_TABLE] + [f'{table}_search_{event}' for table in TYPE_CODES
+                               for event in ('insert', 'update', 'delete')]
+    with db.engine.connect() as conn:
+        existing = set(conn.execute(text('SELECT name FROM sqlite_master')).scalars())
+    return [name for name in wanted if name not in existing]
+
+
+def ensure_index():
+    """Create the index and its triggers if missing, filling the index on first creation."""
+    with db.engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE}).first()
+        for statement in _schema():
+            conn.execute(text(statement))
+        if exists is None:
+            _populate(conn)
+
+
+def rebuild_index():
+    """Drop and rebuild the index from the tables (a contentless index can't 'rebuild' itself)."""
+    with db.engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+        for statement in _schema():
+            conn.execute(text(statement))
+        _populate(conn)
+        return conn.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}_docsize")).scalar()
+
+
+def match_expression(q):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    tokens = _TOKEN.findall(q)
+    if not tokens:
+        return None
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search(q, types=None, page=1, per_page=SEARCH_PAGE_SIZE):
+    """One BM25-ranked page of matches, hydrated from the caches, and whether more pages follow."""
+    expression = match_expression(q)
+    if expression is None:
+        return [], False
+    codes = [TYPE_CODES[name] for name in types] if types else list(TYPES_BY_CODE)
+    placeholders = ', '.join(f':code{i}' for i in range(len(codes)))
+    params = {'expression': expression, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    params.update({f'code{i}': code for i, code in enumerate(codes)})
+    found = db.session.execute(text(
+        f'SELECT rowid, bm25({SEARCH_TABLE}) AS score FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH :expression AND rowid % 4 IN ({placeholders}) '
+        f'ORDER BY score LIMIT :limit OFFSET :offset'
+    ), params).all()
+    has_more = len(found) > per_page
+    results = []
+    for rowid, score in found[:per_page]:
+        kind, key = TYPES_BY_CODE[rowid % 4], rowid // 4
+        row = get_table(f'{kind}_cache').get(key)
+        if row is not None:
+            # bm25() is lower-is-better; flip it so higher scores rank first
+            results.append({'type': kind, 'id': key, 'score': round(-score, 6), 'row': row})
+    return results, has_more
+
+
+@click.command('search-rebuild')
+@with_appcontext
+def rebuild_command():
+    """Rebuild the full-text search index from the employee, department and location tables."""
+    click.echo(f'Indexed {rebuild_index()} rows')
+
+
+# Created by `flask db-migrate` (or on a new database), never on startup against an existing one
+register_migration('search_index', missing_index, ensure_index)
+
+
+def init_search(app):
+    app.cli.add_command(rebuild_command)
@@ -0,0 +1,159 @@
+# serialization.py
+# Response encoding for every blueprint: a JSON provider backed by orjson (when
+# installed) and MessagePack for clients that send Accept: application/msgpack
+# (when msgpack is installed). Both are optional: without orjson encoding falls
+# back to the stdlib json module, and without msgpack JSON is always served.
+#
+# Model instances are encoded by per-model encoders built from each mapped
+# table's columns, so views can return ORM objects as well as cached row dicts.
+import datetime
+import decimal
+import uuid
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import inspect
+from sqlalchemy.exc import NoInspectionAvailable
+
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# How column values orjson/msgpack can't take natively are written out
+_CONVERTERS = {
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    decimal.Decimal: str,
+    uuid.UUID: str,
+}
+
+_model_encoders = {}
+
+
+def _column_converter(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return str
+    if python_type in (int, str, float, bool):
+        return None
+    return _CONVERTERS.get(python_type, str)
+
+
+def model_encoder(model):
+    """Return a function turning ``model`` instances into plain dicts, built once per model."""
+    encoder = _model_encoders.get(model)
+    if encoder is None:
+        fields = [(column.key, _column_converter(column)) for column in inspect(model).columns]
+
+        def encoder(obj):
+            # Loaded columns sit in the instance dict; skipping the attribute
+            # descriptors roughly halves the cost, unloaded ones still go through getattr
+            loaded = obj.__dict__
+            row = {}
+            for key, convert in fields:
+                value = loaded[key] if key in loaded else getattr(obj, key)
+                row[key] = value if convert is None or value is None else convert(value)
+            return row
+
+        _model_encoders[model] = encoder
+    return encoder
+
+
+def _default(obj):
+    encoder = _model_encoders.get(type(obj))
+    if encoder is not None:
+        return encoder(obj)
+    convert = _CONVERTERS.get(type(obj))
+    if convert is not None:
+        return convert(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    try:
+        inspect(type(obj))
+    except NoInspectionAvailable:
+        pass
+    else:
+        return model_encoder(type(obj))(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+
+def _str_keys(obj):
+    # JSON forces object keys to strings; do the same for MessagePack so both
+    # formats decode to the same document. Only the outer mapping is rewritten:
+    # that is where tables keep their integer ids, rows are keyed by column name
+    if isinstance(obj, dict) and not all(type(key) is str for key in obj):
+        return {key if type(key) is str else str(key): value for key, value in obj.items()}
+    return obj
+
+
+def wants_msgpack():
+    if msgpack is None:
+        return False
+    accept = request.accept_mimetypes
+    return accept.quality(MSGPACK_MIMETYPE) > accept.quality('application/json')
+
+
+def encode_msgpack(obj):
+    return msgpack.packb(_str_keys(obj), default=_default, use_bin_type=True)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson-backed provider that answers in MessagePack when the client prefers it.
+
+    Keys are not sorted: cached tables and rows are already in id and column
+    order, and sorting is a large share of the encode time for big tables.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        with span('serialize') as current:
+            response = self._encode_response(self._prepare_response_obj(args, kwargs))
+            current.set('content_type', response.mimetype)
+            current.set('bytes', response.content_length)
+        return response
+
+    def _encode_response(self, obj):
+        if wants_msgpack():
+            response = self._app.response_class(encode_msgpack(obj), mimetype=MSGPACK_MIMETYPE)
+        elif orjson is not None and not ((self.compact is None and self._app.debug) or self.compact is False):
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+            response = self._app.response_class(orjson.dumps(obj, default=_default, option=option),
+                                                mimetype=self.mimetype)
+        else:
+            response = super().response(obj)
+        if msgpack is not None:
+            response.vary.add('Accept')
+        return response
+
+
+def init_serialization(app):
+    app.json = FastJSONProvider(app)
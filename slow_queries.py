@@ -0,0 +1,239 @@
+# slow_queries.py
+# Timing for every statement run on db's engines (primary and replicas), when
+# SLOW_QUERY_LOG is set. Statements are grouped by fingerprint: the SQL with
+# literals replaced by ? and IN lists collapsed, so the same query with
+# different values or list lengths lands in one bucket. Per fingerprint we
+# keep count, total and max time and a log-bucketed latency histogram for p99;
+# /admin/queries serves them.
+#
+# A statement slower than SLOW_QUERY_THRESHOLD_MS is logged with its
+# fingerprint, normalized SQL, the shape (not the values) of its parameters
+# and the first call site outside SQLAlchemy. The first slow execution of each
+# fingerprint also captures EXPLAIN QUERY PLAN (SQLite only), run on a raw
+# DBAPI cursor so it neither re-enters these hooks nor touches the session.
+import hashlib
+import math
+import os
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+from database import db
+from logging_utils import get_logger
+
+log = get_logger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = 100.0
+SLOW_QUERY_MAX_STATEMENTS = 2000
+# Raw statement strings whose fingerprints are memoized before the memo is reset
+MAX_NORMALIZED = 10000
+# Histogram buckets grow by this factor from HISTOGRAM_MIN_MS
+HISTOGRAM_GROWTH = 1.2
+HISTOGRAM_MIN_MS = 0.01
+HISTOGRAM_BUCKETS = 120
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(?:\?|:\w+)(?:\s*,\s*(?:\?|:\w+))*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+# Frames from these packages are skipped when looking for the call site
+_LIBRARY_DIRS = tuple(os.path.dirname(__import__(name).__file__) + os.sep
+                      for name in ('sqlalchemy', 'flask_sqlalchemy'))
+
+
+def normalize(statement):
+    """Statement text with literals as ? and IN lists collapsed to a single placeholder."""
+    sql = _STRING.sub('?', statement)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+def param_shape(parameters, executemany=False):
+    """Types of the bound parameters, without their values."""
+    if executemany:
+        rows = list(parameters) if parameters else []
+        return {'rows': len(rows), 'each': param_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def call_site():
+    """``file:line function`` of the innermost frame outside SQLAlchemy and this module."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != __file__ and not filename.startswith(_LIBRARY_DIRS) and 'contextlib' not in filename:
+            return f'{os.path.relpath(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def _bucket(ms):
+    if ms <= HISTOGRAM_MIN_MS:
+        return 0
+    return min(int(math.log(ms / HISTOGRAM_MIN_MS, HISTOGRAM_GROWTH)) + 1, HISTOGRAM_BUCKETS - 1)
+
+
+def _bucket_upper_ms(index):
+    return HISTOGRAM_MIN_MS * HISTOGRAM_GROWTH ** index
+
+
+class StatementStats:
+    __slots__ = ('fingerprint', 'sql', 'count', 'total_ms', 'max_ms', 'slow_count', 'histogram',
+                 'plan', 'last_slow')
+
+    def __init__(self, fingerprint, sql):
+        self.fingerprint = fingerprint
+        self.sql = sql
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_count = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.plan = None
+        self.last_slow = None
+
+    def percentile(self, fraction):
+        """Upper bound of the histogram bucket holding the ``fraction`` quantile."""
+        rank = math.ceil(self.count * fraction)
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return min(_bucket_upper_ms(index), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'p50_ms': round(self.percentile(0.5), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'slow_count': self.slow_count,
+            'plan': self.plan,
+            'last_slow': self.last_slow
+        }
+
+
+class QueryStats:
+    """Per-fingerprint statement timings for a set of engines."""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_THRESHOLD_MS, max_statements=SLOW_QUERY_MAX_STATEMENTS):
+        self.threshold_ms = threshold_ms
+        self.max_statements = max_statements
+        self.statements = {}
+        self.overflow = 0
+        self._normalized = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def fingerprint(self, statement):
+        found = self._normalized.get(statement)
+        if found is None:
+            sql = normalize(statement)
+            if len(self._normalized) >= MAX_NORMALIZED:
+                self._normalized.clear()
+            found = self._normalized[statement] = (hashlib.sha1(sql.encode()).hexdigest()[:12], sql)
+        return found
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start time from the pooled connection
+        conn = exception_context.connection
+        started = conn.info.get('query_started') if conn is not None else None
+        if started:
+            started.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        ms = (time.perf_counter() - started.pop()) * 1000
+        fingerprint, sql = self.fingerprint(statement)
+        slow = ms >= self.threshold_ms
+        with self._lock:
+            stats = self.statements.get(fingerprint)
+            if stats is None:
+                if len(self.statements) >= self.max_statements:
+                    self.overflow += 1
+                    return
+                stats = self.statements[fingerprint] = StatementStats(fingerprint, sql)
+            stats.count += 1
+            stats.total_ms += ms
+            stats.max_ms = max(stats.max_ms, ms)
+            stats.histogram[_bucket(ms)] += 1
+            if not slow:
+                return
+            stats.slow_count += 1
+            explain = stats.plan is None
+            if explain:
+                # Claim the capture so concurrent slow runs don't all EXPLAIN
+                stats.plan = []
+        site = call_site()
+        shape = param_shape(parameters, executemany)
+        if explain:
+            stats.plan = self._explain(conn, statement, parameters, executemany)
+        stats.last_slow = {'ms': round(ms, 3), 'at': time.time(), 'call_site': site, 'params': shape,
+                           'database': os.path.basename(conn.engine.url.database or '')}
+        log.warning('slow query %s (%.1f ms) at %s: %s', fingerprint, ms, site, sql,
+                    extra={'fingerprint': fingerprint, 'ms': round(ms, 3), 'params': shape,
+                           'scans': [step.strip() for step in stats.plan if step.lstrip().startswith('SCAN')]})
+
+    def _explain(self, conn, statement, parameters, executemany):
+        if conn.dialect.name != 'sqlite' or not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return ['(no plan: not an explainable SQLite statement)']
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            rows = cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        except Exception as e:
+            return [f'(no plan: {e})']
+        finally:
+            cursor.close()
+        # (id, parent, notused, detail): indent each step under its parent
+        depth = {0: -1}
+        plan = []
+        for step_id, parent, _, detail in rows:
+            depth[step_id] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[step_id] + detail)
+        return plan
+
+    def top(self, sort='total_ms', limit=50):
+        with self._lock:
+            rows = [stats.to_dict() for stats in self.statements.values()]
+        rows.sort(key=lambda row: row[sort] or 0, reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.overflow = 0
+
+
+def init_slow_queries(app):
+    if not app.config.get('SLOW_QUERY_LOG'):
+        return
+    app.query_stats = QueryStats(app.config.get('SLOW_QUERY_THRESHOLD_MS', SLOW_QUERY_THRESHOLD_MS),
+                                 app.config.get('SLOW_QUERY_MAX_STATEMENTS', SLOW_QUERY_MAX_STATEMENTS))
+    with app.app_context():
+        for engine in db.engines.values():
+            app.query_stats.attach(engine)
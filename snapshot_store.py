@@ -0,0 +1,359 @@
+# snapshot_store.py
+# Read-only, memory-mapped cache snapshot shared by every worker on a host.
+#
+# One loader process writes all cache tables into a generation file; every worker
+# maps the current generation and reads rows straight out of the page cache, so
+# the cache costs each worker next to no private memory. Writers publish a new
+# generation (a patched copy of the current file) and swap the CURRENT pointer
+# with os.replace, which is atomic; readers notice within MMAP_CHECK_INTERVAL.
+# A request reads through tables pinned to one generation (pin), so its reads
+# agree with each other even if a swap lands mid-request.
+#
+# Every write costs a copy and fsync of the whole generation file, O(cache
+# size) per row, serialized across processes by the publish lock. That suits
+# the read-mostly caches this backend is for; a bulk update of N rows costs N
+# copies, so write-heavy deployments want the memory or tiered backend.
+#
+# Generation file layout (little endian, sections 8-byte aligned):
+#   b'CACHESNP' | u32 header length | JSON header
+#   per table:  int64 ids sorted ascending | fixed-width records in the same order
+# Integer columns are int64 (INT_NULL for None); String columns are a u16 byte
+# length (STR_NULL for None) followed by a slot as wide as the longest value.
+import bisect
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from collections.abc import Mapping
+
+MAGIC = b'CACHESNP'
+INT_NULL = -2 ** 63
+STR_NULL = 0xFFFF
+MMAP_CHECK_INTERVAL = 0.5
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _column_kinds(model):
+    kinds = []
+    for column in model.__table__.columns:
+        kind = 'int' if column.type.python_type is int else 'str'
+        kinds.append((column.key, kind))
+    return kinds
+
+
+class _Layout:
+    def __init__(self, fields):
+        self.fields = fields
+        fmt = '<'
+        for name, kind, width in fields:
+            fmt += 'q' if kind == 'int' else f'H{width}s'
+        self.struct = struct.Struct(fmt)
+
+    def pack(self, row):
+        values = []
+        for name, kind, width in self.fields:
+            value = row.get(name)
+            if kind == 'int':
+                values.append(INT_NULL if value is None else value)
+            elif value is None:
+                values += [STR_NULL, b'']
+            else:
+                encoded = value.encode('utf-8')
+                if len(encoded) > width:
+                    raise _TooWide(name)
+                values += [len(encoded), encoded]
+        return values
+
+    def unpack(self, buffer, offset):
+        values = iter(self.struct.unpack_from(buffer, offset))
+        row = {}
+        for name, kind, width in self.fields:
+            if kind == 'int':
+                value = next(values)
+                row[name] = None if value == INT_NULL else value
+            else:
+                length, raw = next(values), next(values)
+                row[name] = None if length == STR_NULL else raw[:length].decode('utf-8')
+        return row
+
+
+class _TooWide(Exception):
+    pass
+
+
+class _Generation:
+    """One mapped generation file; stays valid after its file is unlinked."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a cache snapshot')
+        header_len, = struct.unpack_from('<I', self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.mm[start:start + header_len])
+        self.number = self.header['generation']
+        self.tables = {}
+        for name, info in self.header['tables'].items():
+            layout = _Layout([tuple(field) for field in info['fields']])
+            ids = memoryview(self.mm)[info['ids_offset']:info['ids_offset'] + 8 * info['count']].cast('q')
+            self.tables[name] = (layout, ids, info['records_offset'])
+
+    def index(self, name, key):
+        layout, ids, records_offset = self.tables[name]
+        i = bisect.bisect_left(ids, key)
+        return i if i < len(ids) and ids[i] == key else None
+
+    def row(self, name, i):
+        layout, ids, records_offset = self.tables[name]
+        return layout.unpack(self.mm, records_offset + i * layout.struct.size)
+
+
+def _write_generation(path, number, tables, kinds):
+    header = {'generation': number, 'tables': {}}
+    sections = []
+    for name, rows in tables.items():
+        fields = []
+        for column, kind in kinds[name]:
+            if kind == 'int':
+                fields.append((column, kind, 8))
+            else:
+                widest = max((len(row[column].encode('utf-8')) for row in rows.values() if row.get(column) is not None), default=0)
+                fields.append((column, kind, _align(max(widest, 1))))
+        layout = _Layout(fields)
+        ids = sorted(rows)
+        header['tables'][name] = {'count': len(ids), 'fields': fields}
+        sections.append((name, layout, ids, rows))
+
+    # Offsets depend on the header length and vice versa; size the header with
+    # oversized placeholder offsets, plus slack so put() can bump the generation
+    for info in header['tables'].values():
+        info['ids_offset'] = info['records_offset'] = 10 ** 15
+    header_len = len(json.dumps(header)) + 64
+    offset = _align(len(MAGIC) + 4 + header_len)
+    for name, layout, ids, rows in sections:
+        info = header['tables'][name]
+        info['ids_offset'] = offset
+        info['records_offset'] = offset = _align(offset + 8 * len(ids))
+        offset = _align(offset + layout.struct.size * len(ids))
+    encoded = json.dumps(header).encode('utf-8').ljust(header_len)
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(encoded)) + encoded)
+        for name, layout, ids, rows in sections:
+            info = header['tables'][name]
+            f.write(b'\0' * (info['ids_offset'] - f.tell()))
+            f.write(struct.pack(f'<{len(ids)}q', *ids))
+            f.write(b'\0' * (info['records_offset'] - f.tell()))
+            for key in ids:
+                f.write(layout.struct.pack(*layout.pack(rows[key])))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class MmapStore:
+    """Publishes and maps generation files under ``directory``."""
+
+    def __init__(self, directory, loader=True, check_interval=MMAP_CHECK_INTERVAL, on_swap=None):
+        self.directory = directory
+        self.loader = loader
+        self.check_interval = check_interval
+        self.on_swap = on_swap
+        self._current = None
+        self._pointer_id = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def _pointer(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def _generation_path(self, number):
+        return os.path.join(self.directory, f'cache-{number:012d}.snap')
+
+    def current(self, notify=True):
+        """The mapped current generation, remapped if another process published."""
+        now = time.monotonic()
+        if self._current is not None and now - self._checked_at < self.check_interval:
+            return self._current
+        with self._lock:
+            self._checked_at = now
+            while True:
+                try:
+                    stat = os.stat(self._pointer)
+                    if (stat.st_ino, stat.st_mtime_ns) == self._pointer_id:
+                        return self._current
+                    with open(self._pointer) as f:
+                        generation = _Generation(os.path.join(self.directory, f.read().strip()))
+                except FileNotFoundError:
+                    if not os.path.exists(self._pointer):
+                        return self._current
+                    # Two generations were published while we read the pointer; retry
+                    continue
+                break
+            swapped = self._current is not None
+            self._current = generation
+            self._pointer_id = (stat.st_ino, stat.st_mtime_ns)
+        if swapped and notify and self.on_swap is not None:
+            self.on_swap()
+        return self._current
+
+    def wait_ready(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while self.current() is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'no cache snapshot published in {self.directory}')
+            self._checked_at = 0.0
+            time.sleep(0.05)
+
+    def tables(self, names):
+        return {name: MmapTable(self, name) for name in names}
+
+    def pin(self, tables):
+        """``tables`` with every live view fixed to the current generation, for one request's reads."""
+        generation = self.current()
+        return {name: MmapTable(self, name, generation) if isinstance(table, MmapTable) else table
+                for name, table in tables.items()}
+
+    def write_full(self, tables, models):
+        kinds = {name: _column_kinds(model) for name, model in models.items()}
+        with self._publish_lock():
+            self._publish(lambda path, number: _write_generation(path, number, tables, kinds))
+
+    def put(self, name, key, row):
+        """Publish a generation with ``row`` stored; copies and fsyncs the whole file (see the module notes)."""
+        with self._publish_lock():
+            generation = self._refresh()
+            if generation is None:
+                raise RuntimeError(f'no cache snapshot published in {self.directory}')
+            i = generation.index(name, key)
+            if i is not None:
+                layout, ids, records_offset = generation.tables[name]
+                try:
+                    values = layout.pack(row)
+                except _TooWide:
+                    pass
+                else:
+                    def patch(path, number):
+                        # Copy the current file and overwrite one record in place
+                        tmp = f'{path}.tmp'
+                        shutil.copyfile(self._generation_path(generation.number), tmp)
+                        with open(tmp, 'r+b') as f:
+                            header_len, = struct.unpack_from('<I', generation.mm, len(MAGIC))
+                            header = dict(generation.header, generation=number)
+                            encoded = json.dumps(header).encode('utf-8').ljust(header_len)
+                            f.seek(len(MAGIC) + 4)
+                            f.write(encoded)
+                            f.seek(records_offset + i * layout.struct.size)
+                            f.write(layout.struct.pack(*values))
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(tmp, path)
+                    self._publish(patch)
+                    return
+            # New id or a value wider than its slot: rewrite the generation
+            self._rewrite(generation, lambda tables: tables[name].__setitem__(key, row))
+
+    def delete(self, name, key):
+        with self._publish_lock():
+            generation = self._refresh()
+            if generation is not None and generation.index(name, key) is not None:
+                self._rewrite(generation, lambda tables: tables[name].pop(key))
+
+    def _rewrite(self, generation, change):
+        tables = {table: dict(MmapTable(self, table, generation).items()) for table in generation.tables}
+        change(tables)
+        kinds = {table: [(field[0], field[1]) for field in generation.header['tables'][table]['fields']]
+                 for table in tables}
+        self._publish(lambda path, number: _write_generation(path, number, tables, kinds))
+
+    def _refresh(self, notify=True):
+        self._checked_at = 0.0
+        return self.current(notify)
+
+    def _publish(self, write):
+        current = self._refresh()
+        number = current.number + 1 if current is not None else 1
+        path = self._generation_path(number)
+        write(path, number)
+        tmp_pointer = f'{self._pointer}.tmp'
+        with open(tmp_pointer, 'w') as f:
+            f.write(os.path.basename(path))
+        os.replace(tmp_pointer, self._pointer)
+        # Our own publish; callers invalidate what they changed themselves
+        self._refresh(notify=False)
+        # Mapped generations stay readable after unlink; keep one back for slow openers
+        stale = self._generation_path(number - 2)
+        if os.path.exists(stale):
+            os.unlink(stale)
+
+    def _publish_lock(self):
+        return _FileLock(os.path.join(self.directory, 'LOCK'))
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+class MmapTable(Mapping):
+    """Read-only dict-like view of one table in the store's current generation.
+
+    Rows are decoded on access; writes go through ``__setitem__``, which
+    publishes a new generation instead of mutating the mapped file. A view
+    built with ``generation`` (see ``MmapStore.pin``) reads only that one.
+    """
+
+    def __init__(self, store, name, generation=None):
+        self._store = store
+        self._name = name
+        self._generation = generation
+
+    def _gen(self):
+        return self._generation or self._store.current()
+
+    def __getitem__(self, key):
+        generation = self._gen()
+        i = generation.index(self._name, key)
+        if i is None:
+            raise KeyError(key)
+        return generation.row(self._name, i)
+
+    def __setitem__(self, key, row):
+        self._store.put(self._name, key, row)
+
+    def __delitem__(self, key):
+        self._store.delete(self._name, key)
+
+    def __iter__(self):
+        layout, ids, records_offset = self._gen().tables[self._name]
+        return iter(ids.tolist())
+
+    def __len__(self):
+        return len(self._gen().tables[self._name][1])
+
+    def items(self):
+        generation = self._gen()
+        layout, ids, records_offset = generation.tables[self._name]
+        return [(key, generation.row(self._name, i)) for i, key in enumerate(ids)]
+
+    def values(self):
+        return [row for key, row in self.items()]
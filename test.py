@@ -657,6 +657,10 @@ export interface UpdateReviewAnswerInput {
 from sqlalchemy import Column, String, JSON, Integer, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 
+from logging_utils import get_logger
+
+log = get_logger(__name__)
+
 Base = declarative_base()
 
 class UserCache(Base):
@@ -684,7 +688,7 @@ class UserCache(Base):
         Returns:
             list[UserCache]: List of matching cache records
         """
-        print(f"Getting data for user: {username}")
+        log.debug("getting data for user %s", username)
         result = session.query(cls).filter(
             cls.user_name == 'admin_user'
         ).all()
@@ -741,8 +745,8 @@ class UserCache(Base):
         """
         Upsert a comment for a specific column in the cache.
         """
-        print(f"Updating comment with: username={username}, table={table_name}, key={primary_key}")
-        print(f"Column: {column_name}, Question: {question}, Answer: {answer}")
+        log.debug("updating comment: user=%s table=%s key=%s column=%s question=%s",
+                  username, table_name, primary_key, column_name, question)
         
         try:
             record = session.query(cls).filter_by(
@@ -752,9 +756,6 @@ class UserCache(Base):
             ).first()
 
             if record:
-                print(f"Record found: {record}")
-                print(f"Current comments: {record.comments}")
-                
                 if record.comments is None:
                     record.comments = {}
                 new_comments = dict(record.comments)
@@ -777,19 +778,16 @@ class UserCache(Base):
                 record.comments = new_comments
                 session.add(record)
                 
-                print(f"New comments structure: {new_comments}")
-                print(f"Record before commit: {record}")
-                
                 session.flush()  # Flush changes to DB
                 session.commit()  # Commit transaction
                 
                 # Verify the update
                 session.refresh(record)
-                print(f"Record after commit and refresh: {record}")
+                log.debug("comment saved: %r", record)
                 
                 return record
         except Exception as e:
-            print(f"Error updating comment: {e}")
+            log.exception("error updating comment for %s/%s", table_name, primary_key)
             session.rollback()
             raise
 
@@ -817,21 +815,19 @@ class ReviewQueue(Base):
         """
         Copy data from UserCache to ReviewQueue for review
         """
-        print("Submit for review called")
+        log.debug("submit for review called by %s", username)
         try:
             # Get all cache records for the user
             cache_records = session.query(UserCache).filter(
                 UserCache.user_name == 'admin_user'
             ).all()
-            print(f"cache records:{cache_records}")
+            log.debug("submitting %d cache records for review", len(cache_records))
             # Create review queue entries
             for cache in cache_records:
-                print(f"cache:{cache}")
                 if cache.data:
                     for column_name, value in cache.data.items():
                         # Get comments for this column if they exist
                         comments = cache.comments.get(column_name, {}) if cache.comments else {}
-                        print(f"Comments:{comments}")
                         review = cls(
                             user_name=cache.user_name,
                             table_name=cache.table_name,
@@ -850,7 +846,7 @@ class ReviewQueue(Base):
             return True
         except Exception as e:
             session.rollback()
-            print(f"Error submitting for review: {e}")
+            log.exception("error submitting for review")
             raise
 
     @classmethod
@@ -876,7 +872,7 @@ class ReviewQueue(Base):
             return None
         except Exception as e:
             session.rollback()
-            print(f"Error updating review: {e}")
+            log.exception("error updating review %s", id)
             raise
 
     @classmethod
@@ -884,15 +880,12 @@ class ReviewQueue(Base):
         """
         Update a review answer, similar to update_comment
         """
-        print(f"Updating review comment with: id={id}")
-        print(f"Question: {question}, Answer: {answer}")
+        log.debug("updating review comment: id=%s question=%s", id, question)
         
         try:
             record = session.query(cls).filter(cls.id == id).first()
 
             if record:
-                print(f"Review record found: {record}")
-                
                 # Map question to corresponding field
                 field_mapping = {
                     'reviewQ1': 'review_q1',
@@ -906,13 +899,13 @@ class ReviewQueue(Base):
                     session.flush()
                     session.commit()
                     session.refresh(record)
-                    print(f"Record after update: {record}")
+                    log.debug("review %s updated: %s=%r", id, field, answer)
                     return record
                 else:
                     raise ValueError(f"Invalid question: {question}")
                     
         except Exception as e:
-            print(f"Error updating review comment: {e}")
+            log.exception("error updating review comment %s", id)
             session.rollback()
             raise
 
@@ -930,7 +923,7 @@ class ReviewQueue(Base):
             return None
         except Exception as e:
             session.rollback()
-            print(f"Error marking as committed: {e}")
+            log.exception("error marking review %s as committed", id)
             raise
 
     
@@ -1080,8 +1073,6 @@ class Mutation:
         info: Info
     ) -> CacheData:
         session = info.context["session"]
-        print("update_comment called")
-        print(input)
         record = UserCache.update_comment(
             session=session,
             username=input.username,
@@ -1139,8 +1130,6 @@ class Mutation:
         info: Info
     ) -> Optional[ReviewQueueItem]:
         session = info.context["session"]
-        print("update_comment_review called")
-        print(input)
         record = ReviewQueue.update_comment_review(
             session=session,
             id=input.id,
@@ -0,0 +1,68 @@
+import pytest
+
+from schema_compiler import SchemaError, compile_records
+
+
+def _tables(spec):
+    """Table sheet rows from {table: [column, ...]}; the first column is the key."""
+    return [{'tablename': table, 'columnname': column, 'columntype': 'String', 'pk': index == 0}
+            for table, columns in spec.items() for index, column in enumerate(columns)]
+
+
+def _relationship(association, table1, table2, table1_pk='id', table2_pk='id'):
+    return {'relationship_table': association, 'table1': table1, 'table2': table2,
+            'table1_pk': table1_pk, 'table2_pk': table2_pk}
+
+
+def test_association_tables_reference_both_sides():
+    ir = compile_records(_tables({'employee': ['id', 'name', 'project_id'], 'project': ['id', 'name']}),
+                         [_relationship('employee_project', 'employee', 'project')])
+
+    # project_id on employee is only named like project's key; it is not a foreign key
+    assert ir['fk_graph'] == {'employee': [], 'project': [], 'employee_project': ['employee', 'project']}
+    assert ir['reverse']['employee'] == [{'table': 'employee_project', 'column': 'employee_id'}]
+    assert ir['reverse']['project'] == [{'table': 'employee_project', 'column': 'project_id'}]
+    assert ir['reverse']['employee_project'] == []
+    assert ir['order'] == ['employee', 'project']
+    assert ir['cycles'] == []
+
+
+def test_declared_association_table_orders_after_both_sides():
+    ir = compile_records(_tables({'assignment': ['id', 'role'], 'project': ['id'], 'employee': ['id']}),
+                         [_relationship('assignment', 'employee', 'project')])
+
+    assert ir['fk_graph']['assignment'] == ['employee', 'project']
+    assert ir['order'] == ['project', 'employee', 'assignment']
+    assert ir['cycles'] == []
+
+
+def test_cycles_follow_in_sheet_order():
+    # location links department and team; department links location and team: a cycle through
+    # location and department, with team referenced by both
+    ir = compile_records(_tables({'location': ['id'], 'department': ['id'], 'team': ['id']}),
+                         [_relationship('location', 'department', 'team'),
+                          _relationship('department', 'location', 'team')])
+
+    assert ir['order'] == ['team', 'location', 'department']
+    assert ir['cycles'] == ['location', 'department']
+
+
+def test_self_relationship_is_not_a_cycle():
+    ir = compile_records(_tables({'employee': ['id']}),
+                         [_relationship('employee_manager', 'employee', 'employee')])
+
+    assert ir['fk_graph']['employee_manager'] == ['employee']
+    assert ir['order'] == ['employee']
+    assert ir['cycles'] == []
+
+
+def test_problems_are_reported_together():
+    with pytest.raises(SchemaError) as raised:
+        compile_records(_tables({'employee': ['id']}),
+                        [_relationship('employee_project', 'employee', 'project'),
+                         _relationship(float('nan'), 'employee', 'employee'),
+                         _relationship('employee_manager', 'employee', 'employee', table2_pk='manager')])
+
+    assert raised.value.problems == ['relationships row 2: unknown table project',
+                                     'relationships row 3: relationship_table is required',
+                                     'relationships row 4: employee has no column manager']
@@ -0,0 +1,282 @@
+# tiered_cache.py
+# Two-tier read-through cache for tables too big to replicate into every worker.
+#
+#   L1: small per-process LRU dict
+#   L2: SQLite key/value file shared by every process on the host
+#   then the model's SQL table
+#
+# Writes go through to L2 and are logged in an invalidations table; every
+# process replays that log at most every sync_interval seconds and drops the
+# keys from its L1, so L1 staleness is bounded by the interval. L2 fills from
+# SQL use INSERT OR IGNORE so a slow reader can never overwrite a newer write.
+# Concurrent misses on one key share a single SQL fetch through the app's
+# SingleFlight, when one is passed in. on_invalidate(table) is called for each
+# table another process's writes touched, so derived caches (the app's query
+# cache) can drop what they computed from it.
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from sqlalchemy import select
+
+from database import db, use_primary
+
+L1_SIZE = 10000
+L2_SIZE = 1000000
+PROMOTE_AFTER = 1
+SYNC_INTERVAL = 0.2
+# Invalidation records older than this many entries are pruned
+INVALIDATION_LOG_SIZE = 100000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    tbl TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (tbl, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kv_stored_at ON kv (tbl, stored_at);
+CREATE TABLE IF NOT EXISTS invalidations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    tbl TEXT NOT NULL,
+    key INTEGER
+);
+"""
+
+
+class TieredStore:
+    def __init__(self, path, l1_size=L1_SIZE, l2_size=L2_SIZE, promote_after=PROMOTE_AFTER,
+                 sync_interval=SYNC_INTERVAL, single_flight=None, on_invalidate=None):
+        self.path = path
+        self.single_flight = single_flight
+        self.on_invalidate = on_invalidate
+        self.l1_size = l1_size
+        self.l2_size = l2_size
+        self.promote_after = promote_after
+        self.sync_interval = sync_interval
+        self.models = {}
+        self._origin = uuid.uuid4().hex
+        self._l1 = OrderedDict()
+        self._l2_hits_by_key = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._synced_seq = None
+        self._synced_at = 0.0
+        self._writes = 0
+        self.counters = dict.fromkeys(
+            ['l1_hits', 'l1_misses', 'l2_hits', 'l2_misses', 'db_hits', 'db_misses', 'promotions', 'demotions'], 0)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def tables(self, names):
+        return {name: TieredTable(self, name) for name in names}
+
+    def get(self, table, key):
+        self.sync()
+        with self._lock:
+            row = self._l1.get((table, key))
+            if row is not None:
+                self._l1.move_to_end((table, key))
+                self.counters['l1_hits'] += 1
+                return row
+            self.counters['l1_misses'] += 1
+            seq_at_read = self._synced_seq
+
+        found = self._conn().execute('SELECT value FROM kv WHERE tbl = ? AND key = ?', (table, key)).fetchone()
+        if found is not None:
+            self.counters['l2_hits'] += 1
+            row = json.loads(found[0])
+        else:
+            self.counters['l2_misses'] += 1
+            if self.single_flight is None:
+                row = self._fill_from_db(table, key)
+            else:
+                row = self.single_flight.do(('row', table, key), lambda: self._fill_from_db(table, key))
+            if row is None:
+                return None
+        self._maybe_promote(table, key, row, seq_at_read)
+        return row
+
+    def put(self, table, key, row):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO kv (tbl, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                         (table, key, json.dumps(row), time.time()))
+            conn.execute('INSERT INTO invalidations (origin, tbl, key) VALUES (?, ?, ?)', (self._origin, table, key))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            if (table, key) in self._l1:
+                self._l1[(table, key)] = row
+        self._wrote(table)
+
+    def reset(self, models):
+        """Forget everything cached, in this process and for every other one."""
+        self.models = models
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table in models:
+                conn.execute('DELETE FROM kv WHERE tbl = ?', (table,))
+                conn.execute('INSERT INTO invalidations (origin, tbl, key) VALUES (?, ?, NULL)', (self._origin, table))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        with self._lock:
+            self._l1.clear()
+            self._l2_hits_by_key.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            l1_entries = len(self._l1)
+        stats = {'l1_entries': l1_entries, 'l1_size': self.l1_size, **counters}
+        for tier in ('l1', 'l2', 'db'):
+            lookups = counters[f'{tier}_hits'] + counters[f'{tier}_misses']
+            stats[f'{tier}_hit_rate'] = counters[f'{tier}_hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _fill_from_db(self, table, key):
+        row = self._load_from_db(table, key)
+        if row is None:
+            self.counters['db_misses'] += 1
+            return None
+        self.counters['db_hits'] += 1
+        self._conn().execute('INSERT OR IGNORE INTO kv (tbl, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                             (table, key, json.dumps(row), time.time()))
+        self._wrote(table)
+        return row
+
+    def _load_from_db(self, table, key):
+        model_table = self.models[table].__table__
+        # The row is shared through L2 until a write invalidates it; a lagging replica's copy would stick
+        with use_primary():
+            found = db.session.execute(select(model_table).where(model_table.c.id == key)).mappings().first()
+        return dict(found) if found is not None else None
+
+    def _maybe_promote(self, table, key, row, seq_at_read):
+        with self._lock:
+            # A sync since our read may have invalidated this key; promoting would pin a stale row
+            if self._synced_seq != seq_at_read:
+                return
+            hits = self._l2_hits_by_key.get((table, key), 0) + 1
+            if hits < self.promote_after:
+                if len(self._l2_hits_by_key) >= 4 * self.l1_size:
+                    self._l2_hits_by_key.clear()
+                self._l2_hits_by_key[(table, key)] = hits
+                return
+            self._l2_hits_by_key.pop((table, key), None)
+            self._l1[(table, key)] = row
+            self.counters['promotions'] += 1
+            while len(self._l1) > self.l1_size:
+                # Demotion just drops the row; L2 already holds it
+                self._l1.popitem(last=False)
+                self.counters['demotions'] += 1
+
+    def sync(self):
+        """Replay other processes' invalidations, at most once per sync_interval."""
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        conn = self._conn()
+        if self._synced_seq is None:
+            self._synced_seq = conn.execute('SELECT coalesce(max(seq), 0) FROM invalidations').fetchone()[0]
+            return
+        oldest = conn.execute('SELECT min(seq) FROM invalidations').fetchone()[0]
+        records = conn.execute('SELECT seq, origin, tbl, key FROM invalidations WHERE seq > ? ORDER BY seq',
+                               (self._synced_seq,)).fetchall()
+        if not records:
+            return
+        touched = set()
+        with self._lock:
+            if oldest is not None and oldest > self._synced_seq + 1:
+                # We missed pruned records; nothing in L1 can be trusted
+                self._l1.clear()
+                touched.update(self.models)
+            for seq, origin, table, key in records:
+                if origin == self._origin:
+                    continue
+                touched.add(table)
+                if key is None:
+                    for cached in [cached for cached in self._l1 if cached[0] == table]:
+                        del self._l1[cached]
+                else:
+                    self._l1.pop((table, key), None)
+            self._synced_seq = max(self._synced_seq, records[-1][0])
+        if self.on_invalidate is not None:
+            for table in touched:
+                self.on_invalidate(table)
+
+    def _wrote(self, table):
+        self._writes += 1
+        if self._writes % 1000:
+            return
+        # Periodic housekeeping: FIFO-trim L2 and prune the invalidation log
+        conn = self._conn()
+        count = conn.execute('SELECT count(*) FROM kv WHERE tbl = ?', (table,)).fetchone()[0]
+        if count > self.l2_size:
+            conn.execute('DELETE FROM kv WHERE tbl = ? AND key IN '
+                         '(SELECT key FROM kv WHERE tbl = ? ORDER BY stored_at LIMIT ?)',
+                         (table, table, count - self.l2_size))
+        conn.execute('DELETE FROM invalidations WHERE seq <= (SELECT max(seq) FROM invalidations) - ?',
+                     (INVALIDATION_LOG_SIZE,))
+
+
+class TieredTable(Mapping):
+    """Dict-like view of one table; point lookups go through the tiers.
+
+    Iteration bypasses the tiers and streams the SQL table, since the point
+    of this backend is not holding the whole table anywhere.
+    """
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def __getitem__(self, key):
+        row = self._store.get(self._name, key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __setitem__(self, key, row):
+        self._store.put(self._name, key, row)
+
+    def _table(self):
+        return self._store.models[self._name].__table__
+
+    def __iter__(self):
+        table = self._table()
+        return iter(db.session.execute(select(table.c.id).order_by(table.c.id)).scalars().all())
+
+    def __len__(self):
+        table = self._table()
+        return db.session.execute(select(db.func.count()).select_from(table)).scalar()
+
+    def items(self):
+        table = self._table()
+        rows = db.session.execute(select(table).order_by(table.c.id)).mappings()
+        return [(row['id'], dict(row)) for row in rows]
+
+    def values(self):
+        return [row for key, row in self.items()]
@@ -0,0 +1,275 @@
+# tracing.py
+# Request tracing without an external collector. When TRACING_ENABLED is set,
+# each request gets a root span, and these children are recorded under it:
+#   cache.table / cache.query   reads of the cache snapshot and the query cache
+#   sql                         every statement executed on any engine
+#   serialize                   encoding the response body (serialization.py)
+#
+# Trace context follows W3C traceparent: a request carrying one joins the
+# caller's trace (the Dash ModelManager sends it) and by default keeps the
+# caller's sampling decision; otherwise the trace is head-sampled at
+# TRACING_SAMPLE_RATE. Unsampled requests have no current span, so every
+# instrumentation point is a context-variable read and nothing else.
+#
+# Finished spans go to TRACING_EXPORTER: 'jsonl' appends one JSON object per
+# span to TRACING_PATH (flushed when its trace's root span ends), 'memory'
+# keeps the most recent TRACING_MEMORY_SPANS spans for /admin/traces.
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACING_SAMPLE_RATE = 0.1
+TRACING_MEMORY_SPANS = 10000
+# Statements longer than this are cut in span attributes
+MAX_STATEMENT_LENGTH = 1000
+# Spans the file exporter buffers before writing even if no trace has ended
+FLUSH_SPANS = 1000
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current = ContextVar('trace_span', default=None)
+
+
+def _new_id(nbytes):
+    return f'{random.getrandbits(nbytes * 8):0{nbytes * 2}x}'
+
+
+class Span:
+    """One timed operation in a trace; use as a context manager or via start()/finish()."""
+
+    __slots__ = ('exporter', 'trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'status', 'root', 'start_time', '_started', 'duration', '_token')
+
+    def __init__(self, exporter, trace_id, parent_id, name, attributes=None, root=False):
+        self.exporter = exporter
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.status = 'ok'
+        # The first span of the trace in this process; finishing it flushes the exporter
+        self.root = root
+        self.duration = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def start(self):
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.status = 'error'
+            self.attributes['error'] = repr(error)
+        _current.reset(self._token)
+        self.exporter.export(self)
+        if self.root:
+            self.exporter.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start_time, 6),
+            'ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span outside a sampled trace."""
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+def span(name, attributes=None):
+    """Child span of the current one, or a no-op when the current request isn't traced."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.exporter, parent.trace_id, parent.span_id, name, attributes)
+
+
+def parse_traceparent(header):
+    """``(trace_id, parent_id, sampled)`` from a W3C traceparent header, or None if malformed."""
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def start_trace(exporter, name, traceparent=None, sample_rate=TRACING_SAMPLE_RATE, respect_parent=True):
+    """Started root span for a new or continued trace, or None if the trace isn't sampled."""
+    parent = parse_traceparent(traceparent)
+    if parent is not None and respect_parent:
+        sampled = parent[2]
+    else:
+        sampled = random.random() < sample_rate
+    if not sampled:
+        return None
+    if parent is None:
+        return Span(exporter, _new_id(16), None, name, root=True).start()
+    return Span(exporter, parent[0], parent[1], name, root=True).start()
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a JSON-lines file."""
+
+    def __init__(self, path, flush_spans=FLUSH_SPANS):
+        self.path = path
+        self.flush_spans = flush_spans
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, span):
+        with self._lock:
+            self._pending.append(span.to_dict())
+            full = len(self._pending) >= self.flush_spans
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                with open(self.path, 'a') as f:
+                    f.writelines(json.dumps(record, default=str) + '\n' for record in pending)
+
+
+class MemoryCollector:
+    """Keeps the most recent finished spans in process."""
+
+    def __init__(self, max_spans=TRACING_MEMORY_SPANS):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+    def flush(self):
+        pass
+
+    def traces(self, limit=20):
+        """The ``limit`` most recent traces, newest first, each with its spans in start order."""
+        by_trace = {}
+        for record in reversed(self.spans):
+            if record['trace_id'] not in by_trace:
+                if len(by_trace) == limit:
+                    continue
+                by_trace[record['trace_id']] = []
+            by_trace[record['trace_id']].append(record)
+        return [{'trace_id': trace_id, 'spans': sorted(spans, key=lambda record: record['start'])}
+                for trace_id, spans in by_trace.items()]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        sql_span = span('sql', {
+            'db.statement': statement[:MAX_STATEMENT_LENGTH],
+            'db.name': os.path.basename(conn.engine.url.database or ''),
+            'db.executemany': executemany
+        })
+        conn.info.setdefault('trace_spans', []).append(sql_span.start())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    if spans:
+        sql_span = spans.pop()
+        sql_span.set('db.rowcount', cursor.rowcount)
+        sql_span.finish()
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    spans = conn.info.get('trace_spans') if conn is not None else None
+    if spans:
+        spans.pop().finish(exception_context.original_exception)
+
+
+def _start_request_trace():
+    config = current_app.config
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    root = start_trace(
+        current_app.trace_exporter,
+        f'{request.method} {rule or request.path}',
+        request.headers.get('traceparent'),
+        config.get('TRACING_SAMPLE_RATE', TRACING_SAMPLE_RATE),
+        config.get('TRACING_RESPECT_PARENT', True)
+    )
+    if root is not None:
+        root.attributes.update({
+            'http.method': request.method,
+            'http.route': rule,
+            'http.target': request.full_path.rstrip('?'),
+            'flask.blueprint': request.blueprint
+        })
+        g.trace_root = root
+
+
+def _tag_response(response):
+    root = g.get('trace_root')
+    if root is not None:
+        root.set('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = root.trace_id
+    return response
+
+
+def _finish_request_trace(exc):
+    root = g.pop('trace_root', None)
+    if root is not None:
+        root.finish(exc)
+
+
+def init_tracing(app):
+    if not app.config.get('TRACING_ENABLED'):
+        return
+    if app.config.get('TRACING_EXPORTER', 'jsonl') == 'memory':
+        app.trace_exporter = MemoryCollector(app.config.get('TRACING_MEMORY_SPANS', TRACING_MEMORY_SPANS))
+    else:
+        app.trace_exporter = JsonLinesExporter(
+            app.config.get('TRACING_PATH') or os.path.join(app.instance_path, 'traces.jsonl'))
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_start_request_trace)
+    app.after_request(_tag_response)
+    app.teardown_request(_finish_request_trace)
@@ -0,0 +1,117 @@
+# traffic_capture.py
+# Records a sanitized log of the requests an app serves, for offline replay
+# with benchmarks/replay.py.
+#
+# Enabled by setting TRAFFIC_CAPTURE_PATH; TRAFFIC_CAPTURE_SAMPLE (0..1) keeps a
+# fraction of requests. Each record is one gzip'd JSON line:
+#   t  unix time the request arrived     m  method
+#   p  path                              r  matched URL rule, for grouping
+#   q  query args                        b  JSON body shape (see _sanitize)
+#   n  request body bytes                s  status code
+#   d  handler time in ms
+# Strings in query args and bodies are replaced by same-length placeholders;
+# numbers and booleans are kept so replays hit the same rows and filters.
+# Wall-clock arrival times keep one timeline across captures from several
+# workers merged into one file.
+import atexit
+import gzip
+import json
+import queue
+import random
+import threading
+import time
+
+from flask import current_app, g, request
+
+FLUSH_INTERVAL = 1.0
+
+
+class CaptureWriter:
+    """Appends records from a queue on a background thread so requests never wait on disk.
+
+    Every flush appends one complete gzip member, so a capture cut short by a
+    crash or kill is still readable up to the last flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name='traffic-capture', daemon=True).start()
+        atexit.register(self.flush)
+
+    def write(self, record):
+        self._queue.put(record)
+
+    def flush(self):
+        with self._lock:
+            lines = []
+            while True:
+                try:
+                    lines.append(json.dumps(self._queue.get_nowait(), separators=(',', ':')))
+                except queue.Empty:
+                    break
+            if lines:
+                with open(self.path, 'ab') as f:
+                    f.write(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+
+def _sanitize(value):
+    if isinstance(value, str):
+        return 'x' * len(value)
+    if isinstance(value, dict):
+        return {key: _sanitize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_sanitize(item) for item in value]
+    return value
+
+
+def _sanitize_arg(value):
+    return value if value.lstrip('-').isdigit() else 'x' * len(value)
+
+
+def _start_capture():
+    if random.random() < current_app.config.get('TRAFFIC_CAPTURE_SAMPLE', 1.0):
+        g.capture_arrived = time.time()
+        g.capture_started = time.perf_counter()
+
+
+def _finish_capture(response):
+    started = g.pop('capture_started', None)
+    if started is None:
+        return response
+    writer = current_app.capture_writer
+    body = request.get_json(silent=True) if request.content_length else None
+    writer.write({
+        't': round(g.pop('capture_arrived'), 4),
+        'm': request.method,
+        'p': request.path,
+        'r': request.url_rule.rule if request.url_rule is not None else None,
+        'q': {name: [_sanitize_arg(value) for value in values] for name, values in request.args.lists()},
+        'b': _sanitize(body) if body is not None else None,
+        'n': request.content_length or 0,
+        's': response.status_code,
+        'd': round((time.perf_counter() - started) * 1000, 3)
+    })
+    return response
+
+
+def init_capture(app):
+    path = app.config.get('TRAFFIC_CAPTURE_PATH')
+    if not path:
+        return
+    app.capture_writer = CaptureWriter(path)
+    app.before_request(_start_capture)
+    app.after_request(_finish_capture)
+
+
+def read_capture(path):
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
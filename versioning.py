@@ -0,0 +1,80 @@
+# versioning.py
+# Optimistic concurrency for the PUT routes. Every row carries a version that
+# each update bumps; it's served as the row's ETag, and a PUT with If-Match
+# only applies if the row is still at one of the listed versions. The check
+# and the write are a single UPDATE ... WHERE id = ? AND version IN (...)
+# RETURNING, so concurrent writers need no lock: the loser gets 412 and the
+# current ETag, and update_cache's version compare keeps the cache monotonic.
+from flask import current_app, jsonify, request
+from sqlalchemy import select, update
+
+from cache import row_lock, update_cache
+from database import db
+
+
+def row_etag(row):
+    return str(row['version']) if row and row.get('version') is not None else None
+
+
+def with_etag(body, row):
+    """Response for ``body`` carrying ``row``'s version as its ETag."""
+    response = jsonify(body)
+    etag = row_etag(row)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def if_match_versions():
+    """Versions accepted by the request's If-Match header; None means any (no header, or '*')."""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    # Tags that aren't versions can never match; an empty set fails the update
+    return {int(tag) for tag in if_match.as_set() if tag.isdigit()}
+
+
+def conditional_update(model, key, values, versions=None, commit=True):
+    """Apply ``values`` to row ``key`` if its version is in ``versions`` (any if None).
+
+    Returns ``(row, None)`` with the updated row, or ``(None, current_version)``
+    when nothing was updated; ``current_version`` is None if the row doesn't exist.
+    With ``commit=False`` the update is left in the session's transaction for
+    the caller to commit.
+    """
+    table = model.__table__
+    statement = update(table).where(table.c.id == key)
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+    statement = statement.values(**values, version=table.c.version + 1).returning(*table.c)
+    row = db.session.execute(statement).mappings().first()
+    if row is None:
+        if commit:
+            db.session.rollback()
+        return None, db.session.execute(select(table.c.version).where(table.c.id == key)).scalar()
+    row = dict(row)
+    if commit:
+        db.session.commit()
+    return row, None
+
+
+def versioned_put(model, cache_name, key, fields, label):
+    """Handle a PUT of ``fields`` to one row with If-Match semantics and refresh the cache."""
+    data = request.json
+    if not request.if_match and current_app.config.get('REQUIRE_IF_MATCH'):
+        return jsonify({'error': 'If-Match header required'}), 428
+    versions = if_match_versions()
+    values = {field: data[field] for field in fields if field in data}
+    # Commit and cache update under the row lock, so the verifier never sees the commit without the cache
+    with row_lock(cache_name, key):
+        row, current_version = conditional_update(model, key, values, versions)
+        if row is not None:
+            update_cache(cache_name, key, row)
+    if row is None:
+        if current_version is None:
+            return jsonify({'error': f'{label} not found'}), 404
+        response = with_etag({'error': f'{label} was modified', 'version': current_version},
+                             {'version': current_version})
+        response.status_code = 412
+        return response
+    return with_etag({'message': f'{label} updated', 'version': row['version']}, row)